@@ -0,0 +1,96 @@
+'''
+Bandwidth and server CPU per image frame, base64 JSON vs binary frames.
+
+    python -m benchmarks.binary_frames [--size 300000] [--clients 2]
+
+Relays a Temi `screenshot` through WebSocketServer to --clients /control
+clients, once as the JSON message the Temi app sends today and once as a
+binary frame to clients connected with ?binary=1. The payload is random
+bytes, as incompressible as a JPEG.
+'''
+import argparse
+import asyncio
+import base64
+import json
+import os
+import tempfile
+import time
+
+os.environ.setdefault('OPENAI_API_KEY', 'unused')
+
+import utils
+from binary_frames import pack_frame
+from client_connection import ClientConnection
+from websocket_server import WebSocketServer, PATH_CONTROL, PATH_TEMI
+
+
+class CountingWebSocket:
+    def __init__(self):
+        self.bytes_sent = 0
+
+    async def send_text(self, data):
+        self.bytes_sent += len(data.encode())
+
+    async def send_bytes(self, data):
+        self.bytes_sent += len(data)
+
+    async def close(self):
+        pass
+
+
+async def relay(binary, image, clients, frames):
+    server = WebSocketServer()
+    sockets = [CountingWebSocket() for _ in range(clients)]
+    for ws in sockets:
+        server.connections[PATH_CONTROL].add(
+            ClientConnection(ws, PATH_CONTROL, binary=binary))
+    clients_now = server.connections[PATH_CONTROL]
+
+    if binary:
+        inbound = pack_frame(
+            {'type': 'screenshot', 'content_type': 'image/jpeg'}, image)
+    else:
+        inbound = json.dumps({
+            'type': 'screenshot',
+            'data': base64.b64encode(image).decode()
+        })
+
+    cpu = 0.0
+    for _ in range(frames):
+        t0 = time.process_time()
+        if binary:
+            await server.binary_handler(PATH_TEMI, inbound)
+        else:
+            await server.temi_handler(None, inbound)
+        cpu += time.process_time() - t0
+        # writers run outside the timed section, as the socket I/O would
+        while any(c.stats()['queue_depth'] for c in clients_now):
+            await asyncio.sleep(0)
+    await asyncio.sleep(0.01)
+    await server.stop()
+
+    inbound_bytes = len(inbound) if binary else len(inbound.encode())
+    outbound_bytes = sum(ws.bytes_sent for ws in sockets) / frames
+    return inbound_bytes, outbound_bytes, cpu / frames
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=300000)
+    parser.add_argument('--clients', type=int, default=2)
+    parser.add_argument('--frames', type=int, default=200)
+    args = parser.parse_args()
+
+    utils.event_logger.log_file = os.path.join(tempfile.mkdtemp(), 'log.log')
+    image = os.urandom(args.size)
+    for name, binary in (('json', False), ('binary', True)):
+        inbound, outbound, cpu = asyncio.run(
+            relay(binary, image, args.clients, args.frames))
+        print(f'{name:>6}: in {inbound / 1e3:8.1f} KB, '
+              f'out {outbound / 1e3:8.1f} KB to {args.clients} clients, '
+              f'server CPU {cpu * 1e3:6.3f} ms/frame')
+    utils.event_logger.close()
+
+
+if __name__ == '__main__':
+    main()
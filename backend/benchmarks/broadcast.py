@@ -0,0 +1,104 @@
+'''
+Cost of relaying large image messages to a group of clients.
+
+    python -m benchmarks.broadcast [--clients 4] [--size 1000000]
+
+Compares the old send_message (str() of the whole message twice, then
+send_json -> json.dumps once per client) with the current one (preview
+plus a single encode shared by every client). Reports mean latency per
+relayed frame and peak traced allocations per frame.
+'''
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault('OPENAI_API_KEY', 'unused')
+
+import utils
+from client_connection import ClientConnection
+from websocket_server import WebSocketServer, PATH_CONTROL
+
+
+class FakeWebSocket:
+    '''
+    Stands in for starlette's WebSocket; sends go nowhere.
+    '''
+    async def send_json(self, data):
+        # what starlette does in send_json
+        await self.send_text(
+            json.dumps(data, separators=(',', ':'), ensure_ascii=False))
+
+    async def send_text(self, data):
+        pass
+
+    async def close(self):
+        pass
+
+
+async def legacy_send_message(sockets, group, message):
+    print_line = f'Sending message to {group}: {str(message)[:100]}'
+    utils.log_event('sent', group, str(message)[:100])
+    for connection in sockets:
+        await connection.send_json(message)
+    return print_line
+
+
+async def run(clients, size, frames):
+    server = WebSocketServer()
+    sockets = [FakeWebSocket() for _ in range(clients)]
+    payload = 'A' * size
+
+    results = {}
+    for name in ('legacy', 'current'):
+        if name == 'current':
+            for ws in sockets:
+                server.connections[PATH_CONTROL].add(
+                    ClientConnection(ws, PATH_CONTROL))
+
+        tracemalloc.start()
+        peaks = []
+        t0 = time.perf_counter()
+        for i in range(frames):
+            tracemalloc.reset_peak()
+            base, _ = tracemalloc.get_traced_memory()
+            message = {'type': 'screenshot', 'data': payload}
+            if name == 'legacy':
+                await legacy_send_message(sockets, PATH_CONTROL, message)
+            else:
+                await server.send_message(PATH_CONTROL, message)
+                # let every writer task send the frame
+                await asyncio.sleep(0)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - base)
+        elapsed = time.perf_counter() - t0
+        tracemalloc.stop()
+        results[name] = (elapsed / frames, max(peaks))
+    await server.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--size', type=int, default=1000000)
+    parser.add_argument('--frames', type=int, default=50)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    utils.event_logger.log_file = os.path.join(tmp_dir, 'log.log')
+    results = asyncio.run(run(args.clients, args.size, args.frames))
+    utils.event_logger.close()
+
+    print(f'{args.size} byte frames to {args.clients} clients, '
+          f'orjson={"yes" if utils.orjson else "no"}')
+    for name, (latency, peak) in results.items():
+        print(f'{name:>8}: {latency * 1000:8.2f} ms/frame, '
+              f'peak alloc {peak / 1e6:6.2f} MB/frame')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+'''
+Dispatch cost per message on /control and /participant.
+
+    python -m benchmarks.dispatch [--messages 200000]
+
+Runs a joystick-heavy command mix through the old if/elif ladder (same
+conditions, in the same order, as control_handler before the router)
+and through the Router. Sends are stubbed out so only parsing and
+dispatch are measured.
+'''
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+os.environ.setdefault('OPENAI_API_KEY', 'unused')
+
+from websocket_server import (
+    WebSocketServer, control_routes, participant_routes,
+    PATH_TEMI, PATH_PARTICIPANT, PATH_CONTROL
+)
+
+
+# (message, weight): what a teleop session on /control looks like
+CONTROL_MIX = [
+    ({'command': 'skidJoy', 'payload': '(0.5, 0)'}, 55),
+    ({'command': 'turnBy', 'payload': '10'}, 10),
+    ({'command': 'tiltBy', 'payload': '5'}, 8),
+    ({'command': 'stopMovement', 'payload': ''}, 5),
+    ({'command': 'zoom_status'}, 15),
+    ({'command': 'displayFace', 'payload': ''}, 4),
+    ({'command': 'identify', 'payload': 'webpage'}, 3),
+]
+
+
+async def noop_send(group, message):
+    pass
+
+
+async def noop_send_to(client, message):
+    # zoom_status answers only the sender; there is no client here
+    pass
+
+
+async def legacy_control(send, message):
+    msg_json = json.loads(message)
+    if 'command' not in msg_json:
+        return
+    command = msg_json['command']
+    if command == 'speak':
+        await send(PATH_TEMI, msg_json)
+    elif command == 'generate_response':
+        pass
+    elif command == 'displayMedia':
+        await send(PATH_TEMI, msg_json)
+    elif command == 'displayFace':
+        await send(PATH_TEMI, msg_json)
+    elif command == 'displayMode':
+        await send(PATH_TEMI, msg_json)
+        await send(PATH_PARTICIPANT, msg_json)
+    elif command == 'refreshScreenShot':
+        await send(PATH_TEMI, msg_json)
+    elif command in [
+            'skidJoy', 'takePicture',
+            'tiltBy', 'tiltAngle', 'stopMovement', 'turnBy',
+            'queryLocations', 'goTo']:
+        await send(PATH_TEMI, msg_json)
+    elif command == 'navigateCamera':
+        await send(PATH_TEMI, msg_json)
+    elif command == 'startVideo':
+        await send(PATH_TEMI, msg_json)
+    elif command == 'stopVideo':
+        await send(PATH_TEMI, msg_json)
+    elif command == 'changeMode':
+        await send(PATH_TEMI, msg_json)
+    elif command == 'allowCapture':
+        await send(PATH_PARTICIPANT, msg_json)
+    elif command == 'zoomToken':
+        await send(PATH_TEMI, msg_json)
+    elif command == 'video_call':
+        await send(PATH_TEMI, msg_json)
+    elif command == 'identify':
+        await send(PATH_CONTROL, {'type': 'initial_status'})
+    elif command == 'zoom_status':
+        await send(PATH_CONTROL, {'type': 'zoom_status'})
+
+
+def make_traffic(mix, n, seed=0):
+    rng = random.Random(seed)
+    messages = [json.dumps(m) for m, _ in mix]
+    weights = [w for _, w in mix]
+    return rng.choices(messages, weights=weights, k=n)
+
+
+async def run(n):
+    server = WebSocketServer()
+    server.send_message = noop_send
+    server.send_to = noop_send_to
+    server.send_urgent = noop_send
+    traffic = make_traffic(CONTROL_MIX, n)
+
+    t0 = time.perf_counter()
+    for message in traffic:
+        await legacy_control(noop_send, message)
+    legacy = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for message in traffic:
+        await control_routes.handle(server, None, message)
+    router = time.perf_counter() - t0
+
+    joystick = make_traffic(CONTROL_MIX[:1], n)
+    t0 = time.perf_counter()
+    for message in joystick:
+        await participant_routes.handle(server, None, message)
+    forward = time.perf_counter() - t0
+    return legacy, router, forward
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=200000)
+    args = parser.parse_args()
+
+    legacy, router, forward = asyncio.run(run(args.messages))
+    per = lambda total: total / args.messages * 1e6
+    print(f'if/elif ladder:        {per(legacy):6.2f} us/message')
+    print(f'router (with stats):   {per(router):6.2f} us/message')
+    print(f'router, skidJoy only:  {per(forward):6.2f} us/message')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+'''
+Per-event overhead of log_event, as seen by the caller.
+
+    python -m benchmarks.event_logger [--events 50000]
+
+Compares the old open/strftime/write/close per event against
+EventLogger.log, plus the time the writer thread needs to drain the
+queue once the caller is done.
+'''
+import argparse
+import os
+import tempfile
+import time
+
+from event_logger import EventLogger, skip_zoom_status_noise
+
+
+def legacy_log_event(log_file, direction, path, data):
+    # utils.log_event before it was backed by EventLogger
+    if (direction == 'received' and
+        path == '/control' and
+        'zoom_status' in data):
+        return
+
+    if (direction == 'sent' and
+        path == '/control' and
+        'zoom_status' in data and
+        "'call_duration': None" in data):
+        return
+
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+    with open(log_file, 'a') as f:
+        f.write(f"[{timestamp}][{direction}][{path}] {data}\n")
+
+
+def events(n):
+    sample = str({'command': 'skidJoy', 'payload': '(0.5, 0)'})[:100]
+    for i in range(n):
+        yield ('received' if i % 2 else 'sent',
+               '/participant' if i % 2 else '/temi', sample)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=50000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        legacy_file = os.path.join(tmp_dir, 'legacy.log')
+        t0 = time.perf_counter()
+        for direction, path, data in events(args.events):
+            legacy_log_event(legacy_file, direction, path, data)
+        legacy = time.perf_counter() - t0
+
+        logger = EventLogger(
+            os.path.join(tmp_dir, 'log.log'),
+            filters=[skip_zoom_status_noise])
+        t0 = time.perf_counter()
+        for direction, path, data in events(args.events):
+            logger.log(direction, path, data)
+        caller = time.perf_counter() - t0
+        logger.close()
+        drained = time.perf_counter() - t0
+
+        with open(logger.log_file) as f:
+            assert sum(1 for _ in f) == args.events
+
+    per = lambda total: total / args.events * 1e6
+    print(f'legacy log_event: {per(legacy):8.2f} us/event')
+    print(f'EventLogger.log:  {per(caller):8.2f} us/event (caller)')
+    print(f'                  {per(drained):8.2f} us/event (until on disk)')
+
+
+if __name__ == '__main__':
+    main()
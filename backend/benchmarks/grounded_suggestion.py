@@ -0,0 +1,141 @@
+'''
+Image-grounded suggestion latency, with and without the frame cache.
+
+    python -m benchmarks.grounded_suggestion [--requests 10] [--capture 1.5]
+
+Sends generate_response with an image through WebSocketServer, with a
+stubbed OpenAI client (first token after --ttft seconds) and a fake
+robot that streams a 1080p snapshot every --snapshot-every seconds and
+answers takePicture after --capture seconds. Once using cached frames
+up to FRAME_MAX_AGE old, once with every cached frame treated as
+stale, so each suggestion waits for the next frame to arrive.
+Reports time from the request to the full suggested_response.
+'''
+import argparse
+import asyncio
+import io
+import os
+import statistics
+import tempfile
+import time
+import types
+
+os.environ.setdefault('OPENAI_API_KEY', 'unused')
+
+import llm_model
+
+
+class StubStream:
+    def __init__(self, ttft):
+        self.ttft = ttft
+        self.words = ['I', 'can', 'see', 'the', 'garden', 'from', 'here!']
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.words:
+            raise StopAsyncIteration
+        await asyncio.sleep(self.ttft if self.ttft else 0.01)
+        self.ttft = 0
+        return types.SimpleNamespace(
+            usage=None,
+            choices=[types.SimpleNamespace(
+                delta=types.SimpleNamespace(content=self.words.pop(0) + ' '))])
+
+
+class StubClient:
+    '''
+    Just enough of AsyncOpenAI for llm_model; counts images it is sent.
+    '''
+
+    def __init__(self, ttft):
+        self.ttft = ttft
+        self.images = 0
+        self.chat = types.SimpleNamespace(
+            completions=types.SimpleNamespace(create=self.create))
+
+    async def create(self, messages, stream=False, **kwargs):
+        if not isinstance(messages[-1]['content'], str):
+            self.images += 1
+        return StubStream(self.ttft)
+
+
+def make_jpeg(i):
+    from PIL import Image
+
+    im = Image.new('RGB', (1920, 1080), ((i * 40) % 256, 120, 80))
+    out = io.BytesIO()
+    im.save(out, format='JPEG', quality=90)
+    return out.getvalue()
+
+
+async def run(args, use_cache):
+    from websocket_server import WebSocketServer, PATH_TEMI, PATH_CONTROL
+
+    client = StubClient(args.ttft)
+    llm_model.gpt_async_client = client
+    server = WebSocketServer()
+    if not use_cache:
+        server.frames.max_age = -1
+    frames = [make_jpeg(i) for i in range(8)]
+    done = {}
+    captures = 0
+
+    async def take_picture():
+        await asyncio.sleep(args.capture)
+        server.frames.add('picture', data=frames[captures % len(frames)])
+
+    async def send_message(path, msg):
+        nonlocal captures
+        if path == PATH_TEMI and msg.get('command') == 'takePicture':
+            captures += 1
+            asyncio.create_task(take_picture())
+        elif path == PATH_CONTROL and msg.get('type') == 'suggested_response':
+            done[msg['message_id']].set_result(time.perf_counter())
+
+    async def snapshots():
+        i = 0
+        while True:
+            server.frames.add('snapshot', data=frames[i % len(frames)])
+            i += 1
+            await asyncio.sleep(args.snapshot_every)
+
+    server.send_message = send_message
+    feed = asyncio.create_task(snapshots())
+    await asyncio.sleep(0.1)
+    latencies = []
+    for i in range(args.requests):
+        server.save_message({'role': 'user',
+                             'content': f'what do you see now? ({i})'})
+        message_id = len(server.messages) - 1
+        done[message_id] = asyncio.get_running_loop().create_future()
+        start = time.perf_counter()
+        await server.control_generate_response(None, {
+            'command': 'generate_response', 'payload': True})
+        latencies.append(await done[message_id] - start)
+        await asyncio.sleep(args.gap)
+    feed.cancel()
+    await server.stop()
+    return latencies, captures, client.images
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=10)
+    parser.add_argument('--capture', type=float, default=1.5)
+    parser.add_argument('--ttft', type=float, default=0.3)
+    parser.add_argument('--snapshot-every', type=float, default=2.0)
+    parser.add_argument('--gap', type=float, default=0.5)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    print(f'{"":>12} {"p50 ms":>8} {"max ms":>8} {"captures":>9} {"images":>7}')
+    for name, use_cache in (('no cache', False), ('frame cache', True)):
+        latencies, captures, images = asyncio.run(run(args, use_cache))
+        print(f'{name:>12} {statistics.median(latencies) * 1000:>8.0f}'
+              f' {max(latencies) * 1000:>8.0f} {captures:>9} {images:>7}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+'''
+Prompt size as the conversation grows, with a stubbed OpenAI client.
+
+    python -m benchmarks.llm_context [--messages 3000] [--every 250]
+
+Replays a long conversation through generate_response_stream, once
+sending the whole history (the old behaviour) and once through a
+ContextBuilder whose summaries come from the same stub. No network: the
+stub answers instantly and records the messages it was sent. Reports
+prompt tokens and time spent building the prompt at a few points.
+
+First checks that nothing falls between the summary and the verbatim
+tail when the budget is too small for KEEP_TURNS messages.
+'''
+import argparse
+import asyncio
+import os
+import time
+import types
+
+os.environ.setdefault('OPENAI_API_KEY', 'unused')
+
+import llm_model
+from llm_context import ContextBuilder, message_tokens
+
+
+class StubStream:
+    def __init__(self, text):
+        self.chunks = [types.SimpleNamespace(
+            usage=None,
+            choices=[types.SimpleNamespace(
+                delta=types.SimpleNamespace(content=text))])]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.chunks:
+            raise StopAsyncIteration
+        return self.chunks.pop()
+
+
+class StubClient:
+    '''
+    Just enough of AsyncOpenAI for llm_model.
+    '''
+
+    def __init__(self):
+        self.sent = []
+        self.chat = types.SimpleNamespace(
+            completions=types.SimpleNamespace(create=self.create))
+
+    async def create(self, messages, stream=False, **kwargs):
+        self.sent.append(messages)
+        if stream:
+            return StubStream('Sounds lovely, tell me more!')
+        # a summary call: keep the gist, bounded like the real one
+        text = messages[-1]['content'][-1200:]
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(
+            message=types.SimpleNamespace(content=text))])
+
+
+def make_message(i):
+    return {
+        'role': 'user' if i % 2 == 0 else 'assistant',
+        'content': f'Message {i}: grandma asked about the garden and the '
+                   f'soccer game on Saturday, and whether the dog got out again.'
+    }
+
+
+async def replay(total, every, context):
+    messages = []
+    points = []
+    for i in range(total):
+        messages.append(make_message(i))
+        if (i + 1) % every:
+            continue
+        start = time.perf_counter()
+        async for _ in llm_model.generate_response_stream(
+                messages, context=context):
+            pass
+        elapsed = time.perf_counter() - start
+        prompt = llm_model.gpt_async_client.sent[-1]
+        points.append((i + 1, sum(message_tokens(m) for m in prompt),
+                       elapsed))
+        # let a background fold run, as it would between utterances
+        await asyncio.sleep(0)
+    return points
+
+
+async def check_tight_budget():
+    # ~20 tokens per message: 300 fits about 15, fewer than keep_turns
+    context = ContextBuilder(llm_model.summarize_messages, budget=300)
+    messages = [make_message(i) for i in range(60)]
+    history = context.history(messages)
+    verbatim = len(history) - (1 if context.summary else 0)
+    assert verbatim < context.keep_turns, verbatim
+    await context._folding
+    # the messages before the verbatim tail are all in the summary now
+    start = len(messages) - 1 - verbatim
+    assert context.upto >= start, (context.upto, start)
+    print(f'tight budget: {verbatim} verbatim, summary covers '
+          f'{context.upto} of {len(messages) - 1}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=3000)
+    parser.add_argument('--every', type=int, default=250)
+    args = parser.parse_args()
+
+    llm_model.gpt_async_client = StubClient()
+    asyncio.run(check_tight_budget())
+
+    results = {}
+    for name in ('full history', 'bounded'):
+        llm_model.gpt_async_client = StubClient()
+        context = None
+        if name == 'bounded':
+            context = ContextBuilder(llm_model.summarize_messages)
+        results[name] = asyncio.run(replay(args.messages, args.every, context))
+        if context is not None:
+            print(f'bounded context: {context.stats()}')
+
+    print(f'{"messages":>9} {"full tokens":>12} {"bounded tokens":>15}'
+          f' {"full ms":>8} {"bounded ms":>11}')
+    for (n, full, t_full), (_, bounded, t_bounded) in zip(
+            results['full history'], results['bounded']):
+        print(f'{n:>9} {full:>12} {bounded:>15}'
+              f' {t_full * 1000:>8.2f} {t_bounded * 1000:>11.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+'''
+Load test with simulated Temi, wizard and participant clients.
+
+    python -m benchmarks.loadtest [--sessions 10] [--seconds 30]
+        [--json results.json] [--url http://127.0.0.1:8000]
+
+Without --url the app is started in-process (uvicorn on a free port, in
+a throwaway participant_data, with a stubbed LLM) and its event loop lag
+is sampled; with --url it runs against a server that is already up.
+In-process, clients and server share the GIL, so latencies run higher
+than against a separate server; compare runs of the same mode.
+
+Every session gets a /temi, a /control and a /participant socket, and
+they replay a realistic mix:
+
+    participant  joystick bursts: skidJoy at 20 Hz for 1 s, then stop,
+                 every --joystick-every s
+    control      zoom_status poll every 2.5 s
+    temi         base64 screenshot (--screenshot-kb) every second,
+                 asr_result every --asr-every s (suggested by the LLM)
+
+Messages carry their send time, and the receiving client reports relay
+latency per kind (zoom_status is a round trip, suggestion is asr_result
+to the final suggested_response). --json writes the results, with the
+config and git commit, for comparing runs across commits.
+'''
+import argparse
+import asyncio
+import base64
+import contextlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+
+from websockets.asyncio.client import connect
+
+from benchmarks.upload_relay import percentile
+
+os.environ.setdefault('OPENAI_API_KEY', 'unused')
+
+ZOOM_POLL = 2.5
+JOYSTICK_RATE = 20
+JOYSTICK_BURST = 1.0
+SCREENSHOT_EVERY = 1.0
+LAG_INTERVAL = 0.05
+
+
+class StubStream:
+    def __init__(self, delay):
+        self.delay = delay
+        self.words = 'Oh nice, and what did you do after that?'.split(' ')
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.words:
+            raise StopAsyncIteration
+        await asyncio.sleep(self.delay)
+        return types.SimpleNamespace(
+            usage=None,
+            choices=[types.SimpleNamespace(
+                delta=types.SimpleNamespace(content=self.words.pop(0) + ' '))])
+
+
+class StubClient:
+    '''
+    Just enough of AsyncOpenAI for llm_model: a few words, --llm-ms apart.
+    '''
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.chat = types.SimpleNamespace(
+            completions=types.SimpleNamespace(create=self.create))
+
+    async def create(self, messages, stream=False, **kwargs):
+        if stream:
+            return StubStream(self.delay)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(
+            message=types.SimpleNamespace(content='summary'))])
+
+
+class LagProbe:
+    '''
+    How late a sleep on the server's event loop wakes up.
+    '''
+
+    def __init__(self, interval=LAG_INTERVAL):
+        self.interval = interval
+        self.samples = []
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(loop.time() - start - self.interval)
+
+
+class InProcessServer:
+    '''
+    The app under uvicorn in a thread, with its own event loop.
+    '''
+
+    def __init__(self, llm_delay):
+        self.llm_delay = llm_delay
+        self.lag = LagProbe()
+        self.port = None
+        self._uvicorn = None
+        self._thread = None
+
+    def start(self):
+        os.chdir(tempfile.mkdtemp())
+        import uvicorn
+        import llm_model
+        import main
+
+        llm_model.gpt_async_client = StubClient(self.llm_delay)
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            self.port = s.getsockname()[1]
+        self._uvicorn = uvicorn.Server(uvicorn.Config(
+            main.app, host='127.0.0.1', port=self.port, log_level='warning'))
+
+        async def serve():
+            probe = asyncio.create_task(self.lag.run())
+            await self._uvicorn.serve()
+            probe.cancel()
+
+        self._thread = threading.Thread(
+            target=asyncio.run, args=(serve(),), daemon=True)
+        self._thread.start()
+        while not self._uvicorn.started:
+            time.sleep(0.05)
+        return f'http://127.0.0.1:{self.port}'
+
+    def stop(self):
+        self._uvicorn.should_exit = True
+        self._thread.join(timeout=10)
+
+
+class Results:
+    def __init__(self):
+        self.latencies = {}
+        self.sent = 0
+        self.received = 0
+
+    def add(self, kind, sent_at):
+        self.latencies.setdefault(kind, []).append(
+            time.perf_counter() - sent_at)
+
+
+async def session_clients(ws_base, session_id, args, results, stop):
+    path = lambda p: f'{ws_base}/{p}/{session_id}'
+    screenshot = base64.b64encode(
+        os.urandom(args.screenshot_kb * 1024)).decode('ascii')
+    # replies that don't echo `t` are matched to the last request
+    last_asr = None
+    last_poll = None
+
+    async with connect(path('temi'), max_size=None) as temi, \
+            connect(path('control'), max_size=None) as control, \
+            connect(path('participant'), max_size=None) as participant:
+
+        async def send(ws, message):
+            message['t'] = time.perf_counter()
+            await ws.send(json.dumps(message))
+            results.sent += 1
+
+        async def receive(ws):
+            nonlocal last_asr, last_poll
+            async for text in ws:
+                results.received += 1
+                msg = json.loads(text)
+                kind = msg.get('type') or msg.get('command')
+                if kind == 'suggested_response':
+                    if last_asr is not None:
+                        results.add('suggestion', last_asr)
+                        last_asr = None
+                elif kind == 'zoom_status':
+                    if last_poll is not None:
+                        results.add('zoom_status', last_poll)
+                        last_poll = None
+                elif 't' in msg:
+                    if kind == 'skidJoy':
+                        kind = 'joystick'
+                    results.add(kind, msg['t'])
+
+        async def joystick():
+            while True:
+                await asyncio.sleep(args.joystick_every)
+                for _ in range(int(JOYSTICK_RATE * JOYSTICK_BURST)):
+                    await send(participant, {
+                        'command': 'skidJoy', 'payload': '(0.5, 0)'})
+                    await asyncio.sleep(1 / JOYSTICK_RATE)
+                await send(participant, {'command': 'stopMovement'})
+
+        async def zoom_poll():
+            nonlocal last_poll
+            while True:
+                last_poll = time.perf_counter()
+                await send(control, {'command': 'zoom_status'})
+                await asyncio.sleep(ZOOM_POLL)
+
+        async def screenshots():
+            while True:
+                await send(temi, {'type': 'screenshot', 'data': screenshot})
+                await asyncio.sleep(SCREENSHOT_EVERY)
+
+        async def speech():
+            nonlocal last_asr
+            while True:
+                await asyncio.sleep(args.asr_every)
+                await send(temi, {
+                    'type': 'asr_result',
+                    'data': 'we went to the park and fed the ducks'})
+                last_asr = time.perf_counter()
+
+        tasks = [asyncio.create_task(c) for c in (
+            receive(temi), receive(control), receive(participant),
+            joystick(), zoom_poll(), screenshots(), speech())]
+        await stop.wait()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def run(ws_base, args):
+    results = Results()
+    stop = asyncio.Event()
+    prefix = f'load-{os.getpid()}'
+    clients = [asyncio.create_task(session_clients(
+        ws_base, f'{prefix}-{i}', args, results, stop))
+        for i in range(args.sessions)]
+    start = time.perf_counter()
+    await asyncio.sleep(args.seconds)
+    stop.set()
+    await asyncio.gather(*clients)
+    return results, time.perf_counter() - start
+
+
+def summarize(values):
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+        'max_ms': round(max(values) * 1000, 3),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', help='run against this server instead')
+    parser.add_argument('--sessions', type=int, default=10)
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--screenshot-kb', type=int, default=60)
+    parser.add_argument('--joystick-every', type=float, default=3)
+    parser.add_argument('--asr-every', type=float, default=4)
+    parser.add_argument('--llm-ms', type=float, default=50,
+                        help='stub LLM delay per word (in-process only)')
+    parser.add_argument('--json', help='write results here (- for stdout)')
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        # the server prints every message; keep that out of the report
+        if url is None:
+            server = InProcessServer(args.llm_ms / 1000)
+            url = server.start()
+        results, elapsed = asyncio.run(
+            run(url.replace('http', 'ws', 1), args))
+        if server is not None:
+            server.stop()
+
+    report = {
+        'commit': git_commit(),
+        'config': vars(args),
+        'duration_s': round(elapsed, 3),
+        'throughput': {
+            'sent_per_s': round(results.sent / elapsed, 1),
+            'received_per_s': round(results.received / elapsed, 1),
+        },
+        'latency': {kind: summarize(values)
+                    for kind, values in sorted(results.latencies.items())},
+        'loop_lag': summarize(server.lag.samples) if server else None,
+    }
+
+    print(f'{args.sessions} sessions for {elapsed:.1f} s against '
+          f'{args.url or "in-process app"}: '
+          f'{report["throughput"]["sent_per_s"]} msgs/s sent, '
+          f'{report["throughput"]["received_per_s"]} msgs/s received')
+    print(f'{"":>12} {"count":>7} {"p50 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+    rows = dict(report['latency'])
+    if report['loop_lag'] is not None:
+        rows['loop lag'] = report['loop_lag']
+    for kind, row in rows.items():
+        if not row['count']:
+            continue
+        print(f'{kind:>12} {row["count"]:>7} {row["p50_ms"]:>8.2f}'
+              f' {row["p99_ms"]:>8.2f} {row["max_ms"]:>8.2f}')
+
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
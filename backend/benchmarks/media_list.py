@@ -0,0 +1,116 @@
+'''
+/api/media-list latency with a large media index.
+
+    python -m benchmarks.media_list [--entries 50000] [--requests 200]
+
+Builds a throwaway participant_data with --entries shared media, then
+calls the app in-process (no network) and reports per-request latency
+for: the old handler (reread and split display_list.txt every time),
+the full list, one 50-item page from the middle, a filtered page, and a
+revalidation that comes back 304. Also reports how long the index takes
+to load at startup.
+'''
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+os.environ.setdefault('OPENAI_API_KEY', 'unused')
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def make_index(media_dir, entries):
+    now = time.time() - entries
+    with open(os.path.join(media_dir, 'media.jsonl'), 'w') as log, \
+            open(os.path.join(media_dir, 'display_list.txt'), 'w') as index:
+        for i in range(entries):
+            ext, mime = ('.mp4', 'video/mp4') if i % 4 == 0 else \
+                ('.jpg', 'image/jpeg')
+            name = f'capture_{i:06d}{ext}'
+            log.write(json.dumps({
+                'op': 'add', 'name': name, 'sha256': f'{i:064x}',
+                'original_name': name, 'mime': mime, 'size': 100000 + i,
+                'width': 1920, 'height': 1080, 'created_at': now + i,
+                'source': 'temi'}) + '\n')
+            log.write(json.dumps(
+                {'op': 'share', 'name': name, 'at': now + i}) + '\n')
+            index.write(f'{name}\n')
+    return now
+
+
+async def run(entries, requests):
+    import httpx
+    from fastapi.responses import JSONResponse
+
+    t0 = time.perf_counter()
+    import main
+    load_time = time.perf_counter() - t0
+
+    def legacy():
+        # the handler as it was: reread the text file on every request
+        try:
+            with open(main.sessions.default.media.index_file, 'r') as f:
+                lines = f.readlines()
+            media_files = [line.strip() for line in lines if line.strip()]
+        except FileNotFoundError:
+            media_files = []
+        return JSONResponse(content={'files': media_files}).body
+
+    results = {}
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        legacy()
+        samples.append(time.perf_counter() - start)
+    results['legacy full list'] = samples
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport,
+                                 base_url='http://bench') as client:
+        etag = (await client.get('/api/media-list')).headers['etag']
+        cases = {
+            'full list': ('/api/media-list', {}),
+            'page of 50': (f'/api/media-list?limit=50&cursor={entries // 2}', {}),
+            'videos, desc, 50': (
+                '/api/media-list?limit=50&type=video&order=desc', {}),
+            'unchanged (304)': ('/api/media-list',
+                                {'If-None-Match': etag}),
+        }
+        for name, (url, headers) in cases.items():
+            samples = []
+            for _ in range(requests):
+                start = time.perf_counter()
+                r = await client.get(url, headers=headers)
+                samples.append(time.perf_counter() - start)
+            assert r.status_code in (200, 304), r.status_code
+            results[name] = samples
+    return load_time, results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=int, default=50000)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.chdir(tmp)
+    os.makedirs('participant_data/media')
+    make_index('participant_data/media', args.entries)
+
+    load_time, results = asyncio.run(run(args.entries, args.requests))
+    print(f'{args.entries} shared media, app + index loaded in '
+          f'{load_time * 1000:.0f} ms')
+    for name, samples in results.items():
+        print(f'{name:>18}: p50 {percentile(samples, 0.5) * 1000:8.2f} ms, '
+              f'p99 {percentile(samples, 0.99) * 1000:8.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+'''
+/media-list and /view latency with thousands of files.
+
+    python -m benchmarks.media_pages [--files 5000] [--requests 100]
+
+Builds a throwaway participant_data with --files uploads and calls the
+app in-process. Reports the old f-string pages (rebuilt on every
+request, `items +=` per file) next to the templated ones: a re-render
+after one more upload, and cached hits.
+'''
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+os.environ.setdefault('OPENAI_API_KEY', 'unused')
+
+from benchmarks.media_list import make_index, percentile
+
+
+def legacy_list(files):
+    # list_media as it was, minus the listdir
+    items = ""
+    for file in sorted(files, reverse=True):
+        lower = file.lower()
+        if lower.endswith((".jpg", ".jpeg", ".png", ".gif")):
+            items += f"""
+                <div style="margin: 20px; text-align: center;">
+                    <img src="/media/{file}" style="max-width: 300px;"><br>
+                    <button onclick="displayMedia('{file}')">Display on Temi</button>
+                </div>
+            """
+        elif lower.endswith((".mp4", ".webm")):
+            items += f"""
+                <div style="margin: 20px; text-align: center;">
+                    <video src="/media/{file}" controls style="max-width: 300px;"></video><br>
+                    <button onclick="displayMedia('{file}')">Display on Temi</button>
+                </div>
+            """
+    return f"<html><body>{items}</body></html>"
+
+
+def legacy_view(filename):
+    file_url = f"/media/{filename}"
+    if filename.lower().endswith((".jpg", ".jpeg", ".png", ".gif")):
+        tag = f'<img src="{file_url}" style="max-width: 90%; max-height: 80vh;" />'
+    else:
+        tag = f"<p>Unsupported file type: {filename}</p>"
+    return f"<html><head><title>View Media: {filename}</title></head><body>{tag}</body></html>"
+
+
+async def run(requests):
+    import httpx
+    from fastapi.responses import HTMLResponse
+    import main
+
+    names = list(main.sessions.default.media.names)
+    # served the same way as the real routes, so only the page differs
+    @main.app.get('/legacy/media-list', response_class=HTMLResponse)
+    async def legacy_list_route():
+        return legacy_list(names)
+
+    @main.app.get('/legacy/view/{filename}', response_class=HTMLResponse)
+    async def legacy_view_route(filename: str):
+        return legacy_view(filename)
+
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport,
+                                 base_url='http://bench') as client:
+        async def get(url):
+            start = time.perf_counter()
+            r = await client.get(url)
+            assert r.status_code == 200, r.status_code
+            return time.perf_counter() - start
+
+        results['legacy /media-list'] = [
+            await get('/legacy/media-list') for _ in range(requests)]
+        results['legacy /view'] = [
+            await get(f'/legacy/view/{names[1]}') for _ in range(requests)]
+        first = []
+        for _ in range(max(1, requests // 10)):
+            # what an upload does to the cached page
+            main.sessions.default.media.version += 1
+            first.append(await get('/media-list'))
+        results['/media-list, re-render'] = first
+        results['/media-list, cached'] = [
+            await get('/media-list') for _ in range(requests)]
+        results['/view, cached'] = [
+            await get(f'/view/{names[1]}') for _ in range(requests)]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=100)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.chdir(tmp)
+    os.makedirs('participant_data/media')
+    make_index('participant_data/media', args.files)
+
+    results = asyncio.run(run(args.requests))
+    print(f'{args.files} files')
+    for name, samples in results.items():
+        print(f'{name:>24}: p50 {percentile(samples, 0.5) * 1000:8.2f} ms, '
+              f'p99 {percentile(samples, 0.99) * 1000:8.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
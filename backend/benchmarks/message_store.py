@@ -0,0 +1,102 @@
+'''
+Per-append cost of the conversation store as the history grows.
+
+    python -m benchmarks.message_store [--total 100000]
+
+Compares the old behaviour (rewrite messages.json with indent=4 on
+every message) against MessageStore.append, reporting the mean cost of
+an append measured at a few history sizes. The old approach is only run
+up to --legacy-max messages since it is quadratic overall.
+'''
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from message_store import MessageStore
+
+
+def make_message(i):
+    return {
+        'role': 'user' if i % 2 else 'assistant',
+        'content': f'message number {i}, about the length of a short utterance'
+    }
+
+
+def bench_legacy(path, total, checkpoints, window):
+    messages = []
+    results = {}
+    for i in range(total):
+        t0 = time.perf_counter()
+        messages.append(make_message(i))
+        with open(path, 'w') as f:
+            json.dump(messages, f, indent=4)
+        dt = time.perf_counter() - t0
+        results.setdefault(_bucket(i, checkpoints, window), []).append(dt)
+    return results
+
+
+async def bench_store(tmp_dir, total, checkpoints, window):
+    store = MessageStore(
+        os.path.join(tmp_dir, 'messages.json'),
+        os.path.join(tmp_dir, 'messages.jsonl'))
+    store.load()
+    results = {}
+    for i in range(total):
+        t0 = time.perf_counter()
+        store.append(make_message(i))
+        dt = time.perf_counter() - t0
+        results.setdefault(_bucket(i, checkpoints, window), []).append(dt)
+        if i % 1000 == 0:
+            # let the flusher run, as it would between real messages
+            await asyncio.sleep(0)
+    await store.close()
+
+    # startup cost of rebuilding from the journal
+    t0 = time.perf_counter()
+    reloaded = MessageStore(store.snapshot_file, store.journal_file)
+    reloaded.load()
+    load_time = time.perf_counter() - t0
+    assert len(reloaded.messages) == total
+    return results, load_time
+
+
+def _bucket(i, checkpoints, window):
+    for c in checkpoints:
+        if c - window <= i < c:
+            return c
+    return None
+
+
+def report(name, results):
+    for c in sorted(k for k in results if k is not None):
+        samples = results[c]
+        mean_us = sum(samples) / len(samples) * 1e6
+        print(f'{name:>8} @ {c:>7} messages: {mean_us:10.1f} us/append')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--total', type=int, default=100000)
+    parser.add_argument('--legacy-max', type=int, default=2000)
+    parser.add_argument('--window', type=int, default=200)
+    args = parser.parse_args()
+
+    checkpoints = [c for c in (1000, 5000, 10000, 50000, 100000)
+                   if c <= args.total]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        legacy = bench_legacy(
+            os.path.join(tmp_dir, 'legacy.json'), args.legacy_max,
+            [c for c in checkpoints if c <= args.legacy_max], args.window)
+        report('rewrite', legacy)
+
+        results, load_time = asyncio.run(
+            bench_store(tmp_dir, args.total, checkpoints, args.window))
+        report('journal', results)
+        print(f'reload of {args.total} messages: {load_time * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
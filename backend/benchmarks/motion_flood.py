@@ -0,0 +1,109 @@
+'''
+Teleop latency under a joystick flood, with a simulated robot.
+
+    python -m benchmarks.motion_flood [--rate 100] [--seconds 5] [--robot-ms 40]
+
+A fake /temi socket takes --robot-ms to accept each message (slow Wi-Fi
+plus the robot acting on it). skidJoy is sent at --rate Hz for
+--seconds, then stopMovement. Reports how old each command is when the
+robot gets it, and how long the stop takes, once with every command
+forwarded (the old behaviour) and once through the MotionChannel.
+'''
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+os.environ.setdefault('OPENAI_API_KEY', 'unused')
+
+import utils
+from client_connection import ClientConnection
+from websocket_server import WebSocketServer, participant_routes, PATH_TEMI
+
+
+class SimulatedRobot:
+    def __init__(self, delay):
+        self.delay = delay
+        self.received = []
+
+    async def send_text(self, data):
+        await asyncio.sleep(self.delay)
+        self.received.append((time.monotonic(), json.loads(data)))
+
+    async def close(self):
+        pass
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def flood(coalesce, rate, seconds, robot_delay):
+    server = WebSocketServer()
+    robot = SimulatedRobot(robot_delay)
+    # generous queue so the forwarding run shows the backlog, not drops
+    server.connections[PATH_TEMI].add(
+        ClientConnection(robot, PATH_TEMI, maxsize=100000))
+
+    async def submit(msg_json):
+        if coalesce:
+            await participant_routes.handle(
+                server, None, json.dumps(msg_json))
+        else:
+            await server.send_message(PATH_TEMI, msg_json)
+
+    sent_at = {}
+    interval = 1.0 / rate
+    start = time.monotonic()
+    for i in range(int(rate * seconds)):
+        sent_at[i] = time.monotonic()
+        await submit({'command': 'skidJoy', 'payload': '(0.5, 0)', 'seq': i})
+        await asyncio.sleep(max(0, start + (i + 1) * interval - time.monotonic()))
+
+    stop_at = time.monotonic()
+    await submit({'command': 'stopMovement', 'payload': ''})
+    while not any(m['command'] == 'stopMovement' for _, m in robot.received):
+        await asyncio.sleep(0.01)
+    stats = server.motion.stats()
+    await server.stop()
+
+    ages = [t - sent_at[m['seq']] for t, m in robot.received if 'seq' in m]
+    stop_latency = robot.received[-1][0] - stop_at
+    return {
+        'delivered': len(ages),
+        'p50_ms': percentile(ages, 0.5) * 1000,
+        'p99_ms': percentile(ages, 0.99) * 1000,
+        'max_ms': max(ages) * 1000,
+        'stop_ms': stop_latency * 1000,
+        'coalesced': stats['coalesced'] if coalesce else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rate', type=float, default=100)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--robot-ms', type=float, default=40)
+    args = parser.parse_args()
+
+    utils.event_logger.log_file = os.path.join(tempfile.mkdtemp(), 'log.log')
+    results = {}
+    for name, coalesce in (('forward', False), ('coalesce', True)):
+        results[name] = asyncio.run(
+            flood(coalesce, args.rate, args.seconds, args.robot_ms / 1000))
+    utils.event_logger.close()
+
+    print(f'{args.rate:.0f} Hz skidJoy for {args.seconds:.0f} s, '
+          f'robot takes {args.robot_ms:.0f} ms/command')
+    for name, r in results.items():
+        print(f'{name:>8}: delivered {r["delivered"]:5d} '
+              f'(coalesced {r["coalesced"]:5d}), command age '
+              f'p50 {r["p50_ms"]:7.1f} ms, p99 {r["p99_ms"]:7.1f} ms, '
+              f'max {r["max_ms"]:7.1f} ms; stop after {r["stop_ms"]:7.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
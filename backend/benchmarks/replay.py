@@ -0,0 +1,186 @@
+'''
+Replays a recorded session into WebSocketServer.
+
+    RECORD_TRAFFIC=1 uvicorn main:app ...   # during a study or a test run
+    python -m benchmarks.replay participant_data/recordings/<file>.jsonl
+        [--speed 1] [--llm-ms 50] [--json results.json]
+
+Sockets are opened and closed and inbound frames fed to the server as
+recorded, with fake websockets, a stubbed LLM and a throwaway data dir.
+--speed 1 keeps the recorded timing, 2 replays twice as fast and 0 as
+fast as possible. Reports time in `receive` per message kind, replay
+time, and outbound messages per path against the recording.
+Resumable clients get their hello, pings and resumes as recorded. Counts
+differ where output depends on the LLM or on timing: partial
+suggestions, heartbeat pings, and joystick commands, which the motion channel coalesces
+much more when replayed at --speed 0.
+'''
+import argparse
+import asyncio
+import collections
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('OPENAI_API_KEY', 'unused')
+# the replay itself isn't recorded
+os.environ['RECORD_TRAFFIC'] = '0'
+
+import llm_model
+from benchmarks.loadtest import StubClient, summarize
+from traffic_recorder import read_recording, OPEN, IN, OUT, CLOSE
+
+# after the last event, time for suggestions etc. to go out
+DRAIN = 1.0
+
+
+class FakeWebSocket:
+    def __init__(self, counts, path):
+        self.counts = counts
+        self.path = path
+
+    async def send_text(self, text):
+        self.counts[self.path] += 1
+
+    async def send_bytes(self, data):
+        self.counts[self.path] += 1
+
+    async def close(self, code=1000):
+        pass
+
+
+def kind_of(data):
+    if not isinstance(data, str):
+        return 'binary'
+    try:
+        msg = json.loads(data)
+        return str(msg.get('type') or msg.get('command'))
+    except (ValueError, AttributeError):
+        return 'invalid'
+
+
+def recorded_heartbeat(events):
+    # the interval the server pinged at, as told to clients in `hello`
+    for _, event, _, _, data in events:
+        if event == OUT and isinstance(data, str) and '"hello"' in data:
+            msg = json.loads(data)
+            if msg.get('type') == 'hello':
+                return msg['data']['heartbeat']
+    return None
+
+
+async def replay(events, speed):
+    from client_connection import ClientConnection
+    from websocket_server import WebSocketServer
+
+    server = WebSocketServer()
+    heartbeat = recorded_heartbeat(events)
+    if heartbeat is not None:
+        server.heartbeat.interval = heartbeat
+    clients = {}
+    # recorded resume token -> the one its replayed connection got
+    tokens = {}
+    recorded = collections.Counter()
+    replayed = collections.Counter()
+    latencies = collections.defaultdict(list)
+    # from the first event, not from when the server started recording
+    origin = events[0][0] if events else 0
+    start = time.perf_counter()
+    for t, event, conn_id, path, data in events:
+        if speed:
+            delay = start + (t - origin) / speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        else:
+            # let writer tasks and background work keep up
+            await asyncio.sleep(0)
+        if event == OUT:
+            recorded[path] += 1
+        elif event == OPEN:
+            resumable = 'token' in data
+            client = ClientConnection(
+                FakeWebSocket(replayed, path), path,
+                on_close=server.leave, binary=data.get('binary', False),
+                resumable=resumable)
+            server.join(client)
+            clients[conn_id] = client
+            if resumable:
+                # sends hello and, if the recorded client resumed, what
+                # it missed, like the live server did
+                token = data.get('resume')
+                await server.resume(client, tokens.get(token, token),
+                                    data.get('seq'))
+                tokens[data['token']] = client.token
+        elif event == CLOSE:
+            client = clients.pop(conn_id, None)
+            if client is not None:
+                client.close()
+        elif event == IN:
+            client = clients.get(conn_id)
+            if client is None:
+                continue
+            frame = ({'text': data} if isinstance(data, str)
+                     else {'bytes': data})
+            received = time.perf_counter()
+            await server.receive(client, frame)
+            latencies[kind_of(data)].append(time.perf_counter() - received)
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(DRAIN)
+    await server.stop()
+    return latencies, recorded, replayed, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('recording')
+    parser.add_argument('--speed', type=float, default=1,
+                        help='1 = recorded timing, 0 = as fast as possible')
+    parser.add_argument('--llm-ms', type=float, default=50,
+                        help='stub LLM delay per word')
+    parser.add_argument('--json', help='write results here (- for stdout)')
+    args = parser.parse_args()
+
+    header, events = read_recording(args.recording)
+    os.chdir(tempfile.mkdtemp())
+    llm_model.gpt_async_client = StubClient(args.llm_ms / 1000)
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        latencies, recorded, replayed, elapsed = asyncio.run(
+            replay(events, args.speed))
+
+    recorded_for = events[-1][0] - events[0][0] if events else 0
+    report = {
+        'recording': args.recording,
+        'session': header.get('session'),
+        'recorded_s': recorded_for,
+        'replayed_s': round(elapsed, 3),
+        'speed': args.speed,
+        'receive': {kind: summarize(values)
+                    for kind, values in sorted(latencies.items())},
+        'outbound': {path: {'recorded': recorded[path],
+                            'replayed': replayed[path]}
+                     for path in sorted(set(recorded) | set(replayed))},
+    }
+
+    print(f'{len(events)} events recorded over {recorded_for:.1f} s, '
+          f'replayed in {elapsed:.2f} s')
+    print(f'{"":>28} {"count":>7} {"p50 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+    for kind, row in report['receive'].items():
+        print(f'{kind:>28} {row["count"]:>7} {row["p50_ms"]:>8.3f}'
+              f' {row["p99_ms"]:>8.3f} {row["max_ms"]:>8.3f}')
+    print(f'{"outbound":>28} {"recorded":>8} {"replayed":>8}')
+    for path, row in report['outbound'].items():
+        print(f'{path:>28} {row["recorded"]:>8} {row["replayed"]:>8}')
+
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
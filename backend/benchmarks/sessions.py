@@ -0,0 +1,109 @@
+'''
+Relay latency with many robot/household sessions in one process.
+
+    uvicorn main:app --port 8000          # in another terminal
+    python -m benchmarks.sessions [--url http://127.0.0.1:8000]
+        [--sessions 1,10,50] [--rate 20] [--seconds 5]
+
+For each session count, every session is created with POST
+/sessions/<id> and gets a /temi/<id> socket (session from the path) and
+a /control socket that joins it with an identify handshake. Each robot sends saved_locations --rate times a second, which
+the server relays to its session's /control; the control socket times
+it. Reports p50/p99 relay latency per session count and any message
+that reached another session's dashboard (there should be none).
+'''
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import httpx
+from websockets.asyncio.client import connect
+
+from benchmarks.upload_relay import percentile
+
+
+async def run_session(ws_base, session_id, rate, seconds, ready, start):
+    latencies = []
+    leaked = 0
+    async with connect(f'{ws_base}/temi/{session_id}') as temi, \
+            connect(f'{ws_base}/control') as control:
+        await control.send(json.dumps({
+            'command': 'identify',
+            'payload': 'webpage',
+            'session': session_id
+        }))
+        ready.release()
+        await start.wait()
+
+        async def receive():
+            nonlocal leaked
+            while True:
+                msg = json.loads(await control.recv())
+                if msg.get('type') != 'saved_locations':
+                    continue
+                if msg['data']['session'] != session_id:
+                    leaked += 1
+                    continue
+                latencies.append(time.perf_counter() - msg['data']['t'])
+
+        receiver = asyncio.create_task(receive())
+        # robots aren't in lockstep
+        await asyncio.sleep(random.random() / rate)
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            await temi.send(json.dumps({
+                'type': 'saved_locations',
+                'data': {'session': session_id, 't': time.perf_counter()}
+            }))
+            await asyncio.sleep(1 / rate)
+        # let the last relays arrive
+        await asyncio.sleep(0.5)
+        receiver.cancel()
+    return latencies, leaked
+
+
+async def run(base, count, rate, seconds):
+    prefix = uuid.uuid4().hex[:8]
+    ws_base = base.replace('http', 'ws', 1)
+    # the robot can only join a session that exists
+    async with httpx.AsyncClient(base_url=base) as http:
+        for i in range(count):
+            response = await http.post(f'/sessions/bench-{prefix}-{i}')
+            response.raise_for_status()
+    ready = asyncio.Semaphore(0)
+    start = asyncio.Event()
+    tasks = [asyncio.create_task(run_session(
+        ws_base, f'bench-{prefix}-{i}', rate, seconds, ready, start))
+        for i in range(count)]
+    for _ in range(count):
+        await ready.acquire()
+    start.set()
+    results = await asyncio.gather(*tasks)
+    latencies = [x for session, _ in results for x in session]
+    leaked = sum(leaked for _, leaked in results)
+    return latencies, leaked
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--sessions', default='1,10,50')
+    parser.add_argument('--rate', type=float, default=20)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    print(f'{"sessions":>8} {"relayed":>8} {"p50 ms":>8} {"p99 ms":>8}'
+          f' {"leaked":>7}')
+    for count in (int(n) for n in args.sessions.split(',')):
+        latencies, leaked = asyncio.run(
+            run(args.url, count, args.rate, args.seconds))
+        print(f'{count:>8} {len(latencies):>8}'
+              f' {percentile(latencies, 0.5) * 1000:>8.2f}'
+              f' {percentile(latencies, 0.99) * 1000:>8.2f} {leaked:>7}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+'''
+Stale suggestions are cancelled, with a stubbed slow OpenAI client.
+
+    python -m benchmarks.suggestion_supersede [--utterances 5] [--gap 0.1]
+
+Feeds a burst of asr_results into WebSocketServer, `--gap` seconds
+apart, while the stub streams each completion word by word over ~1s.
+Reports how many API calls were started, how many ran to the end, and
+which message ids the wizard dashboard got suggestions for; only the
+last utterance should get one. A second round spaces the utterances out
+past the debounce window, so every call starts and the older ones have
+to be cancelled mid-stream.
+'''
+import argparse
+import asyncio
+import os
+import tempfile
+import types
+
+os.environ.setdefault('OPENAI_API_KEY', 'unused')
+
+import llm_model
+
+REPLY = 'That sounds like a lovely afternoon, what happened next?'
+
+
+class SlowStream:
+    def __init__(self, client, delay):
+        self.client = client
+        self.delay = delay
+        self.words = REPLY.split(' ')
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.words:
+            self.client.finished += 1
+            raise StopAsyncIteration
+        await asyncio.sleep(self.delay)
+        word = self.words.pop(0)
+        return types.SimpleNamespace(
+            usage=None,
+            choices=[types.SimpleNamespace(
+                delta=types.SimpleNamespace(content=word + ' '))])
+
+
+class SlowClient:
+    '''
+    Just enough of AsyncOpenAI for llm_model, streaming slowly.
+    '''
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.started = 0
+        self.finished = 0
+        self.chat = types.SimpleNamespace(
+            completions=types.SimpleNamespace(create=self.create))
+
+    async def create(self, messages, stream=False, **kwargs):
+        self.started += 1
+        return SlowStream(self, self.delay)
+
+
+async def burst(server, utterances, gap):
+    sent = []
+
+    async def send_message(path, msg):
+        if msg.get('type') == 'suggested_response':
+            sent.append(msg['message_id'])
+
+    server.send_message = send_message
+    for i in range(utterances):
+        await server.temi_asr_result(None, {
+            'type': 'asr_result',
+            'data': f'utterance {i} about the garden'
+        })
+        await asyncio.sleep(gap)
+    # let the last suggestion finish
+    await asyncio.sleep(server.suggestions.debounce + 2)
+    return sent
+
+
+async def run(utterances, gap, delay):
+    from websocket_server import WebSocketServer
+
+    client = SlowClient(delay)
+    llm_model.gpt_async_client = client
+    server = WebSocketServer()
+    start = len(server.messages)
+    sent = await burst(server, utterances, gap)
+    expected = start + utterances - 1
+    print(f'gap {gap * 1000:.0f} ms: {utterances} utterances, '
+          f'{client.started} API calls started, {client.finished} finished, '
+          f'suggestions delivered for {sent} (latest is {expected})')
+    print(f'  scheduler: {server.suggestions.stats()}')
+    print(f'  cache: {server.llm_cache.stats()}')
+    await server.stop()
+    return sent == [expected]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--utterances', type=int, default=5)
+    parser.add_argument('--gap', type=float, default=0.1)
+    parser.add_argument('--delay', type=float, default=0.1)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.chdir(tmp)
+    ok = True
+    # a burst inside the debounce window, then one spaced out past it
+    for gap in (args.gap, 0.6):
+        ok &= asyncio.run(run(args.utterances, gap, args.delay))
+    print('only the latest suggestion delivered' if ok else 'FAILED')
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
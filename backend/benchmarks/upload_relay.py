@@ -0,0 +1,125 @@
+'''
+Websocket relay latency while a large video is being uploaded.
+
+    uvicorn main:app --port 8000          # in another terminal
+    python -m benchmarks.upload_relay [--url http://127.0.0.1:8000]
+        [--mb 500] [--mode multipart|chunked] [--chunk-mb 8]
+
+A /control client sends zoom_status every 10 ms and times the reply
+while the file is posted to /upload (multipart) or to /uploads in
+--chunk-mb ranges (chunked). Round trips are reported idle and during
+the upload; with the copy done on the event loop they stall for as long
+as the file takes to write.
+'''
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import httpx
+from websockets.asyncio.client import connect
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def make_file(path, size_mb):
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(block)
+
+
+async def probe(ws_url, stop, interval=0.01):
+    samples = []
+    async with connect(ws_url) as ws:
+        while not stop.is_set():
+            start = time.perf_counter()
+            await ws.send(json.dumps({'command': 'zoom_status'}))
+            while True:
+                if json.loads(await ws.recv()).get('type') == 'zoom_status':
+                    break
+            samples.append(time.perf_counter() - start)
+            await asyncio.sleep(interval)
+    return samples
+
+
+async def upload_multipart(client, path):
+    with open(path, 'rb') as f:
+        r = await client.post('/upload', files={
+            'file': ('bench_upload.mp4', f, 'video/mp4')})
+    r.raise_for_status()
+
+
+async def upload_chunked(client, path, chunk_size):
+    size = os.path.getsize(path)
+    r = await client.post('/uploads', json={
+        'filename': 'bench_upload.mp4', 'size': size})
+    r.raise_for_status()
+    upload_id = r.json()['upload_id']
+    with open(path, 'rb') as f:
+        offset = 0
+        while offset < size:
+            data = f.read(chunk_size)
+            end = offset + len(data) - 1
+            r = await client.put(f'/uploads/{upload_id}', content=data,
+                                 headers={'Content-Range':
+                                          f'bytes {offset}-{end}/{size}'})
+            r.raise_for_status()
+            offset += len(data)
+
+
+async def run(url, path, mode, chunk_size):
+    ws_url = url.replace('http', 'ws', 1) + '/control'
+    stop = asyncio.Event()
+    idle_task = asyncio.create_task(probe(ws_url, stop))
+    await asyncio.sleep(2)
+    stop.set()
+    idle = await idle_task
+
+    stop = asyncio.Event()
+    busy_task = asyncio.create_task(probe(ws_url, stop))
+    async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+        start = time.perf_counter()
+        if mode == 'multipart':
+            await upload_multipart(client, path)
+        else:
+            await upload_chunked(client, path, chunk_size)
+        elapsed = time.perf_counter() - start
+    stop.set()
+    busy = await busy_task
+    return idle, busy, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--mb', type=int, default=500)
+    parser.add_argument('--mode', choices=['multipart', 'chunked'],
+                        default='multipart')
+    parser.add_argument('--chunk-mb', type=int, default=8)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, 'upload.bin')
+    make_file(path, args.mb)
+    try:
+        idle, busy, elapsed = asyncio.run(
+            run(args.url, path, args.mode, args.chunk_mb * 1024 * 1024))
+    finally:
+        os.remove(path)
+
+    print(f'{args.mb} MB {args.mode} upload took {elapsed:.1f} s')
+    for name, samples in (('idle', idle), ('uploading', busy)):
+        print(f'{name:>10}: {len(samples):5d} round trips, '
+              f'p50 {percentile(samples, 0.5) * 1000:7.1f} ms, '
+              f'p99 {percentile(samples, 0.99) * 1000:7.1f} ms, '
+              f'max {max(samples) * 1000:7.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
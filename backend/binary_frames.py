@@ -0,0 +1,52 @@
+'''
+Binary websocket frames for images.
+
+A frame is a 2-byte big-endian header length, a UTF-8 JSON header and
+the raw payload bytes:
+
+    | len (uint16) | {"type": "screenshot", "id": ..., "content_type": ...} | bytes |
+
+The server only ever reads the header; the payload is forwarded as-is.
+Clients that have not opted into binary frames (`?binary=1` on the
+websocket URL) get the JSON form they always did, with the payload as
+base64 in `data`.
+'''
+import base64
+import json
+import struct
+
+
+HEADER_LEN = struct.Struct('>H')
+
+
+def pack_frame(header, payload):
+    header_bytes = json.dumps(header, separators=(',', ':')).encode()
+    return HEADER_LEN.pack(len(header_bytes)) + header_bytes + payload
+
+
+def read_header(frame):
+    '''
+    Returns (header, payload_offset) without touching the payload.
+    Raises ValueError on a malformed frame.
+    '''
+    if len(frame) < HEADER_LEN.size:
+        raise ValueError('frame too short')
+    (length,) = HEADER_LEN.unpack_from(frame)
+    end = HEADER_LEN.size + length
+    if len(frame) < end:
+        raise ValueError('truncated header')
+    header = json.loads(bytes(frame[HEADER_LEN.size:end]))
+    if not isinstance(header, dict) or 'type' not in header:
+        raise ValueError('header has no type')
+    return header, end
+
+
+def frame_to_message(frame):
+    '''
+    JSON form of a binary frame, for clients that only speak JSON.
+    '''
+    header, offset = read_header(frame)
+    message = dict(header)
+    message['data'] = base64.b64encode(
+        memoryview(frame)[offset:]).decode('ascii')
+    return message
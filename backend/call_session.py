@@ -0,0 +1,147 @@
+import asyncio
+import collections
+import time
+
+
+IDLE = None
+RINGING = 'ringing'
+WAITING = 'waiting'
+CALLING = 'calling'
+CONNECTED = 'connected'
+
+# who an event comes from
+ROBOT = 'robot'
+PARTICIPANT = 'participant'
+WIZARD = 'wizard'
+ANY = '*'
+
+# (event, side) -> (robot, participant) after the event.
+# 'answer' depends on the other side and the behavior mode, see _answer.
+TRANSITIONS = {
+    ('proactive_call', WIZARD): (RINGING, RINGING),
+    ('start', ROBOT): (CALLING, RINGING),
+    ('start', PARTICIPANT): (RINGING, CALLING),
+    ('end', ANY): (IDLE, IDLE),
+    ('dismiss', ANY): (IDLE, IDLE),
+    ('timeout', ANY): (IDLE, IDLE),
+}
+
+# a call still being set up after this many seconds is dismissed
+RING_TIMEOUT = 60
+HISTORY_LEN = 1000
+
+Transition = collections.namedtuple('Transition', [
+    'at', 'event', 'side',
+    'prev_robot', 'prev_participant', 'robot', 'participant',
+    'duration',
+])
+
+
+class CallSession:
+    '''
+    State of the Zoom call between the robot and the participant.
+
+    Every event goes through `fire`, which applies TRANSITIONS, records a
+    timestamped Transition in `history` and calls `on_change`. The call
+    duration only exists once both sides were connected. While the call
+    is being set up (someone ringing, waiting or calling) an asyncio timer
+    fires a 'timeout' event after `ring_timeout` seconds; `on_timeout` is
+    called with that transition so the clients can be told.
+
+    No sockets involved, so it can be driven directly in tests.
+    '''
+
+    def __init__(self, on_change=None, on_timeout=None,
+                 ring_timeout=RING_TIMEOUT, clock=time.time):
+        self.on_change = on_change
+        self.on_timeout = on_timeout
+        self.ring_timeout = ring_timeout
+        self.clock = clock
+        self.robot = IDLE
+        self.participant = IDLE
+        self.connected_at = None
+        self.entered_at = clock()
+        self.history = collections.deque(maxlen=HISTORY_LEN)
+        self._timer = None
+
+    @property
+    def state(self):
+        return (self.robot, self.participant)
+
+    def duration(self):
+        if self.connected_at is None:
+            return None
+        return self.clock() - self.connected_at
+
+    def status(self):
+        return {
+            'participant': self.participant,
+            'robot': self.robot,
+            'call_duration': self.duration()
+        }
+
+    def fire(self, event, side, proactive=False):
+        '''
+        Applies `event` from `side` and returns the Transition.
+        Unknown events leave the state as it is.
+        '''
+        if event == 'answer':
+            target = self._answer(side, proactive)
+        else:
+            target = TRANSITIONS.get((event, side),
+                                     TRANSITIONS.get((event, ANY)))
+            if target is None:
+                target = self.state
+
+        now = self.clock()
+        duration = None
+        if self.connected_at is not None and target != (CONNECTED, CONNECTED):
+            duration = now - self.connected_at
+            self.connected_at = None
+        elif (target == (CONNECTED, CONNECTED) and
+              self.connected_at is None):
+            self.connected_at = now
+
+        transition = Transition(
+            now, event, side, self.robot, self.participant,
+            target[0], target[1], duration)
+        self.history.append(transition)
+        if target != self.state:
+            self.robot, self.participant = target
+            self.entered_at = now
+            self._rearm_timer()
+            if self.on_change is not None:
+                self.on_change(transition)
+        return transition
+
+    def _answer(self, side, proactive):
+        other = self.participant if side == ROBOT else self.robot
+        if proactive and other == RINGING:
+            # proactive mode: both sides have to pick up
+            if side == ROBOT:
+                return (WAITING, self.participant)
+            return (self.robot, WAITING)
+        return (CONNECTED, CONNECTED)
+
+    def _rearm_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self.state == (IDLE, IDLE) or CONNECTED in self.state:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._timer = loop.call_later(self.ring_timeout, self._ring_timeout)
+
+    def _ring_timeout(self):
+        self._timer = None
+        transition = self.fire('timeout', ANY)
+        if self.on_timeout is not None:
+            self.on_timeout(transition)
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
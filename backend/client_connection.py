@@ -0,0 +1,245 @@
+import asyncio
+import collections
+import itertools
+import secrets
+import time
+
+from metrics import SEND_SECONDS
+from motion_channel import MOTION_COMMANDS
+from traffic_recorder import OUT
+
+
+# what to do with a message when a client's outbound queue is full
+DROP_OLDEST = 'drop_oldest'
+NEVER_DROP = 'never_drop'
+
+# telemetry that is superseded by the next frame/update anyway;
+# everything else (commands, state changes) is never dropped
+OVERFLOW_POLICY = {
+    'screenshot': DROP_OLDEST,
+    'snapshot': DROP_OLDEST,
+    'zoom_status': DROP_OLDEST,
+    'suggested_response_partial': DROP_OLDEST,
+    'ping': DROP_OLDEST,
+}
+
+OUTBOUND_QUEUE_SIZE = 64
+# a client whose backlog of never-drop messages reaches this multiple of
+# the queue size is considered dead and evicted
+HARD_LIMIT_FACTOR = 4
+SEND_TIMEOUT = 10.0
+# smoothing for the average send latency
+LATENCY_EWMA = 0.1
+# never-drop messages kept per resumable client for a reconnect
+RESUME_BUFFER = 256
+
+_ids = itertools.count(1)
+
+
+def _key(message):
+    return message.get('type') or message.get('command')
+
+
+class ClientConnection:
+    '''
+    A websocket plus its own bounded outbound queue and writer task.
+
+    `enqueue` never waits on the network, so one slow client cannot hold
+    up delivery to the others or the handler that is sending. A client
+    whose send fails or times out is closed and `on_close` is called so
+    the server can forget about it.
+
+    A `resumable` client gets a `seq` in every JSON message, counted per
+    connection, and its last RESUME_BUFFER never-drop messages are kept.
+    When it reconnects, the new connection `take_over`s the old one and
+    sends what the client missed (see WebSocketServer.resume).
+    '''
+
+    def __init__(self, websocket, path, on_close=None, binary=False,
+                 maxsize=OUTBOUND_QUEUE_SIZE, overflow_policy=None,
+                 send_timeout=SEND_TIMEOUT, resumable=False,
+                 resume_buffer=RESUME_BUFFER):
+        self.id = next(_ids)
+        self.websocket = websocket
+        self.path = path
+        # whether the client takes binary image frames (see binary_frames)
+        self.binary = binary
+        self.on_close = on_close
+        self.maxsize = maxsize
+        self.overflow_policy = (
+            OVERFLOW_POLICY if overflow_policy is None else overflow_policy)
+        self.send_timeout = send_timeout
+        self.closed = False
+        # the WebSocketServer (robot/household) this socket belongs to
+        self.session = None
+        # its TrafficRecorder, when recording
+        self.recorder = None
+        # monotonic time of the last frame received from it
+        self.last_seen = time.monotonic()
+
+        self.resumable = resumable
+        # names this connection's numbering/buffer when resuming
+        self.token = secrets.token_urlsafe(12) if resumable else None
+        self.seq = 0
+        # (seq, text) of never-drop messages, for a resume
+        self.replay = collections.deque(maxlen=resume_buffer)
+        # newest seq that fell out of `replay`
+        self.trimmed = 0
+        self.closed_at = None
+
+        self.sent = 0
+        self.dropped = 0
+        self.last_latency = 0.0
+        self.avg_latency = 0.0
+        self.max_latency = 0.0
+
+        self._queue = collections.deque()
+        self._ready = asyncio.Event()
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def __repr__(self):
+        return (f'<ClientConnection #{self.id} {self.path} '
+                f'queued={len(self._queue)}>')
+
+    def policy_for(self, message):
+        return self.overflow_policy.get(_key(message), NEVER_DROP)
+
+    def enqueue(self, message, data, urgent=False):
+        '''
+        Queues `data`, the already-encoded `message`: text for JSON
+        messages, bytes for binary frames (`message` is then the header).
+        Returns False if the message was dropped.
+
+        An `urgent` message (stopMovement) goes to the front of the
+        queue, and motion commands still waiting behind it are dropped.
+
+        A closed resumable client still numbers and buffers messages
+        until it resumes or expires, but sends nothing.
+        '''
+        key = _key(message)
+        policy = self.overflow_policy.get(key, NEVER_DROP)
+        if self.resumable and isinstance(data, str):
+            data = self._number(data, policy)
+        if self.closed:
+            return False
+        if urgent:
+            self._drop_motion()
+            self._queue.appendleft((time.monotonic(), policy, key, data))
+            self._ready.set()
+            return True
+        if len(self._queue) >= self.maxsize and not self._drop_oldest():
+            if policy == DROP_OLDEST:
+                self.dropped += 1
+                return False
+            if len(self._queue) >= self.maxsize * HARD_LIMIT_FACTOR:
+                print(f'[ERROR][{self.path}] outbound queue overflow, '
+                      'evicting client')
+                self.close()
+                return False
+        self._queue.append((time.monotonic(), policy, key, data))
+        self._ready.set()
+        return True
+
+    def _number(self, text, policy):
+        # spliced into the shared encoding rather than re-encoding it,
+        # which only works for a JSON object
+        if not text.startswith('{'):
+            print(f'[ERROR][{self.path}] not a JSON object, sent without seq')
+            return text
+        self.seq += 1
+        rest = text[1:].lstrip()
+        sep = '' if rest.startswith('}') else ','
+        text = f'{{"seq":{self.seq}{sep}{rest}'
+        if policy == NEVER_DROP:
+            if len(self.replay) == self.replay.maxlen:
+                self.trimmed = self.replay[0][0]
+            self.replay.append((self.seq, text))
+        return text
+
+    def take_over(self, old, seq):
+        '''
+        Continues `old`'s numbering and buffer on this connection and
+        queues the buffered messages after `seq`, the last one the client
+        got. Returns how many, or None if some of them were trimmed
+        already (or `seq` is not one `old` sent).
+        '''
+        if not isinstance(seq, int) or not old.trimmed <= seq <= old.seq:
+            return None
+        self.token = old.token
+        self.seq = old.seq
+        self.replay = old.replay
+        self.trimmed = old.trimmed
+        now = time.monotonic()
+        missed = [(now, NEVER_DROP, None, text)
+                  for n, text in self.replay if n > seq]
+        self._queue.extend(missed)
+        self._ready.set()
+        return len(missed)
+
+    def _drop_oldest(self):
+        for i, (_, policy, _, _) in enumerate(self._queue):
+            if policy == DROP_OLDEST:
+                del self._queue[i]
+                self.dropped += 1
+                return True
+        return False
+
+    def _drop_motion(self):
+        before = len(self._queue)
+        self._queue = collections.deque(
+            item for item in self._queue if item[2] not in MOTION_COMMANDS)
+        self.dropped += before - len(self._queue)
+
+    async def _write_loop(self):
+        while True:
+            while not self._queue:
+                self._ready.clear()
+                await self._ready.wait()
+            queued_at, _, _, data = self._queue.popleft()
+            if isinstance(data, str):
+                send = self.websocket.send_text(data)
+            else:
+                send = self.websocket.send_bytes(data)
+            try:
+                await asyncio.wait_for(send, self.send_timeout)
+            except Exception as e:
+                print(f'[ERROR][{self.path}] send failed, evicting: {e!r}')
+                try:
+                    await self.websocket.close()
+                except Exception:
+                    pass
+                self.close()
+                return
+            self._record_latency(time.monotonic() - queued_at)
+            if self.recorder is not None:
+                self.recorder.record(OUT, self.id, self.path, data)
+
+    def _record_latency(self, latency):
+        self.sent += 1
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self.avg_latency += LATENCY_EWMA * (latency - self.avg_latency)
+        SEND_SECONDS.observe(latency, self.path)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.closed_at = time.monotonic()
+        self._queue.clear()
+        if self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        if self.on_close is not None:
+            self.on_close(self)
+
+    def stats(self):
+        return {
+            'id': self.id,
+            'seq': self.seq,
+            'queue_depth': len(self._queue),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'last_latency_ms': round(self.last_latency * 1000, 2),
+            'avg_latency_ms': round(self.avg_latency * 1000, 2),
+            'max_latency_ms': round(self.max_latency * 1000, 2),
+        }
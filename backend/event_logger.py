@@ -0,0 +1,174 @@
+import atexit
+import os
+import queue
+import threading
+import time
+
+
+# buffered lines are flushed to disk at least this often...
+FLUSH_INTERVAL = 1.0
+# ... or once this many bytes are buffered
+FLUSH_BYTES = 64 * 1024
+# start a new file once the current one passes this size
+MAX_BYTES = 50 * 1024 * 1024
+
+_STOP = object()
+
+
+def skip_zoom_status_noise(direction, path, data):
+    '''
+    The observer page polls zoom_status every few seconds; only log the
+    replies that carry an actual call duration.
+    '''
+    # /control, or /control/<session>
+    if path != '/control' and not path.startswith('/control/'):
+        return True
+    if (direction == 'received' and
+        'zoom_status' in data):
+        return False
+
+    if (direction == 'sent' and
+        'zoom_status' in data and
+        "'call_duration': None" in data):
+        return False
+    return True
+
+
+def skip_heartbeats(direction, path, data):
+    '''
+    Pongs come from every resumable client every few seconds.
+    '''
+    return not (direction == 'received' and '"pong"' in data)
+
+
+class EventLogger:
+    '''
+    Buffered replacement for opening log.log on every event.
+
+    `log` only runs the filters and puts the event on a queue; a writer
+    thread keeps the file open, formats and writes events in batches,
+    flushes on a size/time threshold and rotates the file by size and
+    by day. Rotated files get a `.YYYY-MM-DD[.N]` suffix.
+
+    Filters are callables `(direction, path, data) -> bool`; an event is
+    dropped as soon as one of them returns False.
+    '''
+
+    def __init__(self, log_file, filters=None,
+                 flush_interval=FLUSH_INTERVAL, flush_bytes=FLUSH_BYTES,
+                 max_bytes=MAX_BYTES):
+        self.log_file = log_file
+        self.filters = list(filters or [])
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.max_bytes = max_bytes
+        self.dropped = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def add_filter(self, fn):
+        self.filters.append(fn)
+        return fn
+
+    def log(self, direction, path, data):
+        for fn in self.filters:
+            if not fn(direction, path, data):
+                self.dropped += 1
+                return
+        if self._thread is None:
+            self._start()
+        self._queue.put((time.time(), direction, path, data))
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name='event-logger', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def close(self):
+        '''
+        Writes out everything queued so far and stops the writer.
+        '''
+        thread = self._thread
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join()
+        self._thread = None
+
+    def _open(self):
+        f = open(self.log_file, 'a')
+        day = time.strftime('%Y-%m-%d')
+        if f.tell() > 0:
+            # keep appending to today's file after a restart, but
+            # rotate yesterday's out of the way
+            mtime_day = time.strftime(
+                '%Y-%m-%d', time.localtime(os.path.getmtime(self.log_file)))
+            if mtime_day != day:
+                f.close()
+                self._rotate(mtime_day)
+                f = open(self.log_file, 'a')
+        return f, day
+
+    def _rotate(self, day):
+        target = f'{self.log_file}.{day}'
+        n = 1
+        while os.path.exists(target):
+            target = f'{self.log_file}.{day}.{n}'
+            n += 1
+        os.replace(self.log_file, target)
+
+    def _run(self):
+        f, day = self._open()
+        size = f.tell()
+        buffered = 0
+        last_flush = time.monotonic()
+        last_second = None
+        stamp = ''
+        stopping = False
+
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+
+            while item is not None:
+                if item is _STOP:
+                    stopping = True
+                    break
+                t, direction, path, data = item
+                second = int(t)
+                if second != last_second:
+                    last_second = second
+                    local = time.localtime(t)
+                    stamp = time.strftime('%Y-%m-%d %H:%M:%S', local)
+                    if stamp[:10] != day or size >= self.max_bytes:
+                        f.close()
+                        self._rotate(day)
+                        f = open(self.log_file, 'a')
+                        day, size = stamp[:10], 0
+                line = f'[{stamp}][{direction}][{path}] {data}\n'
+                f.write(line)
+                size += len(line)
+                buffered += len(line)
+                if buffered >= self.flush_bytes:
+                    f.flush()
+                    buffered = 0
+                    last_flush = time.monotonic()
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    item = None
+
+            now = time.monotonic()
+            if buffered and (stopping or
+                             now - last_flush >= self.flush_interval):
+                f.flush()
+                buffered = 0
+                last_flush = now
+        f.close()
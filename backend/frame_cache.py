@@ -0,0 +1,148 @@
+import asyncio
+import base64
+import collections
+import io
+import os
+import time
+
+
+# the robot's most recent camera frames kept in memory
+FRAME_CACHE_SIZE = 4
+# a frame older than this no longer shows what is in front of the robot
+FRAME_MAX_AGE = float(os.environ.get('FRAME_MAX_AGE', 10))
+# how long a suggestion waits for a takePicture to come back
+FRAME_WAIT = float(os.environ.get('FRAME_WAIT', 5))
+# what the model gets: longest side in pixels, JPEG quality
+MODEL_IMAGE_SIZE = 512
+MODEL_IMAGE_QUALITY = 80
+
+
+def encode_for_model(data=None, path=None):
+    '''
+    Runs in a worker thread: the frame (bytes, base64 text or a file)
+    downscaled and re-encoded as a JPEG data URL, the form the chat API
+    takes images in.
+    '''
+    from PIL import Image, ImageOps
+
+    if isinstance(data, str):
+        data = base64.b64decode(data)
+    with Image.open(path if data is None else io.BytesIO(data)) as im:
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail((MODEL_IMAGE_SIZE, MODEL_IMAGE_SIZE))
+        if im.mode != 'RGB':
+            im = im.convert('RGB')
+        out = io.BytesIO()
+        im.save(out, format='JPEG', quality=MODEL_IMAGE_QUALITY)
+    return 'data:image/jpeg;base64,' + base64.b64encode(
+        out.getvalue()).decode('ascii')
+
+
+class Frame:
+    __slots__ = ('source', 'at', 'data', 'path', 'encoding')
+
+    def __init__(self, source, at, data=None, path=None):
+        self.source = source
+        self.at = at
+        # as received, until it is encoded
+        self.data = data
+        self.path = path
+        # task resolving to the model's data URL (or None), once asked for
+        self.encoding = None
+
+
+class FrameCache:
+    '''
+    Ring buffer of the latest frames the robot sent (snapshots, camera
+    frames, pictures it uploaded), so a suggestion that should see the
+    room can use one instead of a capture round trip.
+
+    Frames are kept as received. Only a frame a suggestion actually
+    uses is decoded, downscaled and encoded for the model, in a worker
+    thread, once; at camera frame rates nothing else is spent on them.
+    When the newest frame is too old, `wait()` lets the caller ask for a
+    new one.
+    '''
+
+    def __init__(self, size=FRAME_CACHE_SIZE, max_age=FRAME_MAX_AGE,
+                 clock=time.monotonic):
+        self.max_age = max_age
+        self.clock = clock
+        self.frames = collections.deque(maxlen=size)
+        self.added = 0
+        self.hits = 0
+        self.stale = 0
+        self.encoded = 0
+        self.failed = 0
+        self._arrived = asyncio.Event()
+
+    def add(self, source, data=None, path=None):
+        '''
+        Keeps a frame given as bytes, base64 text or as the path of a
+        stored image.
+        '''
+        frame = Frame(source, self.clock(), data, path)
+        self.frames.append(frame)
+        self.added += 1
+        self._arrived.set()
+        self._arrived = asyncio.Event()
+        return frame
+
+    def latest(self, max_age=None):
+        '''
+        The newest frame, if it is at most `max_age` seconds old.
+        '''
+        if max_age is None:
+            max_age = self.max_age
+        if self.frames and self.clock() - self.frames[-1].at <= max_age:
+            self.hits += 1
+            return self.frames[-1]
+        self.stale += 1
+        return None
+
+    async def wait(self, timeout=FRAME_WAIT):
+        '''
+        The next frame to arrive, or None after `timeout` seconds.
+        '''
+        arrived = self._arrived
+        try:
+            await asyncio.wait_for(arrived.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return self.frames[-1]
+
+    async def _encode(self, frame):
+        try:
+            return await asyncio.to_thread(
+                encode_for_model, frame.data, frame.path)
+        except Exception as e:
+            print(f'[ERROR][FrameCache._encode]: {e}')
+            self.failed += 1
+            return None
+        finally:
+            frame.data = None
+
+    async def image(self, frame):
+        '''
+        The frame as a data URL for the model, or None if it would not
+        decode. Encoded on first use; later calls share the result.
+        '''
+        if frame.encoding is None:
+            frame.encoding = asyncio.ensure_future(self._encode(frame))
+            self.encoded += 1
+        # shielded: a cancelled suggestion must not cancel the encode
+        return await asyncio.shield(frame.encoding)
+
+    def stats(self):
+        newest = self.frames[-1] if self.frames else None
+        return {
+            'frames': len(self.frames),
+            'added': self.added,
+            'hits': self.hits,
+            'stale': self.stale,
+            'encoded': self.encoded,
+            'failed': self.failed,
+            'newest_source': newest.source if newest else None,
+            'newest_age': (round(self.clock() - newest.at, 3)
+                           if newest else None),
+        }
@@ -0,0 +1,91 @@
+import asyncio
+import os
+import time
+
+from utils import encode_message
+
+
+# clients that take part (connected with ?resume=...) are pinged this
+# often, and evicted after this long without sending anything
+HEARTBEAT_INTERVAL = float(os.environ.get('HEARTBEAT_INTERVAL', 5))
+HEARTBEAT_TIMEOUT = float(os.environ.get('HEARTBEAT_TIMEOUT', 15))
+# close code sent to an evicted client, if it is still there to get it
+EVICTED_CODE = 4000
+
+PING = {'type': 'ping'}
+
+
+class Heartbeat:
+    '''
+    Server-driven liveness for one session's clients.
+
+    Every `interval` each member gets a `ping`; it answers with `pong`
+    (`command` or `type`, like its other messages). Any message counts
+    as a sign of life, so a member that sent nothing for `timeout` is
+    evicted: closed and forgotten right away, instead of whenever a send
+    to it fails. Members are clients that opted in; others still rely on
+    uvicorn's protocol-level pings and failed sends.
+    '''
+
+    def __init__(self, interval=HEARTBEAT_INTERVAL, timeout=HEARTBEAT_TIMEOUT):
+        self.interval = interval
+        self.timeout = timeout
+        self.members = set()
+        self.pings = 0
+        self.evicted = 0
+        self._ticker = None
+        self._closing = set()
+
+    def add(self, client):
+        self.members.add(client)
+        if self._ticker is None or self._ticker.done():
+            self._ticker = asyncio.create_task(self._tick())
+
+    def discard(self, client):
+        self.members.discard(client)
+
+    async def _tick(self):
+        text = encode_message(PING)
+        while self.members:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            for client in list(self.members):
+                if client.closed:
+                    self.members.discard(client)
+                elif now - client.last_seen > self.timeout:
+                    self.evict(client)
+                else:
+                    client.enqueue(PING, text)
+                    self.pings += 1
+
+    def evict(self, client, reason=None):
+        if reason is None:
+            reason = (f'no heartbeat for '
+                      f'{time.monotonic() - client.last_seen:.1f} s')
+        print(f'[ERROR][{client.path}] {reason}, evicting')
+        self.evicted += 1
+        self.members.discard(client)
+        client.close()
+        # the close handshake may never finish with a dead peer; don't
+        # wait for it here
+        task = asyncio.create_task(self._close_socket(client))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _close_socket(self, client):
+        try:
+            await client.websocket.close(code=EVICTED_CODE)
+        except Exception:
+            pass
+
+    def stats(self):
+        return {
+            'members': len(self.members),
+            'pings': self.pings,
+            'evicted': self.evicted,
+        }
+
+    def close(self):
+        if self._ticker is not None:
+            self._ticker.cancel()
+            self._ticker = None
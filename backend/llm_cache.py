@@ -0,0 +1,160 @@
+import asyncio
+import collections
+import hashlib
+import json
+import time
+
+
+# a suggestion for the same conversation is reused for this long
+RESPONSE_CACHE_TTL = 300
+RESPONSE_CACHE_SIZE = 256
+
+
+def cache_key(*parts):
+    '''
+    Stable hash of anything JSON-serializable (messages, params, ...).
+    '''
+    data = json.dumps(parts, sort_keys=True, separators=(',', ':'),
+                      ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class SharedStream:
+    '''
+    One streaming completion read by any number of consumers. Pieces
+    are kept, so a consumer that joins late still gets all of it. If the
+    stream fails or is cancelled part way, readers get its exception or
+    CancelledError rather than the text so far passed off as the whole
+    answer.
+    '''
+
+    def __init__(self, source):
+        self.pieces = []
+        self.done = False
+        # False if the stream failed or was cancelled part way
+        self.complete = False
+        self.error = None
+        self.readers = 0
+        # set once the last reader left and the pump is being cancelled
+        self.cancelled = False
+        self._changed = asyncio.Event()
+        self.task = asyncio.create_task(self._pump(source))
+
+    async def _pump(self, source):
+        try:
+            async for piece in source:
+                self.pieces.append(piece)
+                self._changed.set()
+            self.complete = True
+        except Exception as e:
+            # raised to every reader instead
+            self.error = e
+        finally:
+            self.done = True
+            self._changed.set()
+
+    async def read(self):
+        self.readers += 1
+        try:
+            i = 0
+            while True:
+                while i < len(self.pieces):
+                    yield self.pieces[i]
+                    i += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    if not self.complete:
+                        raise asyncio.CancelledError('stream was cancelled')
+                    return
+                self._changed.clear()
+                await self._changed.wait()
+        finally:
+            self.readers -= 1
+            if self.readers == 0 and not self.done:
+                # nobody wants it any more: stop paying for it
+                self.cancelled = True
+                self.task.cancel()
+
+    def text(self):
+        return ''.join(self.pieces)
+
+
+class ResponseCache:
+    '''
+    Local cache of LLM suggestions, keyed by a hash of everything that
+    decides the answer (the messages sent, image, model parameters).
+
+    A hit replays the cached text; a request identical to one still
+    streaming joins that stream instead of making a second API call, and
+    the call is cancelled once every request reading it was.
+    Entries expire after `ttl` seconds, and only the newest `maxsize`
+    are kept.
+    '''
+
+    def __init__(self, ttl=RESPONSE_CACHE_TTL, maxsize=RESPONSE_CACHE_SIZE,
+                 clock=time.monotonic):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.clock = clock
+        self.entries = collections.OrderedDict()
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, text = entry
+        if expires < self.clock():
+            del self.entries[key]
+            return None
+        return text
+
+    def put(self, key, text):
+        self.entries[key] = (self.clock() + self.ttl, text)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    async def stream(self, key, make_stream):
+        '''
+        Yields the response for `key`: from the cache, from a matching
+        request in flight, or from a new `make_stream()` async generator.
+        '''
+        text = self.get(key)
+        if text is not None:
+            self.hits += 1
+            yield text
+            return
+
+        shared = self.inflight.get(key)
+        if shared is not None and not shared.cancelled:
+            self.shared += 1
+        else:
+            self.misses += 1
+            shared = SharedStream(make_stream())
+            self.inflight[key] = shared
+            shared.task.add_done_callback(
+                lambda _: self._finish(key, shared))
+        async for piece in shared.read():
+            yield piece
+
+    def _finish(self, key, shared):
+        if self.inflight.get(key) is shared:
+            del self.inflight[key]
+        if shared.complete and shared.text():
+            self.put(key, shared.text())
+
+    def stats(self):
+        requests = self.hits + self.shared + self.misses
+        return {
+            'hits': self.hits,
+            'shared': self.shared,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.shared) / requests if requests else 0,
+            'entries': len(self.entries),
+            'inflight': len(self.inflight),
+        }
@@ -0,0 +1,217 @@
+import asyncio
+import json
+import os
+import re
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+TOKEN_ENCODING = 'o200k_base'
+# chat formatting overhead per message
+MESSAGE_OVERHEAD = 4
+# the latest this many messages are always sent verbatim ...
+KEEP_TURNS = 20
+# ... and once this many more have piled up, the older ones are folded
+# into the summary in one go, so it isn't recomputed on every message
+FOLD_EVERY = 10
+# token budget for summary + verbatim history (prompt and system excluded)
+CONTEXT_BUDGET = 4000
+# transcript fed to a single summarize call
+FOLD_CHUNK_TOKENS = 6000
+SUMMARY_PREFIX = 'Summary of the earlier conversation:\n'
+
+_WORD_RE = re.compile(r'\w+|[^\w\s]')
+_encoding = None
+
+
+def count_tokens(text):
+    '''
+    Tokens in `text`, counted locally. Uses tiktoken when it is installed
+    and its encoding is available offline; otherwise a word/punctuation
+    estimate that runs a little high for English.
+    '''
+    global _encoding, tiktoken
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception as e:
+            print(f'[ERROR][count_tokens]: {e}, estimating instead')
+            tiktoken = None
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return max(len(_WORD_RE.findall(text)), len(text) // 4)
+
+
+def message_tokens(message):
+    content = message.get('content') or ''
+    if not isinstance(content, str):
+        content = ' '.join(part.get('text', '') for part in content
+                           if isinstance(part, dict))
+    return count_tokens(content) + MESSAGE_OVERHEAD
+
+
+class ContextBuilder:
+    '''
+    Keeps the conversation sent to the LLM bounded.
+
+    The newest messages go in verbatim, as many as fit the token budget
+    (at most KEEP_TURNS + FOLD_EVERY); everything older is represented by
+    a rolling summary. Once the verbatim part grows past that, or the
+    budget cuts into it, the messages falling out of it are folded into the summary by
+    `summarize(previous_summary, messages)` in the background, and the
+    result is saved to `summary_file` so a restart doesn't redo weeks of
+    history. Suggestions never wait for a summary.
+
+    Token counts are cached per message position (the history is
+    append-only), and every prompt's size is kept for /status.
+    '''
+
+    def __init__(self, summarize, summary_file=None, keep_turns=KEEP_TURNS,
+                 fold_every=FOLD_EVERY, budget=CONTEXT_BUDGET):
+        self.summarize = summarize
+        self.summary_file = summary_file
+        self.keep_turns = keep_turns
+        self.fold_every = fold_every
+        self.budget = budget
+        self.summary = ''
+        # messages before this index are covered by the summary
+        self.upto = 0
+        self.folds = 0
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.max_prompt_tokens = 0
+        self.total_prompt_tokens = 0
+        self.usage_prompt_tokens = None
+        self._counts = []
+        self._summary_tokens = 0
+        self._folding = None
+
+    def load(self):
+        if self.summary_file is None:
+            return self
+        try:
+            with open(self.summary_file, 'r') as f:
+                saved = json.load(f)
+            self.summary = saved['summary']
+            self.upto = saved['upto']
+            self._summary_tokens = count_tokens(self.summary)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f'[ERROR][ContextBuilder.load]: {e}')
+        return self
+
+    def _save(self):
+        tmp = self.summary_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'summary': self.summary, 'upto': self.upto}, f)
+        os.replace(tmp, self.summary_file)
+
+    def _count(self, past):
+        counts = self._counts
+        if len(counts) > len(past):
+            # history was replaced underneath us
+            del counts[:]
+        for message in past[len(counts):]:
+            counts.append(message_tokens(message))
+        if self.upto > len(past):
+            self.summary, self.upto, self._summary_tokens = '', 0, 0
+
+    def history(self, all_messages):
+        '''
+        What to send before the final prompt in place of
+        all_messages[:-1]: the summary (if any) and the verbatim tail.
+        '''
+        past = all_messages[:-1]
+        self._count(past)
+        counts = self._counts
+
+        budget = self.budget - self._summary_tokens
+        limit = max(self.upto, len(past) - self.keep_turns - self.fold_every)
+        start = len(past)
+        used = 0
+        while start > limit and used + counts[start - 1] <= budget:
+            start -= 1
+            used += counts[start]
+        if start > self.upto + self.fold_every or \
+                len(past) - self.upto > self.keep_turns + self.fold_every:
+            self._start_fold(past, start)
+
+        history = []
+        if self.summary:
+            history.append({
+                'role': 'system',
+                'content': SUMMARY_PREFIX + self.summary
+            })
+        return history + past[start:]
+
+    def _start_fold(self, past, start):
+        if self._folding is not None and not self._folding.done():
+            return
+        try:
+            self._folding = asyncio.get_running_loop().create_task(
+                self._fold(list(past), start))
+        except RuntimeError:
+            pass
+
+    async def _fold(self, past, start):
+        # everything that isn't sent verbatim, which is less than
+        # keep_turns when those don't fit the budget
+        target = max(len(past) - self.keep_turns, start)
+        while self.upto < target:
+            end = self.upto
+            size = 0
+            while end < target and (end == self.upto or
+                                    size + self._counts[end] <= FOLD_CHUNK_TOKENS):
+                size += self._counts[end]
+                end += 1
+            try:
+                summary = await self.summarize(self.summary, past[self.upto:end])
+            except Exception as e:
+                print(f'[ERROR][ContextBuilder._fold]: {e}')
+                return
+            if not summary:
+                return
+            self.summary = summary.strip()
+            self._summary_tokens = count_tokens(self.summary)
+            self.upto = end
+            self.folds += 1
+            if self.summary_file is not None:
+                await asyncio.to_thread(self._save)
+
+    def record_prompt(self, messages):
+        '''
+        Counts a prompt about to be sent; returns its size in tokens.
+        '''
+        tokens = sum(message_tokens(m) for m in messages)
+        self.calls += 1
+        self.prompt_tokens = tokens
+        self.total_prompt_tokens += tokens
+        self.max_prompt_tokens = max(self.max_prompt_tokens, tokens)
+        return tokens
+
+    def record_usage(self, prompt_tokens):
+        # what the API billed for the last prompt, when it reports usage
+        self.usage_prompt_tokens = prompt_tokens
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'prompt_tokens': self.prompt_tokens,
+            'avg_prompt_tokens': (self.total_prompt_tokens / self.calls
+                                  if self.calls else 0),
+            'max_prompt_tokens': self.max_prompt_tokens,
+            'usage_prompt_tokens': self.usage_prompt_tokens,
+            'summary_tokens': self._summary_tokens,
+            'summarized_messages': self.upto,
+            'folds': self.folds,
+            'tokenizer': 'tiktoken' if _encoding is not None else 'estimate',
+        }
+
+    def close(self):
+        if self._folding is not None:
+            self._folding.cancel()
+            self._folding = None
@@ -1,10 +1,20 @@
 import os
+import time
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+from llm_cache import cache_key
+from frame_cache import encode_for_model
+from metrics import (
+    LLM_CALL_SECONDS, LLM_FIRST_TOKEN_SECONDS, LLM_PROMPT_TOKENS, LLM_TOKENS
+)
 
 load_dotenv()
 
 gpt_client = OpenAI()
+# streaming client used by the websocket server so the event loop never
+# blocks on a completion. Honours OPENAI_BASE_URL, so it can be pointed
+# at any OpenAI-compatible server (e.g. a local fake for testing).
+gpt_async_client = AsyncOpenAI()
 
 
 OPENAI_GPT_MODEL="gpt-4.1-mini-2025-04-14"
@@ -16,15 +26,24 @@ if not FAMILY_INFO_STR:
     print('FAMILY_INFO_STR is not provided!')
 
 
-MAIN_PROMPT = '''
+SYSTEM_PROMPT = '''
+You are a helpful agent controlling a domestic social robot,
+and your goal is to promote family-connection making.
+The transcriptions you are provided with may be from various people within the family.
+'''
+
+
+ROLE_PROMPT = '''
 **YOUR ROLE**
 You are a friendly, conversational social robot that can chat with the family and answer questions.
 
 
 The family info:
 {FAMILY_INFO}
+'''
 
 
+MAIN_PROMPT = '''
 The latest USER input is: {COMMAND}.
 
 
@@ -35,27 +54,36 @@ In plain text, what is your response?
 '''.strip() + '\n\n\n'
 
 
-
-
-
-
-SYSTEM_PROMPT = '''
-You are a helpful agent controlling a domestic social robot,
-and your goal is to promote family-connection making.
-The transcriptions you are provided with may be from various people within the family.
+# Everything that never changes goes first, in one system message, so
+# the provider can cache the prompt prefix; only the summary, history
+# and the latest input come after it.
+SYSTEM_MESSAGE = {
+    'role': 'system',
+    'content': SYSTEM_PROMPT + ROLE_PROMPT.format(FAMILY_INFO=FAMILY_INFO_STR)
+}
+
+GENERATION_PARAMS = {
+    'model': OPENAI_GPT_MODEL,
+    'max_completion_tokens': 256,
+    'stop': "\n\n\n",
+    'temperature': 0.2,
+    'top_p': 1,
+    'n': 1,
+}
+
+
+SUMMARY_PROMPT = '''
+You keep a running summary of a conversation between a family and their social robot.
+Update the summary with the new part of the transcript. Keep names, facts about
+family members, plans, preferences and open questions; drop small talk.
+Answer with the updated summary only, in at most {MAX_WORDS} words.
 '''
+SUMMARY_MAX_TOKENS = 400
 
 
-def generate_response(all_messages, img_path=None):
-    
-    msg_sys = {
-        'role': 'system',
-        'content': SYSTEM_PROMPT
-    }
-    
+def _build_messages(all_messages, img_path=None, history=None):
     if img_path is None:
         prompt = MAIN_PROMPT.format(
-            FAMILY_INFO=FAMILY_INFO_STR,
             COMMAND=all_messages[-1]['content'],
             IMAGE_PROMPT=''
         )
@@ -65,40 +93,33 @@ def generate_response(all_messages, img_path=None):
         }
     else:
         prompt = MAIN_PROMPT.format(
-            FAMILY_INFO=FAMILY_INFO_STR,
             COMMAND=all_messages[-1]['content'],
             IMAGE_PROMPT='You are also provided with the picture of the view in front of you.'
         )
+        # a data URL from the frame cache, or an image file to encode
+        if not img_path.startswith('data:'):
+            img_path = encode_for_model(path=img_path)
         msg_last = {
             'role': 'user',
-            'content': prompt
-        }
-        # TODO
-        msg_last = {
-            'role': 'user',
-            "content": [
-                {"type": "text", "text": prompt},
-                {
-                    "type":"file",
-                    "file":{
-                        "file_data":"data:application/pdf;base64,JVBERi0xLjUNJeLjz9MN...",
-                        "filename":"competion-sidebar.pdf"
-                    }
-                }
-            ],
+            'content': [
+                {'type': 'text', 'text': prompt},
+                {'type': 'image_url', 'image_url': {'url': img_path}}
+            ]
         }
 
-    messages = [msg_sys] + all_messages[:-1] + [msg_last]
+    if history is None:
+        history = all_messages[:-1]
+    messages = [SYSTEM_MESSAGE] + history + [msg_last]
+    return messages
+
+
+def generate_response(all_messages, img_path=None):
+    messages = _build_messages(all_messages, img_path)
     res = ''
     try:
         ans = gpt_client.chat.completions.create(
-            model=OPENAI_GPT_MODEL,
-            max_completion_tokens=256,
-            stop="\n\n\n",
             messages=messages,
-            temperature=0.2,
-            top_p=1,
-            n=1,
+            **GENERATION_PARAMS
         )
 
         res = ans.choices[0].message.content
@@ -107,3 +128,101 @@ def generate_response(all_messages, img_path=None):
         print(f'[ERROR][generate_response]: {e}')
     return res
 
+
+async def generate_response_stream(all_messages, img_path=None, context=None,
+                                   cache=None):
+    '''
+    Async generator version of generate_response.
+    Yields the completion text piece by piece as it is streamed back,
+    and raises if the API call fails part way.
+    With a ContextBuilder as `context`, older history is replaced by its
+    rolling summary and the prompt size is recorded there. With a
+    ResponseCache as `cache`, a recent answer to the very same prompt is
+    replayed, and identical requests in flight share one API call.
+    '''
+    history = None if context is None else context.history(all_messages)
+    messages = _build_messages(all_messages, img_path, history)
+    if cache is None:
+        async for delta in _stream_completion(messages, context):
+            yield delta
+        return
+    # the image, if any, is part of the messages
+    key = cache_key(messages, GENERATION_PARAMS)
+    async for delta in cache.stream(
+            key, lambda: _stream_completion(messages, context)):
+        yield delta
+
+
+async def _stream_completion(messages, context=None):
+    if context is not None:
+        context.record_prompt(messages)
+    start = time.perf_counter()
+    first_token = True
+    # anything but a normal end or an API error: the reader went away
+    outcome = 'cancelled'
+    try:
+        stream = await gpt_async_client.chat.completions.create(
+            messages=messages,
+            stream=True,
+            stream_options={'include_usage': True},
+            **GENERATION_PARAMS
+        )
+        async for chunk in stream:
+            if chunk.usage is not None:
+                record_usage('suggestion', chunk.usage)
+                if context is not None:
+                    context.record_usage(chunk.usage.prompt_tokens)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if first_token:
+                    LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start)
+                    first_token = False
+                yield delta
+        outcome = 'ok'
+    except Exception as e:
+        outcome = 'error'
+        print(f'[ERROR][generate_response_stream]: {e}')
+        # the text so far is not the answer; don't let it pass for one
+        raise
+    finally:
+        LLM_CALL_SECONDS.observe(
+            time.perf_counter() - start, 'suggestion', outcome)
+
+
+def record_usage(kind, usage):
+    LLM_PROMPT_TOKENS.observe(usage.prompt_tokens, kind)
+    LLM_TOKENS.inc(usage.prompt_tokens, kind, 'prompt')
+    LLM_TOKENS.inc(usage.completion_tokens, kind, 'completion')
+
+
+async def summarize_messages(summary, messages):
+    '''
+    Folds `messages` into the running `summary` (see llm_context).
+    '''
+    transcript = '\n'.join(
+        f"{m['role']}: {m['content']}" for m in messages
+        if isinstance(m.get('content'), str))
+    start = time.perf_counter()
+    ans = await gpt_async_client.chat.completions.create(
+        model=OPENAI_GPT_MODEL,
+        max_completion_tokens=SUMMARY_MAX_TOKENS,
+        messages=[
+            {
+                'role': 'system',
+                'content': SUMMARY_PROMPT.format(MAX_WORDS=SUMMARY_MAX_TOKENS // 2)
+            },
+            {
+                'role': 'user',
+                'content': f'Summary so far:\n{summary or "(none)"}\n\n'
+                           f'New transcript:\n{transcript}'
+            }
+        ],
+        temperature=0.2,
+    )
+    LLM_CALL_SECONDS.observe(time.perf_counter() - start, 'summary', 'ok')
+    usage = getattr(ans, 'usage', None)
+    if usage is not None:
+        record_usage('summary', usage)
+    return ans.choices[0].message.content
@@ -0,0 +1,66 @@
+import asyncio
+
+
+# rapid asr_results within this window get one suggestion, for the last
+SUGGEST_DEBOUNCE = 0.4
+
+
+class SuggestionScheduler:
+    '''
+    At most one LLM suggestion job per conversation.
+
+    Scheduling a job for a newer message cancels the one pending or in
+    flight (cancelling its API stream too, unless another request shares
+    it), so the wizard never gets suggestions for utterances that were
+    already followed by another. Jobs scheduled with a debounce wait that
+    long first, which merges bursts of ASR results into one call.
+    '''
+
+    def __init__(self, debounce=SUGGEST_DEBOUNCE):
+        self.debounce = debounce
+        self.latest_id = None
+        self.scheduled = 0
+        self.superseded = 0
+        self.completed = 0
+        self.failed = 0
+        self._task = None
+
+    def schedule(self, message_id, make_job, debounce=True):
+        '''
+        Runs the coroutine `make_job()` for `message_id`, replacing
+        whatever job came before.
+        '''
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            self.superseded += 1
+        self.scheduled += 1
+        self.latest_id = message_id
+        delay = self.debounce if debounce else 0
+        self._task = asyncio.create_task(self._run(make_job, delay))
+        return self._task
+
+    async def _run(self, make_job, delay):
+        if delay:
+            await asyncio.sleep(delay)
+        try:
+            await make_job()
+        except Exception as e:
+            # nobody awaits the task; don't lose the error with the job
+            self.failed += 1
+            print(f'[ERROR][SuggestionScheduler]: {e}')
+            return
+        self.completed += 1
+
+    def stats(self):
+        return {
+            'latest_id': self.latest_id,
+            'scheduled': self.scheduled,
+            'superseded': self.superseded,
+            'completed': self.completed,
+            'failed': self.failed,
+        }
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
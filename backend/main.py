@@ -1,30 +1,90 @@
+import asyncio
 import os
-import shutil
+import re
 import time
+from contextlib import asynccontextmanager
 
 from fastapi import (
     FastAPI, WebSocket, WebSocketDisconnect,
-    Request, UploadFile, File
+    Request, UploadFile, File, HTTPException
 )
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, JSONResponse, Response
-from fastapi.staticfiles import StaticFiles
-from websocket_server import WebSocketServer, PATH_TEMI, PATH_CONTROL, PATH_PARTICIPANT
-from utils import get_zoom_jwt, log_event
+from fastapi.responses import HTMLResponse, Response
+from websocket_server import (
+    PATH_TEMI, PATH_CONTROL, PATH_PARTICIPANT, DEFAULT_SESSION
+)
+from sessions import Sessions
+from utils import get_zoom_jwt, log_event, event_logger, encode_message
+from uploads import (
+    ChunkedUploads, UploadError, UploadLimit, save_upload, safe_filename
+)
+from media_store import SOURCES, KINDS, media_kind
+from thumbnails import THUMB_FORMATS
+from media_response import cached_file_response
+from pages import render_view, MediaListPage
+import metrics
+from metrics import Gauge, UPLOAD_BYTES, UPLOAD_THROUGHPUT, lag_monitor
 
 from dotenv import load_dotenv
 
 
 load_dotenv()
-app = FastAPI()
-server = WebSocketServer()
+# one WebSocketServer per robot/household; HTTP endpoints take the id
+# as ?session=, and without it use the default one as before
+sessions = Sessions()
+
+
+def get_session(session_id):
+    server = sessions.get(session_id, create=False)
+    if server is None:
+        raise HTTPException(status_code=404, detail="unknown session")
+    return server
+
+
+Gauge("ws_connections", "Open websocket connections per path",
+      lambda: {
+          (path,): sum(len(server.connections[path])
+                       for server in sessions.live.values())
+          for path in sessions.default.connections
+      }, ("path",))
+Gauge("sessions_live", "Sessions loaded in this process",
+      lambda: len(sessions.live))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    lag_monitor.start()
+    yield
+    lag_monitor.close()
+    # flush anything still buffered before the process exits
+    await sessions.stop()
+    event_logger.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
 UPLOAD_DIR = "participant_data/media"
-MEDIA_INDEX_FILE = os.path.join(UPLOAD_DIR, "display_list.txt")
 ZOOM_JWT = os.environ.get('ZOOM_JWT')
 
-app.mount("/media", StaticFiles(directory=UPLOAD_DIR), name="media")
+chunked_uploads = ChunkedUploads(UPLOAD_DIR)
 
 
+
+@app.api_route("/media/{filename}", methods=["GET", "HEAD"])
+async def get_media(filename: str, request: Request,
+                    session: str = DEFAULT_SESSION):
+    # only names that went through the media store are served
+    server = get_session(session)
+    media = server.media.get(filename)
+    if media is None:
+        raise HTTPException(status_code=404, detail="unknown media")
+    return cached_file_response(
+        request, server.media.blob_path(media["sha256"]),
+        f'"{media["sha256"]}"', media["mime"])
+
+
+# refuse oversized multipart uploads before their body is spooled
+app.add_middleware(UploadLimit, paths=["/upload"])
 # CORS is optional but useful during development
 app.add_middleware(
     CORSMiddleware,
@@ -36,36 +96,82 @@ app.add_middleware(
 
 
 @app.websocket(PATH_TEMI)
-async def temi_ws(websocket: WebSocket):
+@app.websocket(PATH_TEMI + "/{session_id}")
+async def temi_ws(websocket: WebSocket, session_id: str = DEFAULT_SESSION):
     print(PATH_TEMI)
     await websocket.accept()
-    await server.handle_connection(websocket, PATH_TEMI)
+    await sessions.handle_connection(websocket, PATH_TEMI, session_id)
 
 
 @app.websocket(PATH_CONTROL)
-async def control_ws(websocket: WebSocket):
+@app.websocket(PATH_CONTROL + "/{session_id}")
+async def control_ws(websocket: WebSocket, session_id: str = DEFAULT_SESSION):
     print(PATH_CONTROL)
     await websocket.accept()
-    await server.handle_connection(websocket, PATH_CONTROL)
+    await sessions.handle_connection(websocket, PATH_CONTROL, session_id)
 
 @app.websocket(PATH_PARTICIPANT)
-async def participant_ws(websocket: WebSocket):
+@app.websocket(PATH_PARTICIPANT + "/{session_id}")
+async def participant_ws(websocket: WebSocket,
+                         session_id: str = DEFAULT_SESSION):
     print(PATH_PARTICIPANT)
     await websocket.accept()
-    await server.handle_connection(websocket, PATH_PARTICIPANT)
+    await sessions.handle_connection(websocket, PATH_PARTICIPANT, session_id)
+
+
+@app.post("/sessions/{session_id}")
+def create_session(session_id: str):
+    '''
+    Creates a session (if it doesn't exist), e.g. so a robot can connect
+    to it before any wizard dashboard has
+    '''
+    server = sessions.get(session_id)
+    if server is None:
+        raise HTTPException(status_code=400, detail="bad session id")
+    return {"session": server.session_id}
 
 
 @app.get("/status")
-def get_status():
+def get_status(session: str = DEFAULT_SESSION):
+    server = get_session(session)
     return {
+        "session": server.session_id,
+        "sessions": sessions.stats(),
         "behavior_mode": server.behavior_mode,
         "message_count": len(server.messages),
         "active_connections": {
             k: len(v) for k, v in server.connections.items()
-        }
+        },
+        "clients": server.client_stats(),
+        "routes": server.route_stats(),
+        "motion": server.motion.stats(),
+        "call": server.zoom_status(),
+        "thumbnails": server.thumbs.stats(),
+        "llm": server.llm_context.stats(),
+        "llm_cache": server.llm_cache.stats(),
+        "suggestions": server.suggestions.stats(),
+        "frames": server.frames.stats(),
+        "loop_lag": lag_monitor.stats(),
+        "recording": server.recorder.stats() if server.recorder else None,
+        "resume": server.resume_stats()
     }
 
 
+@app.get("/metrics")
+def get_metrics():
+    '''
+    Prometheus text format; see metrics.py. With METRICS=0 only the
+    gauges have values.
+    '''
+    return Response(metrics.render(),
+                    media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/call-history")
+def get_call_history(session: str = DEFAULT_SESSION):
+    return [t._asdict() for t in get_session(session).call.history]
+
+
 @app.get("/zoomJWT")
 def return_zoom_jwt():
     token, exp = get_zoom_jwt()
@@ -102,125 +208,212 @@ def return_zoom_jwt():
 
 
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(file: UploadFile = File(...), source: str = "temi",
+                      session: str = DEFAULT_SESSION):
     '''
     Aside from storing it, also announces it to users
     '''
-    save_path = os.path.join(UPLOAD_DIR, file.filename)
     log_event('received', '/upload', file.filename)
-
-    with open(save_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
-
+    server = get_session(session)
+    try:
+        filename = safe_filename(file.filename)
+        check_source(source)
+        start = time.perf_counter()
+        tmp_path, size, sha256 = await save_upload(file, server.upload_dir)
+        observe_upload("multipart", size, time.perf_counter() - start)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return await store_upload(server, tmp_path, size, sha256, filename, source)
+
+
+def observe_upload(kind, size, seconds):
+    UPLOAD_BYTES.inc(size, kind)
+    if seconds > 0:
+        UPLOAD_THROUGHPUT.observe(size / seconds, kind)
+
+
+def check_source(source):
+    if source not in SOURCES:
+        raise UploadError(400, f"source must be one of {SOURCES}")
+
+
+async def store_upload(server, tmp_path, size, sha256, filename, source):
+    media, added = await asyncio.to_thread(
+        server.media.ingest, tmp_path, sha256, size, filename, source)
+    if added:
+        await server.media_changed('add', media)
+        server.warm_thumbnails(media["name"])
+    if source == "temi" and media_kind(media) == "image":
+        # e.g. a takePicture coming back: the robot's freshest view
+        server.frames.add("picture", path=server.media.path(media["name"]))
     await server.send_message(PATH_CONTROL, {
         "type": "media_uploaded",
         "data": "silent"
     })
+    # filename differs from the uploaded one if that name was taken
     return {
         "status": "success",
-        "filename": file.filename,
-        "path": save_path
+        "filename": media["name"],
+        "path": f"/media/{media['name']}{server.query}",
+        "size": size,
+        "sha256": sha256,
+        "media": media
     }
 
 
+# Resumable uploads for large videos:
+#   POST /uploads {"filename", "size", "source", "session"}
+#                                         -> {"upload_id", "offset", ...}
+#   PUT /uploads/{id} with "Content-Range: bytes <start>-<end>/<size>"
+#       and the raw bytes as body; the last range completes the upload
+#   GET /uploads/{id}                     -> current offset, to resume
+@app.post("/uploads")
+async def create_upload(request: Request):
+    data = await request.json()
+    log_event('received', '/uploads', data)
+    try:
+        source = data.get("source", "temi")
+        check_source(source)
+        session = get_session(data.get("session", DEFAULT_SESSION)).session_id
+        upload = chunked_uploads.create(
+            data.get("filename"), data.get("size"), source, session)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return upload.info()
+
+
+@app.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str):
+    try:
+        return chunked_uploads.get(upload_id).info()
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+
+@app.put("/uploads/{upload_id}")
+async def put_upload_chunk(upload_id: str, request: Request):
+    start = 0
+    content_range = request.headers.get("content-range")
+    if content_range:
+        match = re.match(r"bytes (\d+)-\d+/(\d+|\*)", content_range)
+        if match is None:
+            raise HTTPException(status_code=400, detail="bad Content-Range")
+        start = int(match.group(1))
+    try:
+        started = time.perf_counter()
+        upload = await chunked_uploads.append(
+            upload_id, start, request.stream())
+        observe_upload("chunked", upload.offset - start,
+                       time.perf_counter() - started)
+        if upload.offset < upload.size:
+            return upload.info()
+        part_path, size, sha256 = chunked_uploads.finish(upload)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    log_event('received', '/uploads', upload.filename)
+    return await store_upload(
+        get_session(upload.session), part_path, size, sha256,
+        upload.filename, upload.source)
+
+
+@app.get("/thumbs/{filename}")
+async def get_thumbnail(request: Request, filename: str, w: int = 320,
+                        fmt: str = "jpeg", session: str = DEFAULT_SESSION):
+    '''
+    A JPEG/WebP thumbnail of an image, or the poster frame of a video,
+    at most `w` pixels wide (snapped to one of THUMB_SIZES).
+    '''
+    server = get_session(session)
+    media = server.media.get(filename)
+    if media is None or fmt not in THUMB_FORMATS:
+        raise HTTPException(status_code=404, detail="unknown media")
+    path = await server.thumbs.get(
+        media, server.media.path(filename), w, fmt)
+    if path is None:
+        raise HTTPException(status_code=404, detail="no thumbnail")
+    etag = f'"{os.path.basename(path)}"'
+    return cached_file_response(request, path, etag, f"image/{fmt}")
+
+
+def url_session(server):
+    # what goes in ?session= of links to this session's media
+    return None if server.session_id == DEFAULT_SESSION else server.session_id
+
+
 # mostly for thumbnails and Temi display
 @app.get("/view/{filename}", response_class=HTMLResponse)
-async def view_media(filename: str, request: Request):
-    file_url = f"/media/{filename}"
-    lower = filename.lower()
-    
-    if lower.endswith((".jpg", ".jpeg", ".png", ".gif")):
-        tag = f'<img src="{file_url}" style="max-width: 90%; max-height: 80vh;" />'
-    elif lower.endswith((".mp4", ".webm")):
-        tag = (
-            f'<video controls autoplay style="max-width: 90%; max-height: 80vh;">'
-            f'<source src="{file_url}" type="video/mp4">Your browser does not support the video tag.</video>'
-        )
-    else:
-        tag = f"<p>Unsupported file type: {filename}</p>"
-
-    return f"""
-    <html>
-      <head>
-        <title>View Media: {filename}</title>
-      </head>
-      <body style="display:flex; flex-direction:column; align-items:center; justify-content:center; height:100vh;">
-        {tag}
-      </body>
-    </html>
-    """
+async def view_media(filename: str, request: Request,
+                     session: str = DEFAULT_SESSION):
+    server = get_session(session)
+    media = server.media.get(filename)
+    if media is None:
+        raise HTTPException(status_code=404, detail="unknown media")
+    return render_view(filename, media_kind(media), media["mime"],
+                       url_session(server))
+
+
+# by session id
+media_list_pages = {}
 
 
 # Not used for now but is available anyway
 @app.get("/media-list", response_class=HTMLResponse)
-async def list_media():
-    files = os.listdir(UPLOAD_DIR)
-    files.sort(reverse=True)
-
-    items = ""
-    for file in files:
-        lower = file.lower()
-        if lower.endswith((".jpg", ".jpeg", ".png", ".gif")):
-            items += f"""
-                <div style="margin: 20px; text-align: center;">
-                    <img src="/media/{file}" style="max-width: 300px;"><br>
-                    <button onclick="displayMedia('{file}')">Display on Temi</button>
-                </div>
-            """
-        elif lower.endswith((".mp4", ".webm")):
-            items += f"""
-                <div style="margin: 20px; text-align: center;">
-                    <video src="/media/{file}" controls style="max-width: 300px;"></video><br>
-                    <button onclick="displayMedia('{file}')">Display on Temi</button>
-                </div>
-            """
-
-    return f"""
-    <html>
-    <head>
-        <title>Media List</title>
-    </head>
-    <body>
-        <h1>Uploaded Media</h1>
-        <div style="display: flex; flex-wrap: wrap;">
-            {items}
-        </div>
-        <script>
-        const socket = new WebSocket("ws://localhost:8000/control");
-
-        socket.onopen = () => console.log("Connected to WebSocket");
-        socket.onmessage = (event) => console.log("Received:", event.data);
-
-        function displayMedia(filename) {{
-            const message = {{
-                command: "displayMedia",
-                payload: filename
-            }};
-            socket.send(JSON.stringify(message));
-            alert("Sent displayMedia command for: " + filename);
-        }}
-        </script>
-    </body>
-    </html>
-    """
+async def list_media(session: str = DEFAULT_SESSION):
+    server = get_session(session)
+    page = media_list_pages.get(server.session_id)
+    if page is None:
+        page = MediaListPage(server.media, url_session(server))
+        media_list_pages[server.session_id] = page
+    return page.render()
 
-@app.get("/api/media-list")
-async def get_media_list():
-    # files = os.listdir(UPLOAD_DIR)
-    # files.sort(reverse=True)
 
-    # media_files = []
-    # for file in files:
-    #     lower = file.lower()
-    #     if lower.endswith((".jpg", ".jpeg", ".png", ".gif", ".mp4", ".webm")):
-    #         media_files.append(file)
+# by session id: {"version", "body"} of the full list
+media_list_cache = {}
 
-    # return JSONResponse(content={"files": media_files})
-    try:
-        with open(MEDIA_INDEX_FILE, "r") as f:
-            lines = f.readlines()
-        media_files = [line.strip() for line in lines if line.strip()]
-    except FileNotFoundError:
-        media_files = []
 
-    return JSONResponse(content={"files": media_files})
\ No newline at end of file
+@app.get("/api/media-list")
+async def get_media_list(request: Request, limit: int = None,
+                         cursor: int = None, type: str = None,
+                         since: float = None, until: float = None,
+                         order: str = "asc", session: str = DEFAULT_SESSION):
+    '''
+    The display list, in the order media was shared. Without parameters
+    that is every file, as before; `limit` and the returned `next_cursor`
+    page through it, `type` (image/video) and `since`/`until` (unix time
+    shared) filter it, order=desc starts with the newest.
+    '''
+    server = get_session(session)
+    media = server.media
+    etag = f'"{media.epoch}-{media.version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    if type is not None and type not in KINDS:
+        raise HTTPException(status_code=400,
+                            detail=f"type must be one of {KINDS}")
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+
+    # the unfiltered list is what MediaList asks for; encode it once
+    # per version
+    full_list = request.query_params.keys() <= {"session"}
+    cached = media_list_cache.get(server.session_id)
+    if full_list and cached is not None and \
+            cached["version"] == media.version:
+        return Response(media_type="application/json", headers=headers,
+                        content=cached["body"])
+
+    items, next_cursor = media.query(
+        kind=type, since=since, until=until, cursor=cursor, limit=limit,
+        newest_first=order == "desc")
+    body = encode_message({
+        "files": [item["name"] for item in items],
+        "items": items,
+        "next_cursor": next_cursor,
+        "version": media.version
+    })
+    if full_list:
+        media_list_cache[server.session_id] = {
+            "version": media.version, "body": body}
+    return Response(media_type="application/json", headers=headers,
+                    content=body)
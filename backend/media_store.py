@@ -0,0 +1,286 @@
+import bisect
+import hashlib
+import json
+import mimetypes
+import os
+import struct
+import threading
+import time
+
+
+SOURCES = ('temi', 'participant')
+KINDS = ('image', 'video')
+HASH_CHUNK = 1024 * 1024
+
+
+def image_size(path):
+    '''
+    (width, height) read from a PNG, GIF or JPEG header, or None.
+    '''
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(26)
+            if head.startswith(b'\x89PNG\r\n\x1a\n'):
+                return struct.unpack('>II', head[16:24])
+            if head[:6] in (b'GIF87a', b'GIF89a'):
+                return struct.unpack('<HH', head[6:10])
+            if not head.startswith(b'\xff\xd8'):
+                return None
+            f.seek(2)
+            while True:
+                marker = f.read(4)
+                if len(marker) < 4 or marker[0] != 0xff:
+                    return None
+                length = struct.unpack('>H', marker[2:4])[0]
+                # SOF0..SOF15, except DHT / JPG / DAC
+                if 0xc0 <= marker[1] <= 0xcf and marker[1] not in (0xc4, 0xc8, 0xcc):
+                    height, width = struct.unpack('>xHH', f.read(5))
+                    return (width, height)
+                f.seek(length - 2, os.SEEK_CUR)
+    except (OSError, struct.error):
+        return None
+
+
+def media_kind(media):
+    mime = media.get('mime') or ''
+    kind = mime.split('/')[0]
+    return kind if kind in KINDS else None
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaStore:
+    '''
+    Uploaded media, stored once per content hash.
+
+    The bytes live under `objects/<aa>/<sha256>`; every name a file was
+    uploaded under maps to its hash, so uploading the same photo twice
+    costs nothing and a different file under a taken name gets a
+    suffixed name instead of overwriting the first one. Metadata
+    (original name, mime, size, dimensions, created_at, source) and the
+    names shared for display are persisted as an append-only JSON Lines
+    log, and the legacy `display_list.txt` is kept in step with it.
+
+    Everything is held in memory, including the share order indexed by
+    time and by kind, so listing is a couple of bisects and `version`
+    tells clients whether anything changed at all.
+    '''
+
+    def __init__(self, media_dir, index_file=None, log_file=None):
+        self.media_dir = media_dir
+        self.objects_dir = os.path.join(media_dir, 'objects')
+        self.index_file = index_file or os.path.join(
+            media_dir, 'display_list.txt')
+        self.log_file = log_file or os.path.join(media_dir, 'media.jsonl')
+        # name -> metadata record; several names can share one hash
+        self.names = {}
+        # sha256 -> names stored for it; original name -> stored names
+        self.by_hash = {}
+        self.by_original = {}
+        # hashes with bytes in objects/
+        self.blobs = set()
+        # names in the order they were shared for display, when they
+        # were shared (never decreasing) and name -> position
+        self.shared = []
+        self.shared_at = []
+        self.shared_pos = {}
+        # positions in `shared`, by kind
+        self.kind_positions = {kind: [] for kind in KINDS}
+        # bumped on every change; with `epoch` it makes the list ETag
+        self.version = 0
+        self.epoch = format(int(time.time() * 1000), 'x')
+        # ingest runs in worker threads
+        self._lock = threading.Lock()
+
+    def load(self):
+        os.makedirs(self.objects_dir, exist_ok=True)
+        try:
+            with open(self.log_file, 'r') as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except ValueError:
+                        print('[ERROR][MediaStore]: skipping bad record')
+        except FileNotFoundError:
+            self._adopt_legacy_files()
+        return self
+
+    def _apply(self, record):
+        op = record['op']
+        if op == 'add':
+            record = {k: v for k, v in record.items() if k != 'op'}
+            self.names[record['name']] = record
+            self.blobs.add(record['sha256'])
+            self.by_hash.setdefault(record['sha256'], []).append(
+                record['name'])
+            self.by_original.setdefault(
+                record.get('original_name', record['name']), []).append(
+                record['name'])
+        elif op == 'share':
+            name = record['name']
+            if name in self.shared_pos or name not in self.names:
+                return
+            position = len(self.shared)
+            self.shared_pos[name] = position
+            self.shared.append(name)
+            last = self.shared_at[-1] if self.shared_at else 0
+            self.shared_at.append(max(record['at'], last))
+            kind = media_kind(self.names[name])
+            if kind is not None:
+                self.kind_positions[kind].append(position)
+        self.version += 1
+
+    def _append(self, record):
+        self._apply(record)
+        with open(self.log_file, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def _adopt_legacy_files(self):
+        '''
+        Moves files saved by name (before this store existed) into it,
+        keeping their names and the display list.
+        '''
+        for name in sorted(os.listdir(self.media_dir)):
+            path = os.path.join(self.media_dir, name)
+            if not os.path.isfile(path) or name.startswith('.') or \
+                    path in (self.index_file, self.log_file):
+                continue
+            self.ingest(path, file_sha256(path), os.path.getsize(path),
+                        name, 'temi', created_at=os.path.getmtime(path))
+        try:
+            with open(self.index_file, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        self.share(line.strip(), write_index=False)
+        except FileNotFoundError:
+            pass
+
+    def blob_path(self, sha256):
+        return os.path.join(self.objects_dir, sha256[:2], sha256)
+
+    def get(self, name):
+        '''
+        Metadata record for `name`, or None.
+        '''
+        return self.names.get(name)
+
+    def resolve(self, name=None, sha256=None):
+        '''
+        The stored name a share request means. With `sha256`, the media
+        with that content (`name` picks among several names for it);
+        otherwise `name` as a stored name. None if unknown, and also if
+        `name` was the original name of a different upload that got
+        renamed, since it is unclear which of the two is meant.
+        '''
+        if sha256 is not None:
+            names = self.by_hash.get(sha256)
+            if not names:
+                return None
+            return name if name in names else names[-1]
+        media = self.names.get(name)
+        if media is None:
+            return None
+        for other in self.by_original.get(name, ()):
+            if self.names[other]['sha256'] != media['sha256']:
+                return None
+        return name
+
+    def path(self, name):
+        media = self.names.get(name)
+        return None if media is None else self.blob_path(media['sha256'])
+
+    def _free_name(self, name, sha256):
+        taken = self.names.get(name)
+        if taken is None or taken['sha256'] == sha256:
+            return name
+        stem, ext = os.path.splitext(name)
+        return f'{stem}-{sha256[:8]}{ext}'
+
+    def ingest(self, tmp_path, sha256, size, name, source, created_at=None):
+        '''
+        Takes ownership of the complete file at `tmp_path` (on the same
+        filesystem). Returns the metadata of the stored media and whether
+        it is a new name. Does blocking file I/O, so call it from a worker
+        thread.
+        '''
+        dest = self.blob_path(sha256)
+        with self._lock:
+            if sha256 in self.blobs or os.path.exists(dest):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                os.replace(tmp_path, dest)
+
+            stored_name = self._free_name(name, sha256)
+            added = stored_name not in self.names
+            if added:
+                width, height = image_size(dest) or (None, None)
+                self._append({
+                    'op': 'add',
+                    'name': stored_name,
+                    'sha256': sha256,
+                    'original_name': name,
+                    'mime': mimetypes.guess_type(name)[0],
+                    'size': size,
+                    'width': width,
+                    'height': height,
+                    'created_at': created_at or time.time(),
+                    'source': source,
+                })
+            return self.get(stored_name), added
+
+    def share(self, name, write_index=True):
+        '''
+        Adds `name` to the display list. Returns False for unknown names.
+        '''
+        with self._lock:
+            if name not in self.names:
+                return False
+            if name not in self.shared_pos:
+                self._append({'op': 'share', 'name': name, 'at': time.time()})
+                if write_index:
+                    # the display list only ever grows
+                    with open(self.index_file, 'a') as f:
+                        f.write(f'{name}\n')
+            return True
+
+    def query(self, kind=None, since=None, until=None, cursor=None,
+              limit=None, newest_first=False):
+        '''
+        A page of shared media, optionally only images or videos and only
+        those shared within [since, until]. Returns (records, next_cursor);
+        pass next_cursor back for the following page, None means done.
+        Cursors are positions in the share order, so pages stay stable
+        while new media is shared.
+        '''
+        lo = 0 if since is None else bisect.bisect_left(self.shared_at, since)
+        hi = len(self.shared) if until is None else \
+            bisect.bisect_right(self.shared_at, until)
+        positions = range(len(self.shared)) if kind is None else \
+            self.kind_positions[kind]
+        first = bisect.bisect_left(positions, lo)
+        end = bisect.bisect_left(positions, hi)
+        if limit is None:
+            limit = len(positions)
+
+        if newest_first:
+            if cursor is not None:
+                end = min(end, bisect.bisect_left(positions, cursor))
+            start = max(first, end - limit)
+            page = positions[start:end][::-1]
+            next_cursor = positions[start] if start > first else None
+        else:
+            start = first if cursor is None else \
+                max(first, bisect.bisect_left(positions, cursor))
+            stop = min(end, start + limit)
+            page = positions[start:stop]
+            next_cursor = positions[stop] if stop < end else None
+
+        shared, names = self.shared, self.names
+        return [names[shared[p]] for p in page], next_cursor
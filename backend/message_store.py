@@ -0,0 +1,178 @@
+import asyncio
+import json
+import os
+import time
+
+from metrics import DISK_WRITE_SECONDS
+
+
+# a flush happens at most this long after an append
+FLUSH_INTERVAL = 0.5
+# ... or as soon as this many records are pending
+FLUSH_BATCH = 256
+# fold the journal into the snapshot once it grows past this on startup
+COMPACT_AFTER = 10000
+
+
+class MessageStore:
+    '''
+    Conversation history kept in memory and persisted as an append-only
+    JSON Lines journal, one record per message.
+
+    `snapshot_file` is a compacted JSON list (the format messages.json
+    has always used). Every journal record carries its index in the
+    conversation (`seq`), so records already folded into the snapshot
+    are skipped on load and a crash between writing the snapshot and
+    truncating the journal never duplicates messages.
+    '''
+
+    def __init__(self, snapshot_file, journal_file,
+                 flush_interval=FLUSH_INTERVAL, flush_batch=FLUSH_BATCH):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.messages = []
+        self._pending = []
+        self._journal_len = 0
+        self._wakeup = None
+        self._lock = None
+        self._flusher = None
+        # the journal write running in a thread, if any
+        self._writing = None
+
+    def load(self):
+        '''
+        Rebuilds the conversation from the snapshot plus the journal.
+        A torn last record (process died mid-write) is dropped.
+        '''
+        try:
+            with open(self.snapshot_file, 'r') as f:
+                messages = json.load(f)
+        except Exception:
+            print('[ERROR] No messages file. Set to empty')
+            messages = []
+
+        valid_bytes = 0
+        self._journal_len = 0
+        try:
+            with open(self.journal_file, 'rb') as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b'\n'):
+                            raise ValueError('torn record')
+                        record = json.loads(line)
+                    except ValueError:
+                        print('[ERROR][MessageStore]: dropping torn '
+                              f'record at byte {valid_bytes}')
+                        break
+                    valid_bytes += len(line)
+                    self._journal_len += 1
+                    if record['seq'] == len(messages):
+                        messages.append(record['message'])
+            if valid_bytes < os.path.getsize(self.journal_file):
+                os.truncate(self.journal_file, valid_bytes)
+        except FileNotFoundError:
+            pass
+
+        self.messages[:] = messages
+        if self._journal_len > COMPACT_AFTER:
+            self.compact()
+        return self.messages
+
+    def append(self, message):
+        self.messages.append(message)
+        record = {'seq': len(self.messages) - 1, 'message': message}
+        self._pending.append(json.dumps(record) + '\n')
+        if not self._ensure_flusher():
+            # no event loop to flush from; write straight through
+            self._write(self._take_pending())
+        elif len(self._pending) >= self.flush_batch:
+            self._wakeup.set()
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and not self._flusher.done():
+            return True
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._flusher = asyncio.create_task(self._flush_loop())
+        return True
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def _take_pending(self):
+        lines, self._pending = self._pending, []
+        return lines
+
+    async def flush(self):
+        if not self._pending:
+            return
+        async with self._lock:
+            lines = self._take_pending()
+            start = time.perf_counter()
+            # shielded: cancelling the flusher can't stop the thread, and
+            # close() has to wait for it rather than write alongside it
+            self._writing = asyncio.ensure_future(
+                asyncio.to_thread(self._write, lines))
+            await asyncio.shield(self._writing)
+            DISK_WRITE_SECONDS.observe(time.perf_counter() - start, 'messages')
+
+    def _write(self, lines):
+        if not lines:
+            return
+        # one write per batch; every record ends in a newline so a
+        # partial write can only ever leave a torn *last* record
+        with open(self.journal_file, 'a') as f:
+            f.write(''.join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_len += len(lines)
+
+    def compact(self):
+        '''
+        Writes the whole conversation to the snapshot atomically and
+        empties the journal.
+        '''
+        tmp_file = self.snapshot_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.messages, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.snapshot_file)
+        # safe to drop now: every record has seq < len(snapshot)
+        with open(self.journal_file, 'w'):
+            pass
+        self._journal_len = 0
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        if self._writing is not None:
+            # a batch the flusher was writing when it was cancelled
+            try:
+                await self._writing
+            except Exception as e:
+                print(f'[ERROR][MessageStore]: {e}')
+            self._writing = None
+        if self._lock is not None:
+            async with self._lock:
+                self._write(self._take_pending())
+        else:
+            self._write(self._take_pending())
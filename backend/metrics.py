@@ -0,0 +1,208 @@
+'''
+Process metrics in the Prometheus text format, served at /metrics.
+
+Histograms and counters are module-level and updated where things
+happen (router, client writers, LLM calls, uploads, journal writes);
+gauges are read from callbacks when /metrics is scraped. With METRICS=0
+in the environment every `observe`/`inc` returns straight away and the
+lag monitor doesn't run.
+
+Only update these from the event loop thread.
+'''
+import asyncio
+import bisect
+import os
+import time
+
+
+ENABLED = os.environ.get('METRICS', '1') != '0'
+# seconds; handlers and sends are usually well under a millisecond
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 20.0, 30.0, 60.0)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+# bytes per second
+THROUGHPUT_BUCKETS = tuple(mb * 1024 ** 2 for mb in
+                           (1, 5, 10, 25, 50, 100, 250, 500, 1000))
+LAG_INTERVAL = 0.1
+
+_registry = []
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\')
+                         .replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        _registry.append(self)
+
+    def inc(self, amount=1, *label_values):
+        if not ENABLED:
+            return
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        for label_values, value in self.values.items():
+            yield f'{self.name}{_labels(self.labels, label_values)} {value}'
+
+
+class Histogram:
+    '''
+    Cumulative-bucket histogram; `observe` is a bisect and two adds.
+    '''
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self.series = {}
+        _registry.append(self)
+
+    def observe(self, value, *label_values):
+        if not ENABLED:
+            return
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [
+                [0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        names = self.labels + ('le',)
+        for label_values, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + ('+Inf',), counts):
+                cumulative += n
+                yield (f'{self.name}_bucket'
+                       f'{_labels(names, label_values + (bound,))} {cumulative}')
+            labels = _labels(self.labels, label_values)
+            yield f'{self.name}_sum{labels} {total}'
+            yield f'{self.name}_count{labels} {count}'
+
+
+class Gauge:
+    '''
+    Read when scraped: `read()` returns a number, or a dict of
+    label-value tuples to numbers.
+    '''
+
+    def __init__(self, name, help, read, labels=()):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.labels = labels
+        _registry.append(self)
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} gauge'
+        try:
+            value = self.read()
+        except Exception as e:
+            print(f'[ERROR][Gauge {self.name}]: {e}')
+            return
+        if not isinstance(value, dict):
+            value = {(): value}
+        for label_values, v in value.items():
+            yield f'{self.name}{_labels(self.labels, label_values)} {v}'
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+HANDLER_SECONDS = Histogram(
+    'ws_handler_seconds', 'Time spent handling one websocket message',
+    ('router', 'name'))
+SEND_SECONDS = Histogram(
+    'ws_send_seconds', 'Time from queueing a message to it being sent',
+    ('path',))
+LLM_FIRST_TOKEN_SECONDS = Histogram(
+    'llm_first_token_seconds', 'Time to the first streamed token',
+    buckets=LLM_BUCKETS)
+LLM_CALL_SECONDS = Histogram(
+    'llm_call_seconds', 'Duration of LLM calls', ('kind', 'outcome'),
+    buckets=LLM_BUCKETS)
+LLM_PROMPT_TOKENS = Histogram(
+    'llm_prompt_tokens', 'Prompt tokens per LLM call', ('kind',),
+    buckets=TOKEN_BUCKETS)
+LLM_TOKENS = Counter(
+    'llm_tokens_total', 'Tokens billed by the LLM API', ('kind', 'type'))
+UPLOAD_BYTES = Counter(
+    'upload_bytes_total', 'Bytes received by /upload and /uploads', ('kind',))
+UPLOAD_THROUGHPUT = Histogram(
+    'upload_throughput_bytes_per_second',
+    'Throughput of each upload request body', ('kind',),
+    buckets=THROUGHPUT_BUCKETS)
+DISK_WRITE_SECONDS = Histogram(
+    'disk_write_seconds', 'Duration of writes done off the event loop',
+    ('file',))
+LOOP_LAG_SECONDS = Histogram(
+    'event_loop_lag_seconds',
+    'How late the event loop ran a timer due now (blocking work shows '
+    'up here)')
+
+
+class LagMonitor:
+    '''
+    Sleeps `interval` in a loop and records how late it woke up: the
+    time the event loop spent on something else that didn't yield.
+    '''
+
+    def __init__(self, interval=LAG_INTERVAL):
+        self.interval = interval
+        self.last = 0.0
+        self.max = 0.0
+        self._task = None
+
+    def start(self):
+        if ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+            self.last = lag
+            self.max = max(self.max, lag)
+            LOOP_LAG_SECONDS.observe(lag)
+
+    def stats(self):
+        return {
+            'enabled': self._task is not None,
+            'last_ms': round(self.last * 1000, 3),
+            'max_ms': round(self.max * 1000, 3),
+        }
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+Gauge('event_loop_lag_max_seconds', 'Largest event loop lag seen',
+      lambda: lag_monitor.max)
+lag_monitor = LagMonitor()
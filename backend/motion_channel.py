@@ -0,0 +1,89 @@
+import asyncio
+
+
+MOTION_COMMANDS = ['skidJoy', 'turnBy', 'tiltBy', 'tiltAngle']
+STOP_COMMAND = 'stopMovement'
+# at most this many motion updates per second go to the robot
+MOTION_MAX_RATE = 10
+
+
+class MotionChannel:
+    '''
+    Coalescing, rate-limited path for teleop commands to one robot.
+
+    Only the latest pending message per motion command is kept, and
+    pending messages are sent at most `max_rate` times per second, so a
+    burst of joystick repeats turns into one up-to-date command instead
+    of a backlog the robot works through long after the stick was
+    released. stopMovement discards anything pending and is sent
+    straight away through `send_urgent`, ahead of whatever is already
+    queued for the robot.
+    '''
+
+    def __init__(self, send, send_urgent=None, max_rate=MOTION_MAX_RATE):
+        # coroutine functions taking the message to deliver
+        self.send = send
+        self.send_urgent = send if send_urgent is None else send_urgent
+        self.min_interval = 1.0 / max_rate
+        self.received = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self._pending = {}
+        self._last_sent = 0.0
+        self._ready = None
+        self._task = None
+
+    async def submit(self, msg_json):
+        self.received += 1
+        command = msg_json['command']
+        if command == STOP_COMMAND:
+            self.dropped += len(self._pending)
+            self._pending.clear()
+            self.sent += 1
+            await self.send_urgent(msg_json)
+            return
+
+        if command in self._pending:
+            self.coalesced += 1
+        self._pending[command] = msg_json
+        self._ensure_task()
+        self._ready.set()
+
+    def _ensure_task(self):
+        if self._task is None or self._task.done():
+            self._ready = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            wait = self._last_sent + self.min_interval - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if not self._pending:
+                # a stop came in while we were waiting
+                continue
+            batch = list(self._pending.values())
+            self._pending.clear()
+            self._last_sent = loop.time()
+            for msg_json in batch:
+                self.sent += 1
+                await self.send(msg_json)
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._pending.clear()
+
+    def stats(self):
+        return {
+            'received': self.received,
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+            'pending': len(self._pending),
+        }
@@ -0,0 +1,68 @@
+import functools
+import os
+from urllib.parse import quote
+
+import jinja2
+import markupsafe
+
+from media_store import media_kind
+
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'templates')
+# compiled once, autoescaped, since filenames come from clients
+templates = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(TEMPLATE_DIR),
+    autoescape=True,
+    auto_reload=False,
+)
+VIEW_CACHE_SIZE = 1024
+
+
+@functools.lru_cache(maxsize=VIEW_CACHE_SIZE)
+def render_view(filename, kind, mime, session=None):
+    # what a name points to never changes, so a page per name is enough
+    return templates.get_template('view.html').render(
+        filename=filename, kind=kind, mime=mime, session=session)
+
+
+class MediaListPage:
+    '''
+    The /media-list page, rendered from the media store and kept until
+    the store's version changes. Each file's fragment is rendered once
+    (a name never changes), so a new upload only costs a join. URLs carry
+    `session` unless it is None (the default session).
+    '''
+
+    def __init__(self, media, session=None):
+        self.media = media
+        self.session = session
+        self.renders = 0
+        self._version = None
+        self._html = None
+        self._items = {}
+
+    def _item(self, media):
+        name = media['name']
+        html = self._items.get(name)
+        if html is None:
+            html = templates.get_template('media_item.html').render(
+                file=name, url=quote(name), kind=media_kind(media),
+                session=self.session)
+            self._items[name] = html
+        return html
+
+    def render(self):
+        version = self.media.version
+        if self._version != version:
+            # newest upload first; copied in one go since uploads are
+            # added from worker threads
+            items = [self._item(media)
+                     for media in reversed(list(self.media.names.values()))
+                     if media_kind(media) is not None]
+            self._html = templates.get_template('media_list.html').render(
+                items=markupsafe.Markup(''.join(items)),
+                session=self.session)
+            self._version = version
+            self.renders += 1
+        return self._html
@@ -0,0 +1,97 @@
+import json
+from time import perf_counter
+
+from metrics import HANDLER_SECONDS
+
+
+class RouteStats:
+    __slots__ = ('count', 'total_time', 'max_time')
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, elapsed):
+        self.count += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+
+    def as_dict(self):
+        avg = self.total_time / self.count if self.count else 0.0
+        return {
+            'count': self.count,
+            'avg_ms': round(avg * 1000, 3),
+            'max_ms': round(self.max_time * 1000, 3),
+        }
+
+
+class Router:
+    '''
+    Maps the `key` field of incoming messages ('command' or 'type') to a
+    handler with a single dict lookup.
+
+    Handlers are WebSocketServer methods registered with `@router.on(...)`
+    and called as `handler(server, client, msg_json)`, `client` being the
+    sender's ClientConnection. Messages that are only relayed are declared
+    with `router.forward(names, *groups)` and sent on without running any
+    handler code.
+    '''
+
+    def __init__(self, name, key):
+        self.name = name
+        self.key = key
+        self.handlers = {}
+        self.stats = {}
+
+    def on(self, *names):
+        def register(fn):
+            for name in names:
+                self._add(name, fn)
+            return fn
+        return register
+
+    def forward(self, names, *groups):
+        if isinstance(names, str):
+            names = [names]
+
+        async def forward(server, client, msg_json):
+            for group in groups:
+                await server.send_message(group, msg_json)
+        forward.groups = groups
+
+        for name in names:
+            self._add(name, forward)
+
+    def _add(self, name, fn):
+        if name in self.handlers:
+            raise ValueError(f'{self.name}: {name!r} is already routed')
+        self.handlers[name] = fn
+        self.stats[name] = RouteStats()
+
+    async def handle(self, server, client, message):
+        try:
+            msg_json = json.loads(message)
+        except Exception as e:
+            print(f'[ERROR][{self.name}]: {e}')
+            return
+        try:
+            name = msg_json[self.key]
+            handler = self.handlers[name]
+        except (KeyError, TypeError):
+            # not a dict, no key, unhashable key or nothing routed for it
+            return
+        start = perf_counter()
+        try:
+            await handler(server, client, msg_json)
+        finally:
+            elapsed = perf_counter() - start
+            self.stats[name].record(elapsed)
+            HANDLER_SECONDS.observe(elapsed, self.name, name)
+
+    def stats_dict(self):
+        return {
+            name: stats.as_dict()
+            for name, stats in self.stats.items() if stats.count
+        }
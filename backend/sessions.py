@@ -0,0 +1,181 @@
+import json
+import os
+import re
+import time
+
+from fastapi import WebSocketDisconnect
+
+from client_connection import ClientConnection
+from llm_cache import ResponseCache
+from thumbnails import ThumbnailCache
+from websocket_server import (
+    WebSocketServer, DATA_DIR, SESSIONS_DIR, DEFAULT_SESSION, THUMB_DIR,
+    PATH_CONTROL, RESUME_TTL
+)
+
+
+# also used as a directory name, so nothing else is allowed
+SESSION_ID_RE = re.compile(r'[A-Za-z0-9_-]{1,64}')
+# field of an `identify` message that moves the socket to a session
+SESSION_FIELD = 'session'
+# a session without clients for this long is unloaded (its data stays on
+# disk); longer than RESUME_TTL so a resumable client can still come back
+SESSION_IDLE_TTL = max(10 * 60, 2 * RESUME_TTL)
+
+
+class Sessions:
+    '''
+    One WebSocketServer per robot/household, so a backend process can
+    serve several of them.
+
+    A socket's session comes from its path (/temi/<id>, /control/<id>,
+    /participant/<id>) or from the `session` field of an `identify`
+    message; plain /temi etc. are the default session, kept in
+    participant_data/ as before. Everything a session sends stays within
+    it, and each has its own conversation, call, media and data dir.
+    Thumbnails (stored by content hash) and the LLM response cache are
+    shared.
+
+    Only a /control socket (the wizard) or POST /sessions/<id> creates a
+    session; the robot and participant can only join one that exists.
+    Sessions are loaded on first use and unloaded once they have had no
+    clients for `idle_ttl`, checked whenever a socket connects. The
+    default session is always kept.
+    '''
+
+    def __init__(self, data_dir=DATA_DIR, sessions_dir=SESSIONS_DIR,
+                 idle_ttl=SESSION_IDLE_TTL):
+        self.data_dir = data_dir
+        self.sessions_dir = sessions_dir
+        self.idle_ttl = idle_ttl
+        self.thumbs = ThumbnailCache(THUMB_DIR).load()
+        self.llm_cache = ResponseCache()
+        self.live = {}
+        # session id -> when its last client left (or it was loaded)
+        self.idle = {}
+        self.moved = 0
+        self.unloaded = 0
+        self.default = self.get(DEFAULT_SESSION)
+
+    def session_dir(self, session_id):
+        if session_id == DEFAULT_SESSION:
+            return self.data_dir
+        return os.path.join(self.sessions_dir, session_id)
+
+    def get(self, session_id=DEFAULT_SESSION, create=True):
+        '''
+        The session `session_id`, loaded from its data dir if it isn't
+        live yet. Without `create`, only sessions that already exist on
+        disk are opened; None for those and for malformed ids.
+        '''
+        if not isinstance(session_id, str):
+            return None
+        session = self.live.get(session_id)
+        if session is not None:
+            return session
+        if not SESSION_ID_RE.fullmatch(session_id):
+            return None
+        data_dir = self.session_dir(session_id)
+        if not create and not os.path.isdir(data_dir):
+            return None
+        session = WebSocketServer(
+            session_id, data_dir, thumbs=self.thumbs, llm_cache=self.llm_cache)
+        self.live[session_id] = session
+        self._mark_idle(session)
+        return session
+
+    def _mark_idle(self, session):
+        if session.session_id != DEFAULT_SESSION:
+            self.idle[session.session_id] = time.monotonic()
+
+    def _join(self, session, client):
+        self.idle.pop(session.session_id, None)
+        session.join(client)
+
+    def _leave(self, session, client):
+        session.leave(client)
+        if not any(session.connections.values()):
+            self._mark_idle(session)
+
+    async def _unload_idle(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        for session_id, since in list(self.idle.items()):
+            if since > cutoff:
+                continue
+            del self.idle[session_id]
+            session = self.live.pop(session_id)
+            self.unloaded += 1
+            await session.stop()
+
+    async def handle_connection(self, websocket, ws_path,
+                                session_id=DEFAULT_SESSION):
+        await self._unload_idle()
+        session = self.get(session_id, create=ws_path == PATH_CONTROL)
+        if session is None:
+            print(f'[ERROR][handle_connection]: bad or unknown session '
+                  f'{session_id!r}')
+            await websocket.close(code=1008)
+            return
+        query = websocket.query_params
+        client = ClientConnection(
+            websocket, ws_path,
+            on_close=lambda client: self._leave(client.session, client),
+            binary=query.get('binary') == '1',
+            # ?resume=new, or ?resume=<token>&seq=<n> after a reconnect
+            resumable='resume' in query)
+        self._join(session, client)
+        if client.resumable:
+            await session.resume(client, query.get('resume'), query.get('seq'))
+        try:
+            while True:
+                frame = await websocket.receive()
+                if frame['type'] == 'websocket.disconnect':
+                    raise WebSocketDisconnect(frame.get('code', 1000))
+                text = frame.get('text')
+                # cheap check first: only identify messages can move it
+                if text is not None and SESSION_FIELD in text and \
+                        'identify' in text:
+                    self._identify(client, text)
+                await client.session.receive(client, frame)
+        except WebSocketDisconnect:
+            print(f"[{ws_path}] Disconnected")
+        except RuntimeError as e:
+            # socket was already closed by an evicted writer
+            print(f"[{ws_path}] Closed: {e}")
+        finally:
+            client.close()
+
+    def _identify(self, client, text):
+        try:
+            msg = json.loads(text)
+            if 'identify' not in (msg.get('command'), msg.get('type')):
+                return
+            session_id = msg.get(SESSION_FIELD)
+        except (ValueError, AttributeError):
+            return
+        if session_id is None or session_id == client.session.session_id:
+            return
+        session = self.get(session_id, create=client.path == PATH_CONTROL)
+        if session is None:
+            print(f'[ERROR][identify]: bad or unknown session {session_id!r}')
+            return
+        self._leave(client.session, client)
+        self._join(session, client)
+        self.moved += 1
+
+    def stats(self):
+        return {
+            'live': len(self.live),
+            'idle': len(self.idle),
+            'moved': self.moved,
+            'unloaded': self.unloaded,
+            'connections': {
+                session_id: sum(len(c) for c in session.connections.values())
+                for session_id, session in self.live.items()
+            },
+        }
+
+    async def stop(self):
+        for session in list(self.live.values()):
+            await session.stop()
+        self.thumbs.close()
@@ -0,0 +1,189 @@
+import asyncio
+import collections
+import os
+import shutil
+import subprocess
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+
+# widths thumbnails are rendered at; requests snap up to the next one
+THUMB_SIZES = (160, 320, 640)
+THUMB_FORMATS = {'jpeg': 'jpg', 'webp': 'webp'}
+# rendered on upload / share so the dashboard grid is ready
+WARM_SIZES = ((320, 'jpeg'), (320, 'webp'))
+THUMB_CACHE_BYTES = int(os.environ.get('THUMB_CACHE_BYTES', 256 * 1024 ** 2))
+THUMB_WORKERS = int(os.environ.get('THUMB_WORKERS', 2))
+# poster frames are taken this far into the video
+POSTER_AT = 1.0
+FFMPEG = shutil.which('ffmpeg')
+
+
+def _poster_frame(src, dest):
+    for seek in (POSTER_AT, 0):
+        subprocess.run(
+            [FFMPEG, '-v', 'error', '-y', '-ss', str(seek), '-i', src,
+             '-frames:v', '1', '-f', 'image2', dest],
+            check=False, timeout=60,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if os.path.exists(dest) and os.path.getsize(dest) > 0:
+            return True
+    return False
+
+
+def render(src, dest, size, fmt, is_video):
+    '''
+    Runs in a worker process: writes a `size`-pixel-wide-at-most
+    thumbnail of the image (or of a video's poster frame) to `dest`.
+    Returns False if there is nothing to render.
+    '''
+    from PIL import Image, ImageOps
+
+    tmp = f'{dest}.{uuid.uuid4().hex}.tmp'
+    frame = None
+    try:
+        if is_video:
+            if FFMPEG is None:
+                return False
+            frame = tmp + '.jpg'
+            if not _poster_frame(src, frame):
+                return False
+            src = frame
+        with Image.open(src) as im:
+            im = ImageOps.exif_transpose(im)
+            im.thumbnail((size, size * 4))
+            if im.mode not in ('RGB', 'L'):
+                im = im.convert('RGB')
+            im.save(tmp, format=fmt.upper(), quality=80)
+        os.replace(tmp, dest)
+        return True
+    finally:
+        for path in (tmp, frame):
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+
+def snap_size(size):
+    for allowed in THUMB_SIZES:
+        if size <= allowed:
+            return allowed
+    return THUMB_SIZES[-1]
+
+
+class ThumbnailCache:
+    '''
+    Resized JPEG/WebP thumbnails and video poster frames, kept on disk
+    under `<hash>-<width>.<ext>` so a derivative is rendered once per
+    content, not per name.
+
+    Rendering happens in a process pool (resizing is CPU-bound and would
+    otherwise hold the GIL), concurrent requests for the same derivative
+    share one render, and once the files exceed `budget` bytes the least
+    recently used ones are deleted.
+    '''
+
+    def __init__(self, cache_dir, budget=THUMB_CACHE_BYTES,
+                 workers=THUMB_WORKERS):
+        self.cache_dir = cache_dir
+        self.budget = budget
+        self.workers = workers
+        # path -> size in bytes, least recently used first
+        self.entries = collections.OrderedDict()
+        self.total = 0
+        self.rendered = 0
+        self.hits = 0
+        self.evicted = 0
+        self._inflight = {}
+        self._pool = None
+
+    def load(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        found = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.tmp') or not os.path.isfile(path):
+                continue
+            st = os.stat(path)
+            found.append((st.st_mtime, path, st.st_size))
+        for _, path, size in sorted(found):
+            self.entries[path] = size
+            self.total += size
+        return self
+
+    def path_for(self, sha256, size, fmt):
+        return os.path.join(
+            self.cache_dir, f'{sha256}-{size}.{THUMB_FORMATS[fmt]}')
+
+    async def get(self, media, src, size, fmt):
+        '''
+        Path of the thumbnail for `media` (stored at `src`), rendering it
+        first if needed, or None if it cannot be made (not an image, or
+        a video without ffmpeg).
+        '''
+        size = snap_size(size)
+        path = self.path_for(media['sha256'], size, fmt)
+        if path in self.entries:
+            self.entries.move_to_end(path)
+            self.hits += 1
+            return path
+
+        future = self._inflight.get(path)
+        if future is None:
+            future = asyncio.ensure_future(self._render(media, src, path,
+                                                        size, fmt))
+            self._inflight[path] = future
+            future.add_done_callback(
+                lambda _: self._inflight.pop(path, None))
+        return await asyncio.shield(future)
+
+    async def _render(self, media, src, path, size, fmt):
+        mime = media.get('mime') or ''
+        is_video = mime.startswith('video/')
+        if not (is_video or mime.startswith('image/')) or \
+                (is_video and FFMPEG is None):
+            return None
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        try:
+            done = await loop.run_in_executor(
+                self._pool, render, src, path, size, fmt, is_video)
+        except Exception as e:
+            print(f'[ERROR][ThumbnailCache]: {media["name"]}: {e}')
+            return None
+        if not done:
+            return None
+        self.rendered += 1
+        self._add(path, os.path.getsize(path))
+        return path
+
+    def _add(self, path, size):
+        self.entries[path] = size
+        self.total += size
+        while self.total > self.budget and len(self.entries) > 1:
+            old, old_size = self.entries.popitem(last=False)
+            self.total -= old_size
+            self.evicted += 1
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                pass
+
+    async def warm(self, media, src):
+        for size, fmt in WARM_SIZES:
+            await self.get(media, src, size, fmt)
+
+    def stats(self):
+        return {
+            'files': len(self.entries),
+            'bytes': self.total,
+            'budget': self.budget,
+            'rendered': self.rendered,
+            'hits': self.hits,
+            'evicted': self.evicted,
+        }
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,140 @@
+import atexit
+import base64
+import json
+import os
+import queue
+import threading
+import time
+
+
+# RECORD_TRAFFIC=1 records every session's websocket traffic to
+# <session data dir>/recordings/<start time>.jsonl
+RECORD_TRAFFIC = os.environ.get('RECORD_TRAFFIC') == '1'
+RECORDINGS_DIR = 'recordings'
+FORMAT_VERSION = 1
+FLUSH_INTERVAL = 1.0
+
+# events, one per line after the header
+OPEN = 'open'
+IN = 'in'
+OUT = 'out'
+CLOSE = 'close'
+
+_STOP = object()
+
+
+class TrafficRecorder:
+    '''
+    Full capture of a session's websocket traffic, for replaying it
+    later (see benchmarks/replay.py). log.log only keeps a preview of
+    each message; this keeps the frames themselves.
+
+    The file starts with a header object, then one array per event:
+
+        [t, event, connection id, path, data]
+
+    `t` is monotonic seconds since the recording started. `event` is
+    open (data: {"binary": bool}), in, out or close (data: null). Text
+    frames are stored as the string sent, binary ones as {"b64": ...}.
+    The open of a resumable client also has the `resume` token and
+    `seq` it asked for, the `token` it got and whether it `resumed`.
+
+    `record` only puts the event on a queue; a writer thread encodes
+    and writes them, like EventLogger.
+    '''
+
+    def __init__(self, path, session_id=None, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.session_id = session_id
+        self.flush_interval = flush_interval
+        self.recorded = 0
+        self.start = time.monotonic()
+        self._queue = queue.SimpleQueue()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._thread = threading.Thread(
+            target=self._run, name='traffic-recorder', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @classmethod
+    def for_session(cls, data_dir, session_id):
+        name = time.strftime('%Y%m%d-%H%M%S') + '.jsonl'
+        return cls(os.path.join(data_dir, RECORDINGS_DIR, name), session_id)
+
+    def record(self, event, conn_id, path, data=None):
+        self.recorded += 1
+        self._queue.put((time.monotonic(), event, conn_id, path, data))
+
+    def close(self):
+        '''
+        Writes out everything recorded so far and stops the writer.
+        '''
+        thread = self._thread
+        if thread is None:
+            return
+        self._thread = None
+        self._queue.put(_STOP)
+        thread.join()
+
+    def stats(self):
+        return {'path': self.path, 'recorded': self.recorded}
+
+    def _encode(self, item):
+        t, event, conn_id, path, data = item
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = {'b64': base64.b64encode(data).decode('ascii')}
+        return json.dumps([round(t - self.start, 6), event, conn_id, path,
+                           data], separators=(',', ':'), ensure_ascii=False)
+
+    def _run(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({
+                'version': FORMAT_VERSION,
+                'session': self.session_id,
+                'started': time.time(),
+            }) + '\n')
+            last_flush = time.monotonic()
+            stopping = False
+            while not stopping:
+                try:
+                    item = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    item = None
+                lines = []
+                while item is not None:
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    try:
+                        lines.append(self._encode(item) + '\n')
+                    except Exception as e:
+                        print(f'[ERROR][TrafficRecorder]: {e}')
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        item = None
+                f.writelines(lines)
+                now = time.monotonic()
+                if stopping or now - last_flush >= self.flush_interval:
+                    f.flush()
+                    last_flush = now
+
+
+def read_recording(path):
+    '''
+    The header of a recording and its events as tuples
+    (t, event, conn_id, path, data), binary data decoded to bytes.
+    A line cut off by a crash ends the events.
+    '''
+    with open(path, encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        events = []
+        for line in f:
+            try:
+                t, event, conn_id, ws_path, data = json.loads(line)
+            except ValueError:
+                break
+            if isinstance(data, dict) and 'b64' in data:
+                data = base64.b64decode(data['b64'])
+            events.append((t, event, conn_id, ws_path, data))
+    return header, events
@@ -0,0 +1,228 @@
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+
+from starlette.responses import JSONResponse
+
+
+CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 2 * 1024 ** 3))
+# unfinished chunked uploads are cleaned up after this many seconds
+PART_TTL = 24 * 60 * 60
+# multipart boundaries and part headers on top of the file itself
+FORM_OVERHEAD = 64 * 1024
+
+
+class UploadError(Exception):
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def safe_filename(filename):
+    name = os.path.basename((filename or '').replace('\\', '/')).strip()
+    if name in ('', '.', '..'):
+        raise UploadError(400, 'invalid filename')
+    return name
+
+
+def _copy_file(src, tmp_path, max_bytes):
+    '''
+    Runs in a worker thread: copies, hashes and size-checks in one pass.
+    '''
+    digest = hashlib.sha256()
+    size = 0
+    with open(tmp_path, 'wb') as out:
+        while True:
+            chunk = src.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadError(413, f'file larger than {max_bytes} bytes')
+            digest.update(chunk)
+            out.write(chunk)
+        out.flush()
+        os.fsync(out.fileno())
+    return size, digest.hexdigest()
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+async def save_upload(file, upload_dir, max_bytes=MAX_UPLOAD_BYTES):
+    '''
+    Copies an UploadFile into a temp file in `upload_dir` without
+    blocking the event loop, and returns (tmp_path, size, sha256 hex
+    digest) for the media store to take over. Nothing is left behind
+    if the copy fails.
+    '''
+    tmp_path = os.path.join(upload_dir, f'.{uuid.uuid4().hex}.tmp')
+    try:
+        size, digest = await asyncio.to_thread(
+            _copy_file, file.file, tmp_path, max_bytes)
+    except BaseException:
+        await asyncio.to_thread(_remove, tmp_path)
+        raise
+    return tmp_path, size, digest
+
+
+class UploadLimit:
+    '''
+    ASGI middleware turning away multipart uploads to `paths` whose
+    Content-Length is over `max_bytes` (plus form overhead), before any
+    of the body is read. FastAPI parses and spools a form before the
+    endpoint runs, so save_upload's own check only catches a request
+    after it has been written to a temp file. The server won't read
+    past Content-Length, so requests without one are refused too.
+    '''
+
+    def __init__(self, app, paths, max_bytes=MAX_UPLOAD_BYTES):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] in self.paths:
+            error = self._check(dict(scope['headers']).get(b'content-length'))
+            if error is not None:
+                response = JSONResponse(
+                    {'detail': error.detail}, status_code=error.status_code)
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+    def _check(self, content_length):
+        if content_length is None:
+            return UploadError(411, 'Content-Length required')
+        try:
+            length = int(content_length)
+        except ValueError:
+            return UploadError(400, 'bad Content-Length')
+        if length > self.max_bytes + FORM_OVERHEAD:
+            return UploadError(413, f'file larger than {self.max_bytes} bytes')
+        return None
+
+
+class ChunkedUpload:
+    def __init__(self, upload_dir, filename, size, source, session=None):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.size = size
+        self.source = source
+        # the robot/household the finished file belongs to
+        self.session = session
+        self.offset = 0
+        self.part_path = os.path.join(upload_dir, f'.{self.id}.part')
+        self.digest = hashlib.sha256()
+        self.updated = time.time()
+        self.lock = asyncio.Lock()
+
+    def info(self):
+        return {
+            'upload_id': self.id,
+            'filename': self.filename,
+            'size': self.size,
+            'offset': self.offset,
+        }
+
+
+class ChunkedUploads:
+    '''
+    Resumable uploads for large videos.
+
+    A client creates an upload with its filename and total size, then
+    PUTs consecutive byte ranges; after a dropped connection it asks for
+    the current offset and continues from there. Request bodies are
+    streamed straight to a `.part` file (writes and hashing happen in a
+    worker thread), which is handed to the media store once all bytes
+    are in.
+    '''
+
+    def __init__(self, upload_dir, max_bytes=MAX_UPLOAD_BYTES,
+                 part_ttl=PART_TTL):
+        self.upload_dir = upload_dir
+        self.max_bytes = max_bytes
+        self.part_ttl = part_ttl
+        self.uploads = {}
+
+    def create(self, filename, size, source, session=None):
+        if not isinstance(size, int) or size < 0:
+            raise UploadError(400, 'size must be a non-negative integer')
+        if size > self.max_bytes:
+            raise UploadError(413, f'file larger than {self.max_bytes} bytes')
+        self._expire()
+        upload = ChunkedUpload(
+            self.upload_dir, safe_filename(filename), size, source, session)
+        open(upload.part_path, 'wb').close()
+        self.uploads[upload.id] = upload
+        return upload
+
+    def get(self, upload_id):
+        upload = self.uploads.get(upload_id)
+        if upload is None:
+            raise UploadError(404, 'unknown upload')
+        return upload
+
+    async def append(self, upload_id, start, chunks):
+        '''
+        Writes the async iterable `chunks` at byte `start`, which has to
+        be the current offset. Returns the upload.
+        '''
+        upload = self.get(upload_id)
+        async with upload.lock:
+            if start != upload.offset:
+                raise UploadError(
+                    409, f'expected offset {upload.offset}, got {start}')
+            with open(upload.part_path, 'ab') as f:
+                pending = []
+                pending_len = 0
+                async for chunk in chunks:
+                    if upload.offset + pending_len + len(chunk) > upload.size:
+                        raise UploadError(413, 'more bytes than announced')
+                    pending.append(chunk)
+                    pending_len += len(chunk)
+                    if pending_len >= CHUNK_SIZE:
+                        await self._write(upload, f, pending)
+                        pending, pending_len = [], 0
+                await self._write(upload, f, pending)
+                if upload.offset == upload.size:
+                    # on disk before finish() hands it to the media store
+                    await asyncio.to_thread(os.fsync, f.fileno())
+            upload.updated = time.time()
+        return upload
+
+    async def _write(self, upload, f, chunks):
+        if not chunks:
+            return
+        data = b''.join(chunks)
+
+        def write():
+            f.write(data)
+            f.flush()
+            upload.digest.update(data)
+
+        await asyncio.to_thread(write)
+        upload.offset += len(data)
+
+    def finish(self, upload):
+        '''
+        Hands over a complete upload, already fsynced by `append`:
+        returns (part_path, size, sha256) and forgets about it.
+        '''
+        del self.uploads[upload.id]
+        return upload.part_path, upload.size, upload.digest.hexdigest()
+
+    def _expire(self):
+        cutoff = time.time() - self.part_ttl
+        for upload in list(self.uploads.values()):
+            if upload.updated < cutoff and not upload.lock.locked():
+                _remove(upload.part_path)
+                del self.uploads[upload.id]
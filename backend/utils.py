@@ -1,8 +1,15 @@
+import json
 import os
 import time
 import jwt  # PyJWT
 from functools import lru_cache
 from dotenv import load_dotenv
+from event_logger import EventLogger, skip_zoom_status_noise, skip_heartbeats
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 load_dotenv()
@@ -13,6 +20,9 @@ ZOOM_SDK_SECRET = os.environ.get("ZOOM_SDK_SECRET")
 ZOOM_SESSION_NAME = os.environ.get("ZOOM_SESSION_NAME")
 LOG_FILE = "participant_data/log.log"
 
+event_logger = EventLogger(
+    LOG_FILE, filters=[skip_zoom_status_noise, skip_heartbeats])
+
 
 @lru_cache(maxsize=1)
 def get_zoom_jwt():
@@ -41,18 +51,28 @@ def get_zoom_jwt():
 
 
 def log_event(direction: str, path: str, data: str):
-    # skip these:
-    if (direction == 'received' and
-        path == '/control' and
-        'zoom_status' in data):
-        return
-
-    if (direction == 'sent' and
-        path == '/control' and
-        'zoom_status' in data and
-        "'call_duration': None" in data):
-        return
-
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-    with open(LOG_FILE, 'a') as f:
-        f.write(f"[{timestamp}][{direction}][{path}] {data}\n")
\ No newline at end of file
+    # queued and written by event_logger's background thread
+    event_logger.log(direction, path, data)
+
+
+def encode_message(message):
+    '''
+    Serializes a message once so the same text can be sent to every
+    recipient. Uses orjson when it is installed.
+    '''
+    if orjson is not None:
+        return orjson.dumps(message).decode()
+    return json.dumps(message, separators=(',', ':'), ensure_ascii=False)
+
+
+def preview(message, limit=100):
+    '''
+    Same as str(message)[:limit] but without building the full repr of
+    multi-MB base64 payloads first.
+    '''
+    if isinstance(message, dict):
+        message = {
+            k: v[:limit] if isinstance(v, str) else v
+            for k, v in message.items()
+        }
+    return str(message)[:limit]
@@ -1,13 +1,25 @@
 import asyncio
 from dotenv import load_dotenv
-import json
 import os
 import time
-from websockets.asyncio.server import serve
-from fastapi import WebSocketDisconnect
-import signal
-from llm_model import generate_response
-from utils import log_event
+from llm_model import generate_response_stream, summarize_messages
+from llm_context import ContextBuilder
+from llm_cache import ResponseCache
+from llm_scheduler import SuggestionScheduler
+from frame_cache import FrameCache
+from traffic_recorder import TrafficRecorder, RECORD_TRAFFIC, OPEN, IN, CLOSE
+from utils import log_event, encode_message, preview
+from message_store import MessageStore
+from media_store import MediaStore
+from thumbnails import ThumbnailCache
+from binary_frames import read_header, frame_to_message
+from router import Router
+from motion_channel import MotionChannel, MOTION_COMMANDS, STOP_COMMAND
+from zoom_status import ZoomStatusFeed
+from heartbeat import Heartbeat
+from call_session import (
+    CallSession, ROBOT, PARTICIPANT, WIZARD, WAITING
+)
 
 
 load_dotenv()
@@ -19,17 +31,21 @@ PATH_TEMI = '/temi'
 PATH_CONTROL = '/control'
 PATH_PARTICIPANT = '/participant'
 LOG_FILE = 'participant_data/log.log'
-MESSAGES_FILE = 'participant_data/messages.json'
-UPLOAD_DIR = "participant_data/media"
-MEDIA_INDEX_FILE = os.path.join(UPLOAD_DIR, "display_list.txt")
-
-
-try:
-    with open(MESSAGES_FILE, 'r') as f:
-        MESSAGES = json.load(f)
-except Exception as e:
-    print('[ERROR] No messages file. Set to empty')
-    MESSAGES = []
+# the default session lives in participant_data/ itself; every other
+# robot/household gets participant_data/sessions/<id>/
+DATA_DIR = 'participant_data'
+SESSIONS_DIR = os.path.join(DATA_DIR, 'sessions')
+DEFAULT_SESSION = 'default'
+# relative to a session's data dir
+MESSAGES_FILE = 'messages.json'
+MESSAGES_JOURNAL = 'messages.jsonl'
+SUMMARY_FILE = 'summary.json'
+UPLOAD_DIR = 'media'
+MEDIA_INDEX_FILE = os.path.join(UPLOAD_DIR, 'display_list.txt')
+# thumbnails are stored by content hash, so all sessions share them
+THUMB_DIR = os.path.join(DATA_DIR, UPLOAD_DIR, 'thumbs')
+# how long a dropped resumable client can come back and resume
+RESUME_TTL = float(os.environ.get('RESUME_TTL', 60))
 
 
 
@@ -42,400 +58,736 @@ photo, video
 REACTIVE = 'reactive'
 PROACTIVE = 'proactive'
 
+# where binary image frames go, by source path and frame type
+BINARY_ROUTES = {
+    PATH_TEMI: {
+        'screenshot': [PATH_CONTROL],
+        'snapshot': [PATH_CONTROL],
+        'camera': [PATH_CONTROL],
+    },
+    PATH_PARTICIPANT: {
+        'screenshot': [PATH_CONTROL],
+    },
+    PATH_CONTROL: {},
+}
+# frames from the robot's camera, kept for image-grounded suggestions.
+# As JSON only `snapshot` carries an image; a JSON `camera` message is
+# camera status (e.g. 'ready') and is just forwarded
+CAMERA_FRAMES = ('snapshot', 'camera')
+
+control_routes = Router('control', 'command')
+temi_routes = Router('temi', 'type')
+participant_routes = Router('participant', 'command')
+
+# messages that are only relayed, declared here rather than handled
+control_routes.forward([
+    'takePicture', 'queryLocations', 'goTo',
+    # TODO: startVideo behavior should differ depending on
+    # self.behavior_mode
+    'startVideo', 'stopVideo'], PATH_TEMI)
+control_routes.forward('displayMode', PATH_TEMI, PATH_PARTICIPANT)
+control_routes.forward('allowCapture', PATH_PARTICIPANT)
+
+temi_routes.forward([
+    'saved_locations', 'media_prefetched',
+    'screenshot', 'video_recording', 'camera'], PATH_CONTROL)
+temi_routes.forward(['declined_share', 'video_capture'], PATH_PARTICIPANT)
+
 
 class WebSocketServer:
-    def __init__(self):
+    '''
+    Everything about one robot/household: its sockets, conversation,
+    call, media and behavior mode. Messages only ever go to the sockets
+    of the same session (see sessions.Sessions).
+    '''
+
+    def __init__(self, session_id=DEFAULT_SESSION, data_dir=DATA_DIR,
+                 thumbs=None, llm_cache=None):
+        self.session_id = session_id
+        self.data_dir = data_dir
+        # added to URLs handed to clients so they resolve to this session
+        self.query = ('' if session_id == DEFAULT_SESSION
+                      else f'?session={session_id}')
+        self.upload_dir = os.path.join(data_dir, UPLOAD_DIR)
+        os.makedirs(self.upload_dir, exist_ok=True)
         self.connections = {
             PATH_TEMI: set(),
             PATH_CONTROL: set(),
             PATH_PARTICIPANT: set()
         }
-        self.zoom_status_call_start = 0
-        self.zoom_status_robot = None
-        self.zoom_status_participant = None
+        self.call = CallSession(
+            on_change=self._on_call_change,
+            on_timeout=self._on_call_timeout)
+        # pushes zoom_status to /control clients that subscribed
+        self.zoom_feed = ZoomStatusFeed(PATH_CONTROL, self.zoom_status)
+        # pings resumable clients and evicts the silent ones
+        self.heartbeat = Heartbeat()
+        # closed resumable clients by path and token, still buffering
+        # messages until they resume or RESUME_TTL passes
+        self.detached = {path: {} for path in self.connections}
+        self.resumes = {'resumed': 0, 'failed': 0, 'expired': 0}
         self.behavior_mode = None
         self.last_displayed = None
+        self.message_store = MessageStore(
+            os.path.join(data_dir, MESSAGES_FILE),
+            os.path.join(data_dir, MESSAGES_JOURNAL))
         self.messages = self._load_messages()
+        # bounded history + rolling summary for the LLM
+        self.llm_context = ContextBuilder(
+            summarize_messages, os.path.join(data_dir, SUMMARY_FILE)).load()
+        # repeated / concurrent suggestions for the same conversation
+        self.llm_cache = ResponseCache() if llm_cache is None else llm_cache
+        # one suggestion at a time, for the newest message
+        self.suggestions = SuggestionScheduler()
+        # latest camera frames, so suggestions can see without a capture
+        self.frames = FrameCache()
+        self.media = MediaStore(
+            self.upload_dir, os.path.join(data_dir, MEDIA_INDEX_FILE)).load()
+        # a shared cache is closed by whoever passed it in
+        self.own_thumbs = thumbs is None
+        self.thumbs = ThumbnailCache(THUMB_DIR).load() if thumbs is None \
+            else thumbs
+        self.path_handlers = {
+            PATH_TEMI: self.temi_handler,
+            PATH_CONTROL: self.control_handler,
+            PATH_PARTICIPANT: self.participant_handler,
+        }
+        # teleop commands from /control and /participant to the robot
+        self.motion = MotionChannel(
+            lambda msg: self.send_message(PATH_TEMI, msg),
+            lambda msg: self.send_urgent(PATH_TEMI, msg))
+        # keep references to fire-and-forget tasks so they aren't GC'd
+        self.background_tasks = set()
+        # full websocket capture for benchmarks/replay.py, if enabled
+        self.recorder = (TrafficRecorder.for_session(data_dir, session_id)
+                         if RECORD_TRAFFIC else None)
 
 
-    def _load_messages(self):
-        try:
-            with open(MESSAGES_FILE, 'r') as f:
-                return json.load(f)
-        except Exception:
-            print('[ERROR] No messages file. Set to empty')
-            return []
+    def zoom_status(self):
+        return self.call.status()
 
-    def save_messages(self):
-        with open(MESSAGES_FILE, 'w') as f:
-            json.dump(self.messages, f, indent=4)
+    def _load_messages(self):
+        return self.message_store.load()
+
+    def save_message(self, message):
+        # appended to the journal in the background; self.messages is
+        # the store's own list so it is already up to date
+        self.message_store.append(message)
+
+    async def stop(self):
+        self.motion.close()
+        self.call.close()
+        self.zoom_feed.close()
+        self.heartbeat.close()
+        if self.own_thumbs:
+            self.thumbs.close()
+        self.llm_context.close()
+        self.suggestions.close()
+        for clients in self.connections.values():
+            for client in list(clients):
+                client.close()
+        await self.message_store.close()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def where(self, path):
+        # a path as logged: /control, or /control/<id> for other sessions
+        if self.session_id == DEFAULT_SESSION:
+            return path
+        return f'{path}/{self.session_id}'
+
+    def join(self, client):
+        client.session = self
+        client.recorder = self.recorder
+        self.connections[client.path].add(client)
+        if client.resumable:
+            self.heartbeat.add(client)
+        # a resumable client's open is recorded by `resume`, with how it
+        # went
+        if self.recorder is not None and not client.resumable:
+            self.recorder.record(
+                OPEN, client.id, client.path, {'binary': client.binary})
+
+    def leave(self, client):
+        self.connections[client.path].discard(client)
+        self.zoom_feed.unsubscribe(client)
+        self.heartbeat.discard(client)
+        if client.resumable and client.closed:
+            self._expire_detached()
+            self.detached[client.path][client.token] = client
+        if self.recorder is not None:
+            self.recorder.record(CLOSE, client.id, client.path)
+
+    def _expire_detached(self):
+        cutoff = time.monotonic() - RESUME_TTL
+        for detached in self.detached.values():
+            for token, client in list(detached.items()):
+                if client.closed_at < cutoff:
+                    del detached[token]
+                    self.resumes['expired'] += 1
+
+    async def resume(self, client, token=None, seq=None):
+        '''
+        Called when a resumable client connects. With the `token` of its
+        previous connection and the last `seq` it got, that connection's
+        buffered messages after `seq` are sent first. Then `hello` tells
+        the client the token for this connection and whether it resumed;
+        if not, it has to identify and reload as usual.
+        '''
+        self._expire_detached()
+        replayed = None
+        if token:
+            for other in list(self.connections[client.path]):
+                if other.token == token and other is not client:
+                    # it reconnected before the old socket was noticed
+                    # dead; that socket is gone for sure now
+                    self.heartbeat.evict(other, 'resumed elsewhere')
+        old = self.detached[client.path].pop(token, None) if token else None
+        if old is not None:
+            try:
+                replayed = client.take_over(old, int(seq))
+            except (TypeError, ValueError):
+                pass
+        if token and token != 'new':
+            self.resumes['failed' if replayed is None else 'resumed'] += 1
+        if self.recorder is not None:
+            self.recorder.record(OPEN, client.id, client.path, {
+                'binary': client.binary,
+                'resume': token,
+                'seq': seq,
+                'token': client.token,
+                'resumed': replayed is not None,
+            })
+        await self.send_to(client, {
+            'type': 'hello',
+            'data': {
+                'token': client.token,
+                'resumed': replayed is not None,
+                'replayed': replayed or 0,
+                'heartbeat': self.heartbeat.interval
+            }
+        })
 
-    async def handle_connection(self, websocket, ws_path):
-        self.connections[ws_path].add(websocket)
-        try:
-            while True:
-                message = await websocket.receive_text()
-                print(message[:100])
-                log_event('received', ws_path, message[:100])
-                if message == '':
-                    pass
-                if ws_path == PATH_TEMI:
-                    await self.temi_handler(websocket, message)
-                elif ws_path == PATH_CONTROL:
-                    await self.control_handler(websocket, message)
-                elif ws_path == PATH_PARTICIPANT:
-                    await self.participant_handler(websocket, message)
-                else:
-                    # No handler for this path; close the connection.
-                    return
-        except WebSocketDisconnect:
-            print(f"[{ws_path}] Disconnected")
-        finally:
-            if websocket in self.connections[ws_path]:
-                self.connections[ws_path].remove(websocket)
-            print(self.connections)
+    def resume_stats(self):
+        return {
+            **self.resumes,
+            'detached': sum(len(d) for d in self.detached.values()),
+            'heartbeat': self.heartbeat.stats(),
+        }
 
-    async def send_message(self, group, message):
-        # we really just expect one to be in the set
-        print(f'Sending message to {group}: {str(message)[:100]}')
-        log_event('sent', group, str(message)[:100])
-        for connection in self.connections[group]:
-            await connection.send_json(message)
-            # try:
-            #     await connection.send(json.dumps(message))
-            # except Exception as e:
-            #     print(e)
-
-    async def control_handler(self, websocket, message):
-        # TODO: Check if Temi wants message or msg_json
-        try:
-            msg_json = json.loads(message)
-        except Exception as e:
-            print(f'[ERROR][control_handler]: {e}')
-            return
-        if 'command' not in msg_json:
+    def run_in_background(self, coro):
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    def request_suggestion(self, with_image=False, debounce=True):
+        '''
+        Schedules a suggestion for the latest message, superseding any
+        still pending or streaming for an older one.
+        '''
+        all_messages = list(self.messages)
+        if not all_messages:
             return
-        if msg_json['command'] == 'speak':
-            self.messages.append({
-                'role': 'assistant',
-                'content': msg_json['payload']
+        # messages are never removed, so the index identifies one
+        message_id = len(all_messages) - 1
+        self.suggestions.schedule(
+            message_id,
+            lambda: self.suggest_response(all_messages, with_image, message_id),
+            debounce=debounce)
+
+    async def grounding_image(self):
+        '''
+        The freshest camera frame, encoded for the model. The robot is only
+        asked to take a picture when the cached frames are too old.
+        '''
+        frame = self.frames.latest()
+        if frame is None:
+            await self.send_message(PATH_TEMI, {
+                'command': 'takePicture',
+                'payload': ''
             })
-            self.save_messages()
-            await self.send_message(PATH_TEMI, msg_json)
-
-        elif msg_json['command'] == 'generate_response':
-            img_path = None
-            with_image = msg_json['payload']
-            if with_image:
-                # TODO
-                # capture an image from Temi
-                # include the path 
-                # img_path = 
-                pass
-            res = generate_response(self.messages, img_path)
-            if res:
-                msg_2 = {
-                    'type': 'suggested_response',
-                    'data': res
-                }
-                await self.send_message(PATH_CONTROL, msg_2)
-
-        elif msg_json['command'] == 'displayMedia':
-            self.last_displayed = msg_json['payload']
-            await self.send_message(PATH_TEMI, msg_json)
-
-        elif msg_json['command'] == 'displayFace':
-            self.last_displayed = None
-            await self.send_message(PATH_TEMI, msg_json)
-
-        elif msg_json['command'] == 'displayMode':
-            await self.send_message(PATH_TEMI, msg_json)
-            await self.send_message(PATH_PARTICIPANT, msg_json)
-
-        elif msg_json['command'] == 'refreshScreenShot':
-            if msg_json['payload'] == 'temi':
-                await self.send_message(PATH_TEMI, msg_json)
-            elif msg_json['payload'] == 'web':
-                await self.send_message(PATH_PARTICIPANT, msg_json)
-
-        elif msg_json['command'] in [
-                'skidJoy', 'takePicture',
-                'tiltBy', 'tiltAngle', 'stopMovement', 'turnBy',
-                'queryLocations', 'goTo']:
-            await self.send_message(PATH_TEMI, msg_json)
-
-        elif msg_json['command'] == 'navigateCamera':
-            # for this project: whenever its admin capturing,
-            #  we always do it headless
-            msg_json['payload'] = 'headless'
-            await self.send_message(PATH_TEMI, msg_json)
-
-        elif msg_json['command'] == 'startVideo':
-            # TODO: behavior should differ depending on 
-            # self.behavior_mode
-            await self.send_message(PATH_TEMI, msg_json)
-
-        elif msg_json['command'] == 'stopVideo':
-            # TODO:
-            await self.send_message(PATH_TEMI, msg_json)
-
-        elif msg_json['command'] == 'changeMode':
-            self.behavior_mode = msg_json['payload']
+            frame = await self.frames.wait()
+            if frame is None:
+                print('[ERROR][grounding_image]: no picture from temi, '
+                      'suggesting without one')
+                return None
+        return await self.frames.image(frame)
+
+    async def suggest_response(self, all_messages, with_image=False,
+                               message_id=None):
+        '''
+        Streams an LLM suggestion to the wizard dashboard.
+        Text so far is sent as `suggested_response_partial` while tokens
+        arrive, then the full text as the usual `suggested_response`.
+        Both carry the id of the message being answered.
+        '''
+        img_path = await self.grounding_image() if with_image else None
+        res = ''
+        try:
+            async for delta in generate_response_stream(
+                    all_messages, img_path, self.llm_context, self.llm_cache):
+                res += delta
+                await self.send_message(PATH_CONTROL, {
+                    'type': 'suggested_response_partial',
+                    'data': res,
+                    'message_id': message_id
+                })
+        except Exception:
+            # logged by llm_model; a cut-off answer is not sent as final
+            return
+        if res:
             msg = {
-                'type': 'behavior_mode',
-                'data': self.behavior_mode
+                'type': 'suggested_response',
+                'data': res,
+                'message_id': message_id
             }
             await self.send_message(PATH_CONTROL, msg)
-            await self.send_message(PATH_PARTICIPANT, msg)
-            await self.send_message(PATH_TEMI, msg_json)
 
-        elif msg_json['command'] == 'allowCapture':
-            await self.send_message(PATH_PARTICIPANT, msg_json)
-
-        elif msg_json['command'] == 'zoomToken':
-            msg_json['payload'] = ZOOM_JWT
-            await self.send_message(PATH_TEMI, msg_json)
-
-        elif msg_json['command'] == 'video_call':
-            action = msg_json['payload']
-            if action == 'proactive_call':
-                self.zoom_status_robot = 'ringing'
-                self.zoom_status_participant = 'ringing'
-                participant_msg = {
-                    'type': 'video_call',
-                    'data': action
-                }
-                await self.send_message(PATH_TEMI, msg_json)
-                await self.send_message(PATH_PARTICIPANT, participant_msg)
-            elif action == 'end':
-                self.zoom_status_robot = None
-                self.zoom_status_participant = None
-                call_duration = time.time() - self.zoom_status_call_start
-                print(f'Call ended. Lasted {call_duration} seconds.')
-                participant_msg = {
-                    'type': 'video_call',
-                    'data': 'end'
-                }
-                await self.send_message(PATH_TEMI, msg_json)
-                await self.send_message(PATH_PARTICIPANT, participant_msg)
-            elif action == "ending_alert":
-                participant_msg = {
-                    'type': 'video_call',
-                    'data': 'ending_alert'
-                }
-                await self.send_message(PATH_TEMI, msg_json)
-                await self.send_message(PATH_PARTICIPANT, participant_msg)
-
-        elif msg_json['command'] == 'identify':
-            if msg_json.get('payload') == 'webpage':
-                msg = {
-                    'type': 'initial_status',
-                    'data': {
-                        'behavior_mode': self.behavior_mode,
-                        'last_displayed': self.last_displayed
-                    }
-                }
-                await self.send_message(PATH_CONTROL, msg)
+    async def receive(self, client, frame):
+        '''
+        Handles one websocket frame from `client`.
+        '''
+        ws_path = client.path
+        client.last_seen = time.monotonic()
+        if self.recorder is not None:
+            data = frame.get('bytes')
+            self.recorder.record(
+                IN, client.id, ws_path,
+                frame.get('text') if data is None else data)
+        if frame.get('bytes') is not None:
+            await self.binary_handler(ws_path, frame['bytes'])
+            return
+        message = frame['text']
+        print(message[:100])
+        log_event('received', self.where(ws_path), message[:100])
+        handler = self.path_handlers.get(ws_path)
+        if handler is not None:
+            await handler(client, message)
 
-        elif msg_json['command'] == 'zoom_status':
-            call_duration = None
-            if self.zoom_status_robot == 'connected':
-                call_duration = time.time() - self.zoom_status_call_start
-            msg = {
-                'type': 'zoom_status',
-                'data': {
-                    'participant': self.zoom_status_participant,
-                    'robot': self.zoom_status_robot,
-                    'call_duration': call_duration
-                }
+    async def send_message(self, group, message):
+        '''
+        Queues the message for every client in the group and returns
+        right away; each client's writer task does the actual send.
+        '''
+        summary = preview(message)
+        print(f'Sending message to {self.where(group)}: {summary}')
+        log_event('sent', self.where(group), summary)
+        clients = self.connections[group]
+        detached = self.detached[group]
+        if not clients and not detached:
+            return
+        # encoded once, the same text goes to every client
+        text = encode_message(message)
+        for client in list(clients):
+            client.enqueue(message, text)
+        # only buffered, for when they resume
+        for client in list(detached.values()):
+            client.enqueue(message, text)
+
+    async def send_urgent(self, group, message):
+        '''
+        Like send_message, but ahead of everything already queued for
+        the group, dropping queued motion commands (see enqueue).
+        '''
+        summary = preview(message)
+        print(f'Sending urgent message to {self.where(group)}: {summary}')
+        log_event('sent', self.where(group), summary)
+        text = encode_message(message)
+        for client in list(self.connections[group]):
+            client.enqueue(message, text, urgent=True)
+        for client in list(self.detached[group].values()):
+            client.enqueue(message, text)
+
+    async def send_to(self, client, message):
+        '''
+        Like send_message, but only to the one client.
+        '''
+        summary = preview(message)
+        print(f'Sending message to {client}: {summary}')
+        log_event('sent', self.where(client.path), summary)
+        client.enqueue(message, encode_message(message))
+
+    def warm_thumbnails(self, filename):
+        # so the dashboard grid doesn't wait for the first render
+        self.run_in_background(self.thumbs.warm(
+            self.media.get(filename), self.media.path(filename)))
+
+    async def media_changed(self, op, media):
+        '''
+        Change feed for the media index. Uploads only concern the wizard;
+        shares also go to the participant. `version` lets a client that
+        missed one refetch /api/media-list.
+        '''
+        msg = {
+            'type': 'media_index',
+            'data': {
+                'op': op,
+                'version': self.media.version,
+                'media': media
             }
-            await self.send_message(PATH_CONTROL, msg)
+        }
+        await self.send_message(PATH_CONTROL, msg)
+        if op == 'share':
+            await self.send_message(PATH_PARTICIPANT, msg)
 
-    async def temi_handler(self, websocket, message):
+    async def send_frame(self, group, header, frame):
+        '''
+        Forwards a binary frame untouched to clients that take binary,
+        and as a JSON message (built at most once) to the rest.
+        '''
+        summary = f'{header} <{len(frame)} bytes>'
+        print(f'Sending frame to {self.where(group)}: {summary}')
+        log_event('sent', self.where(group), summary)
+        text = None
+        for client in list(self.connections[group]):
+            if client.binary:
+                client.enqueue(header, frame)
+                continue
+            if text is None:
+                text = encode_message(frame_to_message(frame))
+            client.enqueue(header, text)
+
+    async def binary_handler(self, ws_path, frame):
         try:
-            msg_json = json.loads(message)
-        except Exception as e:
-            print(f'[ERROR][temi_handler]: {e}')
+            header, offset = read_header(frame)
+        except ValueError as e:
+            print(f'[ERROR][binary_handler]: {e}')
             return
-        if msg_json['type'] == 'asr_result':
-            self.messages.append({
-                'role': 'user',
-                'content': msg_json['data']
-            })
-            self.save_messages()
-            await self.send_message(PATH_CONTROL, msg_json)
-            # generate response from gpt and send to controller dashboard
-            res = generate_response(self.messages)
-            if res:
-                msg_2 = {
-                    'type': 'suggested_response',
-                    'data': res
-                }
-                await self.send_message(PATH_CONTROL, msg_2)
-        
-        elif msg_json['type'] == 'saved_locations':
-            locations = msg_json.get("data", [])
-            print(f"Received locations: {locations}")
-            await self.send_message(PATH_CONTROL, msg_json)
-
-        elif msg_json['type'] in [
-                'screenshot', 'snapshot', 'video_recording', 'camera']:
-            await self.send_message(PATH_CONTROL, msg_json)
-
-        elif msg_json['type'] == 'declined_share':
-            await self.send_message(PATH_PARTICIPANT, msg_json)
+        summary = f'{header} <{len(frame)} bytes>'
+        print(summary)
+        log_event('received', self.where(ws_path), summary)
+        if ws_path == PATH_TEMI and header['type'] in CAMERA_FRAMES:
+            self.frames.add(header['type'], data=bytes(frame[offset:]))
+        for group in BINARY_ROUTES[ws_path].get(header['type'], []):
+            await self.send_frame(group, header, frame)
+
+    def client_stats(self):
+        return {
+            path: [client.stats() for client in clients]
+            for path, clients in self.connections.items()
+        }
 
-        elif msg_json['type'] == 'video_capture':
-            await self.send_message(PATH_PARTICIPANT, msg_json)
+    async def control_handler(self, client, message):
+        # TODO: Check if Temi wants message or msg_json
+        await control_routes.handle(self, client, message)
+
+    async def temi_handler(self, client, message):
+        await temi_routes.handle(self, client, message)
 
-        elif msg_json['type'] == 'share_media':
-            filename = msg_json['data']
-            with open(MEDIA_INDEX_FILE, "a") as f:
-                f.write(f"{filename}\n")
+    async def participant_handler(self, client, message):
+        await participant_routes.handle(self, client, message)
+
+    def route_stats(self):
+        return {
+            router.name: router.stats_dict()
+            for router in (control_routes, temi_routes, participant_routes)
+        }
 
-            await self.send_message(PATH_CONTROL, {
-                "type": "media_uploaded",
-                "filename": filename,
-                "url": f"/view/{filename}"
+    # ---- video call ----
+
+    def _on_call_change(self, transition):
+        log_event('call', transition.side,
+                  f'{transition.event}: '
+                  f'{transition.prev_robot}/{transition.prev_participant} -> '
+                  f'{transition.robot}/{transition.participant}')
+        if transition.duration is not None:
+            print(f'Call ended. Lasted {transition.duration} seconds.')
+        self.zoom_feed.changed()
+
+    def _on_call_timeout(self, transition):
+        # nobody picked up in time; tell everyone to hang up
+        self.run_in_background(self._dismiss_call())
+
+    async def _dismiss_call(self):
+        await self.send_message(PATH_TEMI, {
+            'command': 'video_call',
+            'payload': 'dismiss'
+        })
+        laptop_msg = {
+            'type': 'video_call',
+            'data': 'dismiss'
+        }
+        await self.send_message(PATH_PARTICIPANT, laptop_msg)
+        await self.send_message(PATH_CONTROL, laptop_msg)
+
+    async def _answer_call(self, side):
+        '''
+        Returns True if the answer was fully handled here and should not
+        be relayed as-is.
+        '''
+        t = self.call.fire(
+            'answer', side, proactive=self.behavior_mode == PROACTIVE)
+        if WAITING in (t.robot, t.participant):
+            # proactive mode: wait for the other side to pick up too
+            return True
+        if WAITING in (t.prev_robot, t.prev_participant):
+            robot_msg = {
+                'command': 'video_call',
+                'payload': 'connected'
+            }
+            laptop_msg = {
+                'type': 'video_call',
+                'data': 'connected'
+            }
+            await self.send_message(PATH_PARTICIPANT, laptop_msg)
+            await self.send_message(PATH_CONTROL, laptop_msg)
+            await self.send_message(PATH_TEMI, robot_msg)
+            return True
+        return False
+
+    # ---- teleop, from /control and /participant ----
+
+    @control_routes.on(*MOTION_COMMANDS, STOP_COMMAND)
+    @participant_routes.on(*MOTION_COMMANDS, STOP_COMMAND)
+    async def motion_command(self, client, msg_json):
+        await self.motion.submit(msg_json)
+
+    # ---- /control ----
+
+    @control_routes.on('speak')
+    async def control_speak(self, client, msg_json):
+        self.save_message({
+            'role': 'assistant',
+            'content': msg_json['payload']
+        })
+        await self.send_message(PATH_TEMI, msg_json)
+
+    @control_routes.on('generate_response')
+    async def control_generate_response(self, client, msg_json):
+        # payload: whether the suggestion should see the robot's view
+        with_image = bool(msg_json['payload'])
+        # runs as its own task so this socket keeps being served
+        # while the completion streams in
+        self.request_suggestion(with_image, debounce=False)
+
+    @control_routes.on('displayMedia')
+    async def control_display_media(self, client, msg_json):
+        self.last_displayed = msg_json['payload']
+        await self.send_message(PATH_TEMI, msg_json)
+
+    @control_routes.on('prefetchMedia')
+    async def control_prefetch_media(self, client, msg_json):
+        '''
+        Lets the robot download media ahead of a displayMedia, e.g. as
+        soon as the wizard opens it. The payload is a filename or a list
+        of them; Temi gets url, hash and size for each known one.
+        '''
+        names = msg_json['payload']
+        if isinstance(names, str):
+            names = [names]
+        items = []
+        for name in names:
+            media = self.media.get(name)
+            if media is None:
+                continue
+            items.append({
+                'filename': name,
+                'url': f'/media/{name}{self.query}',
+                'sha256': media['sha256'],
+                'size': media['size'],
+                'mime': media['mime']
             })
-            await self.send_message(PATH_PARTICIPANT, {
-                "type": "media_uploaded",
-                "filename": filename,
-                "url": f"/view/{filename}"
+        if items:
+            await self.send_message(PATH_TEMI, {
+                'command': 'prefetchMedia',
+                'payload': items
             })
 
-        elif msg_json['type'] == 'video_call':
-            action = msg_json.get("data")
-            if action == 'start':
-                self.zoom_status_robot = 'calling'
-                self.zoom_status_participant = 'ringing'
-            elif action == 'end':
-                self.zoom_status_robot = None
-                self.zoom_status_participant = None
-                call_duration = time.time() - self.zoom_status_call_start
-                print(f'Call ended. Lasted {call_duration} seconds.')
-            elif action == 'answer':
-                if self.behavior_mode == PROACTIVE:
-                    if self.zoom_status_participant == 'ringing':
-                        self.zoom_status_robot = 'waiting'
-                        return
-                    elif self.zoom_status_participant == 'waiting':
-                        self.zoom_status_robot = 'connected'
-                        self.zoom_status_participant = 'connected'
-                        robot_msg = {
-                            'command': 'video_call',
-                            'payload': 'connected'
-                        }
-                        laptop_msg = {
-                            'type': 'video_call',
-                            'data': 'connected'
-                        }
-                        self.zoom_status_call_start = time.time()
-                        await self.send_message(PATH_PARTICIPANT, laptop_msg)
-                        await self.send_message(PATH_CONTROL, laptop_msg)
-                        await self.send_message(PATH_TEMI, robot_msg)
-                        return
-
-                self.zoom_status_robot = 'connected'
-                self.zoom_status_participant = 'connected'
-                self.zoom_status_call_start = time.time()
-            elif action == 'dismiss':
-                self.zoom_status_robot = None
-                self.zoom_status_participant = None
-            await self.send_message(PATH_PARTICIPANT, msg_json)
-            await self.send_message(PATH_CONTROL, msg_json)
+    @control_routes.on('displayFace')
+    async def control_display_face(self, client, msg_json):
+        self.last_displayed = None
+        await self.send_message(PATH_TEMI, msg_json)
 
-    async def participant_handler(self, websocket, message):
-        try:
-            msg_json = json.loads(message)
-        except Exception as e:
-            print(f'[ERROR][control_handler]: {e}')
-            return
-        if 'command' not in msg_json:
-            return
-        if msg_json['command'] in [
-                'skidJoy', 'tiltBy', 'tiltAngle',
-                'stopMovement', 'turnBy']:
+    @control_routes.on('refreshScreenShot')
+    async def control_refresh_screenshot(self, client, msg_json):
+        if msg_json['payload'] == 'temi':
             await self.send_message(PATH_TEMI, msg_json)
+        elif msg_json['payload'] == 'web':
+            await self.send_message(PATH_PARTICIPANT, msg_json)
 
-        elif msg_json['command'] == 'video_call':
-            if msg_json['payload'] == 'answer':
-                if self.behavior_mode == PROACTIVE:
-                    if self.zoom_status_robot == 'ringing':
-                        self.zoom_status_participant = 'waiting'
-                        return
-                    elif self.zoom_status_robot == 'waiting':
-                        self.zoom_status_robot = 'connected'
-                        self.zoom_status_participant = 'connected'
-                        robot_msg = {
-                            'command': 'video_call',
-                            'payload': 'connected'
-                        }
-                        laptop_msg = {
-                            'type': 'video_call',
-                            'data': 'connected'
-                        }
-                        self.zoom_status_call_start = time.time()
-                        await self.send_message(PATH_PARTICIPANT, laptop_msg)
-                        await self.send_message(PATH_CONTROL, laptop_msg)
-                        await self.send_message(PATH_TEMI, robot_msg)
-                        return
-                else:
-                    self.zoom_status_robot = 'connected'
-                    self.zoom_status_participant = 'connected'
-                    self.zoom_status_call_start = time.time()
-            elif msg_json['payload'] == 'dismiss':
-                self.zoom_status_robot = None
-                self.zoom_status_participant = None
-            elif msg_json['payload'] == 'start':
-                self.zoom_status_participant = 'calling'
-                self.zoom_status_robot = 'ringing'
-            elif msg_json['payload'] == 'end':
-                self.zoom_status_robot = None
-                self.zoom_status_participant = None
-                call_duration = time.time() - self.zoom_status_call_start
-                print(f'Call ended. Lasted {call_duration} seconds.')
-                laptop_msg = {
-                    'type': 'video_call',
-                    'data': 'end'
-                }
-                await self.send_message(PATH_TEMI, msg_json)
-                await self.send_message(PATH_CONTROL, laptop_msg)
-                return
+    @control_routes.on('navigateCamera')
+    async def control_navigate_camera(self, client, msg_json):
+        # for this project: whenever its admin capturing,
+        #  we always do it headless
+        msg_json['payload'] = 'headless'
+        await self.send_message(PATH_TEMI, msg_json)
+
+    @control_routes.on('changeMode')
+    async def control_change_mode(self, client, msg_json):
+        self.behavior_mode = msg_json['payload']
+        msg = {
+            'type': 'behavior_mode',
+            'data': self.behavior_mode
+        }
+        await self.send_message(PATH_CONTROL, msg)
+        await self.send_message(PATH_PARTICIPANT, msg)
+        await self.send_message(PATH_TEMI, msg_json)
+
+    @control_routes.on('zoomToken')
+    async def control_zoom_token(self, client, msg_json):
+        msg_json['payload'] = ZOOM_JWT
+        await self.send_message(PATH_TEMI, msg_json)
+
+    @control_routes.on('video_call')
+    async def control_video_call(self, client, msg_json):
+        action = msg_json['payload']
+        if action in ('proactive_call', 'end'):
+            self.call.fire(action, WIZARD)
+        if action in ('proactive_call', 'end', 'ending_alert'):
+            participant_msg = {
+                'type': 'video_call',
+                'data': action
+            }
             await self.send_message(PATH_TEMI, msg_json)
-            await self.send_message(PATH_CONTROL, msg_json)
+            await self.send_message(PATH_PARTICIPANT, participant_msg)
 
-        elif msg_json['command'] == 'screenshot':
+    @control_routes.on('identify')
+    async def control_identify(self, client, msg_json):
+        if msg_json.get('payload') == 'webpage':
             msg = {
-                'type': 'screenshot',
-                'data': msg_json['payload']
+                'type': 'initial_status',
+                'data': {
+                    'behavior_mode': self.behavior_mode,
+                    'last_displayed': self.last_displayed
+                }
             }
             await self.send_message(PATH_CONTROL, msg)
 
-        elif msg_json['command'] == 'initiate_capture':
-            web_msg = {
-                'type': 'initiate_capture',
-                'data': msg_json['payload']
-            }
-            await self.send_message(PATH_CONTROL, web_msg)
-            # robot msg
-            # for this project: whenever its admin capturing,
-            # we always do it headless
-            robot_msg = {
-                'command': 'navigateCamera',
-                'payload': 'headless'
+    @control_routes.on('pong')
+    @temi_routes.on('pong')
+    @participant_routes.on('pong')
+    async def pong(self, client, msg_json):
+        # answer to a heartbeat ping; receive() already noted the client
+        # is alive
+        pass
+
+    @control_routes.on('zoom_status')
+    async def control_zoom_status(self, client, msg_json):
+        # 'subscribe' opts into pushed updates; a plain zoom_status is
+        # still answered, so polling clients keep working
+        if msg_json.get('payload') == 'subscribe':
+            self.zoom_feed.subscribe(client)
+        elif msg_json.get('payload') == 'unsubscribe':
+            self.zoom_feed.unsubscribe(client)
+        msg = {
+            'type': 'zoom_status',
+            'data': self.zoom_status()
+        }
+        await self.send_to(client, msg)
+
+    # ---- /temi ----
+
+    @temi_routes.on('snapshot')
+    async def temi_snapshot(self, client, msg_json):
+        # JSON form of a camera frame: base64 JPEG in `data`, only
+        # decoded if a suggestion uses it
+        data = msg_json.get('data')
+        if isinstance(data, str):
+            self.frames.add('snapshot', data=data)
+        await self.send_message(PATH_CONTROL, msg_json)
+
+    @temi_routes.on('asr_result')
+    async def temi_asr_result(self, client, msg_json):
+        self.save_message({
+            'role': 'user',
+            'content': msg_json['data']
+        })
+        await self.send_message(PATH_CONTROL, msg_json)
+        # generate response from gpt and send to controller dashboard
+        self.request_suggestion()
+
+    @temi_routes.on('share_media')
+    async def temi_share_media(self, client, msg_json):
+        # `data` is the name /upload returned; with `sha256` (also
+        # returned) the right file is found even if the name was taken
+        requested = msg_json['data']
+        filename = self.media.resolve(requested, msg_json.get('sha256'))
+        if filename is None or \
+                not await asyncio.to_thread(self.media.share, filename):
+            print(f'[ERROR][temi_share_media]: unknown or ambiguous media '
+                  f'{requested}, send its sha256')
+            return
+        await self.media_changed('share', self.media.get(filename))
+        self.warm_thumbnails(filename)
+
+        await self.send_message(PATH_CONTROL, {
+            "type": "media_uploaded",
+            "filename": filename,
+            "url": f"/view/{filename}{self.query}"
+        })
+        await self.send_message(PATH_PARTICIPANT, {
+            "type": "media_uploaded",
+            "filename": filename,
+            "url": f"/view/{filename}{self.query}"
+        })
+
+    @temi_routes.on('video_call')
+    async def temi_video_call(self, client, msg_json):
+        action = msg_json.get("data")
+        if action == 'answer':
+            if await self._answer_call(ROBOT):
+                return
+        else:
+            self.call.fire(action, ROBOT)
+        await self.send_message(PATH_PARTICIPANT, msg_json)
+        await self.send_message(PATH_CONTROL, msg_json)
+
+    # ---- /participant ----
+
+    @participant_routes.on('video_call')
+    async def participant_video_call(self, client, msg_json):
+        action = msg_json['payload']
+        if action == 'answer':
+            if await self._answer_call(PARTICIPANT):
+                return
+        else:
+            self.call.fire(action, PARTICIPANT)
+        if action == 'end':
+            laptop_msg = {
+                'type': 'video_call',
+                'data': 'end'
             }
-            await self.send_message(PATH_TEMI, robot_msg)
+            await self.send_message(PATH_TEMI, msg_json)
+            await self.send_message(PATH_CONTROL, laptop_msg)
+            return
+        await self.send_message(PATH_TEMI, msg_json)
+        await self.send_message(PATH_CONTROL, msg_json)
+
+    @participant_routes.on('screenshot')
+    async def participant_screenshot(self, client, msg_json):
+        msg = {
+            'type': 'screenshot',
+            'data': msg_json['payload']
+        }
+        await self.send_message(PATH_CONTROL, msg)
+
+    @participant_routes.on('initiate_capture')
+    async def participant_initiate_capture(self, client, msg_json):
+        web_msg = {
+            'type': 'initiate_capture',
+            'data': msg_json['payload']
+        }
+        await self.send_message(PATH_CONTROL, web_msg)
+        # robot msg
+        # for this project: whenever its admin capturing,
+        # we always do it headless
+        robot_msg = {
+            'command': 'navigateCamera',
+            'payload': 'headless'
+        }
+        await self.send_message(PATH_TEMI, robot_msg)
 
-        elif msg_json['command'] == 'identify':
-            if msg_json.get('payload') == 'webpage':
-                msg = {
-                    'type': 'initial_status',
-                    'data': {
-                        'behavior_mode': self.behavior_mode,
-                    }
+    @participant_routes.on('identify')
+    async def participant_identify(self, client, msg_json):
+        if msg_json.get('payload') == 'webpage':
+            msg = {
+                'type': 'initial_status',
+                'data': {
+                    'behavior_mode': self.behavior_mode,
                 }
-                await self.send_message(PATH_PARTICIPANT, msg)
+            }
+            await self.send_message(PATH_PARTICIPANT, msg)
 
 
 # server = WebSocketServer()
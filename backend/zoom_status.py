@@ -0,0 +1,93 @@
+import asyncio
+
+from utils import log_event, encode_message, preview
+
+
+# while a call is connected, subscribers get the duration this often
+ZOOM_STATUS_TICK = 15
+
+
+class ZoomStatusFeed:
+    '''
+    Pushes zoom_status to subscribed clients instead of having them poll.
+
+    `changed()` is called whenever the robot/participant call status is
+    set; the status is published once per event-loop iteration at most,
+    and only if it actually differs from what was last sent. While the
+    call is connected a slow tick re-sends it so the call duration stays
+    fresh.
+    '''
+
+    def __init__(self, path, get_status, tick_interval=ZOOM_STATUS_TICK):
+        self.path = path
+        # returns the current {'participant', 'robot', 'call_duration'}
+        self.get_status = get_status
+        self.tick_interval = tick_interval
+        self.subscribers = set()
+        self.published = 0
+        self._last = None
+        self._scheduled = False
+        self._ticker = None
+
+    def subscribe(self, client):
+        self.subscribers.add(client)
+        self._update_ticker(self.get_status())
+
+    def unsubscribe(self, client):
+        self.subscribers.discard(client)
+
+    def changed(self):
+        if self._scheduled:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._scheduled = True
+        loop.call_soon(self._publish_if_changed)
+
+    def _publish_if_changed(self):
+        self._scheduled = False
+        status = self.get_status()
+        key = (status['robot'], status['participant'])
+        if key != self._last:
+            self._last = key
+            self.publish(status)
+        self._update_ticker(status)
+
+    def publish(self, status=None):
+        if status is None:
+            status = self.get_status()
+        self.subscribers = {c for c in self.subscribers if not c.closed}
+        if not self.subscribers:
+            return
+        message = {
+            'type': 'zoom_status',
+            'data': status
+        }
+        log_event('sent', self.path, preview(message))
+        text = encode_message(message)
+        for client in self.subscribers:
+            client.enqueue(message, text)
+        self.published += 1
+
+    def _update_ticker(self, status):
+        ticking = self._ticker is not None and not self._ticker.done()
+        wanted = bool(self.subscribers) and status['call_duration'] is not None
+        if wanted and not ticking:
+            self._ticker = asyncio.create_task(self._tick())
+        elif not wanted and ticking:
+            self._ticker.cancel()
+            self._ticker = None
+
+    async def _tick(self):
+        while True:
+            await asyncio.sleep(self.tick_interval)
+            self.publish()
+            if not self.subscribers:
+                return
+
+    def close(self):
+        if self._ticker is not None:
+            self._ticker.cancel()
+            self._ticker = None
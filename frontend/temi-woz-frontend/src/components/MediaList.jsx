@@ -1,5 +1,5 @@
 import { useEffect, useState } from "react";
-import { getBackendUrl } from '../utils/utils';
+import { getBackendUrl, withSession } from '../utils/utils';
 
 
 export default function MediaList({ sendMessage, newMediaFile, displayedMedia }) {
@@ -10,10 +10,20 @@ export default function MediaList({ sendMessage, newMediaFile, displayedMedia })
   const backendUrl = getBackendUrl();
 
   useEffect(() => {
-    fetch(`${backendUrl}/api/media-list`)
-      .then((res) => res.json())
-      .then((data) => setFiles(data.files))
-      .catch((err) => console.error("Failed to fetch media list:", err));
+    // the list carries an ETag, so refetching when the tab comes back
+    // (and may have missed pushes) is a cheap 304 if nothing changed
+    const loadFiles = () => {
+      fetch(withSession(`${backendUrl}/api/media-list`), { cache: "no-cache" })
+        .then((res) => res.json())
+        .then((data) => setFiles(data.files))
+        .catch((err) => console.error("Failed to fetch media list:", err));
+    };
+    const onVisible = () => {
+      if (document.visibilityState === "visible") loadFiles();
+    };
+    loadFiles();
+    document.addEventListener("visibilitychange", onVisible);
+    return () => document.removeEventListener("visibilitychange", onVisible);
   }, []);
 
   useEffect(() => {
@@ -35,6 +45,13 @@ export default function MediaList({ sendMessage, newMediaFile, displayedMedia })
   const handleMediaClick = (filename) => {
     setModalMedia(filename);
     setModalOpen(true);
+    if (sendMessage) {
+      // let Temi start downloading while the wizard decides
+      sendMessage({
+        command: "prefetchMedia",
+        payload: filename
+      })
+    }
   }
 
   return (
@@ -80,7 +97,12 @@ export default function MediaList({ sendMessage, newMediaFile, displayedMedia })
                 >
                   {isImage && (
                     <img
-                      src={`${backendUrl}/media/${file}`}
+                      src={withSession(`${backendUrl}/thumbs/${file}?w=320`)}
+                      onError={(e) => {
+                        // no thumbnail (yet): fall back to the original
+                        e.currentTarget.onerror = null;
+                        e.currentTarget.src = withSession(`${backendUrl}/media/${file}`);
+                      }}
                       alt={file}
                       style={{
                         maxWidth: "100%",
@@ -92,7 +114,9 @@ export default function MediaList({ sendMessage, newMediaFile, displayedMedia })
                   )}
                   {isVideo && (
                     <video
-                      src={`${backendUrl}/media/${file}`}
+                      src={withSession(`${backendUrl}/media/${file}`)}
+                      poster={withSession(`${backendUrl}/thumbs/${file}?w=320`)}
+                      preload="none"
                       controls
                       style={{
                         maxWidth: "100%",
@@ -123,13 +147,13 @@ export default function MediaList({ sendMessage, newMediaFile, displayedMedia })
               <div className="modal-body text-center p-0 bg-black">
                 {/\.(jpg|jpeg|png|gif)$/i.test(modalMedia) ? (
                   <img
-                    src={`${backendUrl}/media/${modalMedia}`}
+                    src={withSession(`${backendUrl}/media/${modalMedia}`)}
                     alt={modalMedia}
                     className="img-fluid"
                   />
                 ) : (
                   <video
-                    src={`${backendUrl}/media/${modalMedia}`}
+                    src={withSession(`${backendUrl}/media/${modalMedia}`)}
                     controls
                     className="w-100"
                   />
@@ -8,7 +8,7 @@ import { connectWebSocket, sendMessageWS } from "../utils/ws";
 import { fetchZoomToken } from "../utils/utils"; 
 
 
-// TODO: periodic fetch current Zoom status and display
+// Zoom status is pushed by the server (subscribed on connect)
 
 
 const ObserverPage = () => {
@@ -30,18 +30,21 @@ const ObserverPage = () => {
     sendMessageWS(message);
   };
 
-  function useZoomStatusPoller(sendMessage, intervalMs = 2500) {
-    useEffect(() => {
-      const intervalId = setInterval(() => {
-        sendMessage({ command: "zoom_status" });
-      }, intervalMs);
-
-      return () => clearInterval(intervalId); // Cleanup on unmount
-    }, [sendMessage, intervalMs]);
-  }
-
-  // poll zoom call status
-  useZoomStatusPoller(sendMessage);
+  // zoom_status is pushed on changes plus a slow tick while connected;
+  // count the duration up locally in between
+  const [callDuration, setCallDuration] = useState(null);
+  useEffect(() => {
+    if (zoomStatus?.call_duration == null) {
+      setCallDuration(null);
+      return;
+    }
+    const receivedAt = Date.now();
+    setCallDuration(zoomStatus.call_duration);
+    const intervalId = setInterval(() => {
+      setCallDuration(zoomStatus.call_duration + (Date.now() - receivedAt) / 1000);
+    }, 1000);
+    return () => clearInterval(intervalId);
+  }, [zoomStatus]);
 
   function formatDuration(seconds) {
     if (seconds > 10000) {
@@ -77,7 +80,10 @@ const ObserverPage = () => {
       }
     }
     // share the path of the main control page
-    connectWebSocket(onWsMessage, "control");
+    const connection = connectWebSocket(onWsMessage, "control", {
+      onOpen: () => connection.send({ command: "zoom_status", payload: "subscribe" })
+    });
+    return () => connection.close();
   }, []);
 
 
@@ -181,9 +187,9 @@ const ObserverPage = () => {
                     <p><strong>Robot:</strong> {zoomStatus.robot || 'N/A'}</p>
                     <p><strong>Participant:</strong> {zoomStatus.participant || 'N/A'}</p>
                     <p>
-                      <strong>Call Duration:</strong> {formatDuration(zoomStatus.call_duration)}
+                      <strong>Call Duration:</strong> {formatDuration(callDuration)}
                     </p>
-                    {(zoomStatus.call_duration > 150) &&
+                    {(callDuration > 150) &&
                       <div className="alert alert-danger">
                         The call is getting close to duration limit:
                         <ol>
@@ -91,7 +91,8 @@ const ParticipantAsyncPage = () => {
         captureAndSend(sendMessage);
       }
     }
-    connectWebSocket(onWsMessage, "participant");
+    const connection = connectWebSocket(onWsMessage, "participant");
+    return () => connection.close();
   }, []);
 
 
@@ -75,7 +75,8 @@ const ParticipantSyncPage = () => {
         captureAndSend(sendMessage);
       }
     }
-    connectWebSocket(onWsMessage, "participant");
+    const connection = connectWebSocket(onWsMessage, "participant");
+    return () => connection.close();
   }, []);
 
 
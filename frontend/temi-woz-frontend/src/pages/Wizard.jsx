@@ -1,8 +1,9 @@
-import { useEffect, useState } from "react";
+import { useEffect, useRef, useState } from "react";
 import { connectWebSocket, sendMessageWS } from "../utils/ws";
 import MediaList from '../components/MediaList';
 import { useGamepadControls } from "../utils/useGamepadControls";
 import presetPhrases from "../utils/presetPhrases";
+import { imageSrc } from "../utils/utils";
 
 const WizardPage = () => {
 
@@ -30,6 +31,8 @@ const WizardPage = () => {
   const [startTime, setStartTime] = useState(null); // timestamp in ms
   const [now, setNow] = useState(null);
   const [timerActive, setTimerActive] = useState(false);
+  // id of the newest message a suggestion was received for
+  const suggestionFor = useRef(-1);
 
   const sendMessage = (message) => {
     sendMessageWS(message);
@@ -57,7 +60,13 @@ const WizardPage = () => {
       console.log(data)
       if (data.type === 'asr_result') {
         setLog((prev) => [...prev, `Received: ${data.data}`]);
-      } else if (data.type === 'suggested_response') {
+      } else if (data.type === 'suggested_response_partial' ||
+                 data.type === 'suggested_response') {
+        // ignore a suggestion for an utterance that has been followed by another
+        if (data.message_id != null) {
+          if (data.message_id < suggestionFor.current) return;
+          suggestionFor.current = data.message_id;
+        }
         setInputText(data.data);
       } else if (data.type === "initial_status") {
         setBehaviorMode(data.data.behavior_mode);
@@ -84,13 +93,9 @@ const WizardPage = () => {
         const locationList = data.data;
         setSavedLocations(locationList);
       } else if (data.type === "screenshot") {
-        setScreenshotData(
-          `data:image/jpeg;base64,${data.data}`
-        );
+        setScreenshotData(imageSrc(data));
       } else if (data.type === "snapshot") {
-        setSnapshotData(
-          `data:image/jpeg;base64,${data.data}`
-        );
+        setSnapshotData(imageSrc(data));
         setLastSnapshotTime(Date.now());
       } else if (data.type == "video_recording") {
         if (data.data === 'started') {
@@ -109,9 +114,19 @@ const WizardPage = () => {
         setNotification(`You're up! Tablet requested a ${data.data} from the robot. Go do it! Camera is activated for you already!`)
       }
     }
-    connectWebSocket(onWsMessage, "control");
+    const connection = connectWebSocket(onWsMessage, "control", { binary: true });
+    return () => connection.close();
   }, []);
 
+  // release blob: URLs of frames that have been replaced
+  useEffect(() => () => {
+    if (screenshotData?.startsWith("blob:")) URL.revokeObjectURL(screenshotData);
+  }, [screenshotData]);
+
+  useEffect(() => () => {
+    if (snapshotData?.startsWith("blob:")) URL.revokeObjectURL(snapshotData);
+  }, [snapshotData]);
+
   useGamepadControls(sendMessage, setPressedButtons);
 
   useEffect(() => {
@@ -1,10 +1,19 @@
 import html2canvas from 'html2canvas';
+import { sendFrameWS, sessionId } from './ws';
 
 export const getBackendUrl = () => {
   const { protocol, hostname } = window.location;
   return `${protocol}//${hostname}:8000`;
 };
 
+// adds this page's session to a backend URL
+export const withSession = (url) => {
+  const session = sessionId();
+  if (!session) return url;
+  const sep = url.includes("?") ? "&" : "?";
+  return `${url}${sep}session=${encodeURIComponent(session)}`;
+};
+
 
 export async function fetchZoomToken() {
   try {
@@ -25,9 +34,23 @@ export async function fetchZoomToken() {
 
 export const captureAndSend = async ( sendMessage ) => {
   const canvas = await html2canvas(document.body);
+  // raw JPEG in a binary frame; falls back to base64 JSON below
+  const blob = await new Promise((resolve) => canvas.toBlob(resolve, 'image/jpeg'));
+  if (blob && sendFrameWS({ type: "screenshot", content_type: "image/jpeg" }, blob)) {
+    return;
+  }
   const base64Image = canvas.toDataURL('image/jpeg');
   sendMessage({
     command: "screenshot",
     payload: base64Image.split(",")[1]  // Just the base64 part, like Android does
   });
-};
\ No newline at end of file
+};
+
+
+// <img> src for an image message, whether it came as a binary frame or
+// as base64 JSON
+export const imageSrc = (data) => (
+  data.blob
+    ? URL.createObjectURL(data.blob)
+    : `data:image/jpeg;base64,${data.data}`
+);
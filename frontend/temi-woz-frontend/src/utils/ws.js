@@ -1,41 +1,158 @@
-let socket;
-let reconnectTimeout = null;
+// the handle of the latest connectWebSocket call, which
+// sendMessageWS/sendFrameWS send on
+let current = null;
 
 
-export function connectWebSocket(onMessage, path) {
+// Binary frames (see backend/binary_frames.py):
+// uint16 header length | JSON header | raw payload bytes
+const decodeFrame = (buffer) => {
+  const headerLength = new DataView(buffer).getUint16(0);
+  const header = JSON.parse(
+    new TextDecoder().decode(new Uint8Array(buffer, 2, headerLength))
+  );
+  const blob = new Blob(
+    [new Uint8Array(buffer, 2 + headerLength)],
+    { type: header.content_type }
+  );
+  return { ...header, blob };
+};
+
+
+// ?session=<id> on the page picks the robot/household to talk to;
+// without it, the backend's default session is used
+export const sessionId = () =>
+  new URLSearchParams(window.location.search).get("session");
+
+
+// With `binary`, the server sends images as binary frames, which arrive
+// here as `{ type, id, content_type, blob }` instead of base64 `data`.
+// `onOpen` runs after every (re)connect, e.g. to re-subscribe.
+// Returns `{ send, sendFrame, close }` for this connection; each call
+// keeps its own socket and reconnects it until `close()`.
+export function connectWebSocket(onMessage, path, { binary = false, onOpen } = {}) {
+  let socket = null;
+  let reconnectTimeout = null;
+  let closed = false;
+  // Resume state (see WebSocketServer.resume in the backend), kept across
+  // this connection's reconnects: the token of the current socket and the
+  // last `seq` received on it, so a reconnect can pick up the messages it
+  // missed instead of reloading.
+  let resumeToken = null;
+  let lastSeq = 0;
+  let livenessTimeout = null;
+
+  const isOpen = () => socket && socket.readyState === WebSocket.OPEN;
+
+  const send = (message) => {
+    if (!isOpen()) {
+      console.warn("WebSocket not open");
+      return false;
+    }
+    socket.send(JSON.stringify(message));
+    return true;
+  };
+
+  const sendFrame = (header, blob) => {
+    if (!isOpen()) {
+      console.warn("WebSocket not open");
+      return false;
+    }
+    const headerBytes = new TextEncoder().encode(JSON.stringify(header));
+    const length = new Uint8Array(2);
+    new DataView(length.buffer).setUint16(0, headerBytes.length);
+    socket.send(new Blob([length, headerBytes, blob]));
+    return true;
+  };
+
+  const identify = () => send({ command: "identify", payload: "webpage" });
+
+  // the server pings every `heartbeat` seconds; if nothing at all
+  // arrives for a few of those, the connection is dead
+  const expectMessages = (ws, heartbeat) => {
+    clearTimeout(livenessTimeout);
+    livenessTimeout = setTimeout(() => ws.close(), heartbeat * 3000);
+  };
+
   const connect = () => {
     console.log("Connecting WebSocket...");
-    socket = new WebSocket(`wss://${window.location.hostname}:8000/${path}`);
+    const params = new URLSearchParams();
+    if (binary) params.set("binary", "1");
+    const resuming = resumeToken !== null;
+    params.set("resume", resuming ? resumeToken : "new");
+    if (resuming) params.set("seq", lastSeq);
+    const session = sessionId() ? `/${encodeURIComponent(sessionId())}` : "";
+    const ws = new WebSocket(`wss://${window.location.hostname}:8000/${path}${session}?${params}`);
+    ws.binaryType = "arraybuffer";
+    socket = ws;
+    let heartbeat = null;
 
-    socket.onopen = () => {
+    ws.onopen = () => {
       console.log("WebSocket connected");
-      socket.send(JSON.stringify({ command: "identify", payload: "webpage" }));
+      // when resuming, wait for `hello` to know whether that worked
+      if (!resuming) identify();
+      onOpen?.();
     };
 
-    socket.onmessage = (event) => {
-      const data = JSON.parse(event.data);
+    ws.onmessage = (event) => {
+      const data = event.data instanceof ArrayBuffer
+        ? decodeFrame(event.data)
+        : JSON.parse(event.data);
+      if (data.seq !== undefined) lastSeq = data.seq;
+      if (heartbeat) expectMessages(ws, heartbeat);
+      if (data.type === "ping") {
+        send({ command: "pong" });
+        return;
+      }
+      if (data.type === "hello") {
+        console.log("WebSocket hello:", data.data);
+        resumeToken = data.data.token;
+        heartbeat = data.data.heartbeat;
+        expectMessages(ws, heartbeat);
+        if (resuming && !data.data.resumed) identify();
+        return;
+      }
       console.log("Received:", data);
       onMessage?.(data);
     };
 
-    socket.onclose = () => {
+    ws.onclose = () => {
       console.warn("WebSocket closed");
-      reconnectTimeout = setTimeout(connect, 2000); // try again in 2s
+      clearTimeout(livenessTimeout);
+      if (!closed) reconnectTimeout = setTimeout(connect, 2000); // try again in 2s
     };
 
-    socket.onerror = (err) => {
+    ws.onerror = (err) => {
       console.error("WebSocket error:", err);
       // let onclose handle the reconnect
     };
   };
 
+  const close = () => {
+    closed = true;
+    clearTimeout(reconnectTimeout);
+    clearTimeout(livenessTimeout);
+    socket?.close();
+    if (current === handle) current = null;
+  };
+
+  const handle = { send, sendFrame, close };
+  current = handle;
   connect();
+  return handle;
 }
 
 export function sendMessageWS(message) {
-  if (socket && socket.readyState === WebSocket.OPEN) {
-    socket.send(JSON.stringify(message));
-  } else {
+  if (!current) {
+    console.warn("WebSocket not open");
+    return;
+  }
+  current.send(message);
+}
+
+export function sendFrameWS(header, blob) {
+  if (!current) {
     console.warn("WebSocket not open");
+    return false;
   }
+  return current.sendFrame(header, blob);
 }